@@ -0,0 +1,65 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Audio Store - ONE PCM DECODE PER SOURCE VERSION
+# -----------------------------------------------------------------------------
+import asyncio, hashlib, logging, os, time
+
+import metrics, supervisor
+
+SAMPLE_RATE = 16000
+# Raw float32 is exactly what Whisper consumes, so workers can hand memory-mapped views straight to the model.
+PCM_FORMAT = 'f32le'
+# A decode writes its .part file continuously, so one untouched for this long was left behind by a crash.
+PART_GRACE_SECONDS = 600
+
+class AudioStore:
+    """Decodes a source's audio once, to a 16 kHz mono float32 PCM file in `directory`. Transcription workers map that
+    file with numpy.memmap and slice their windows out of it, so they need no FFmpeg run and no copy of the audio.
+    File names are keyed by the source's path, size and mtime, so a replaced source is decoded again."""
+    def __init__(self, directory: str):
+        self.directory = directory; self._locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _key(self, source_path: str, stat) -> str:
+        return f"{hashlib.sha1(os.path.abspath(source_path).encode()).hexdigest()[:16]}-{stat.st_size}-{stat.st_mtime_ns}"
+
+    def path_for(self, source_path: str) -> str | None:
+        try: return os.path.join(self.directory, self._key(source_path, os.stat(source_path)) + ".f32")
+        except OSError: return None
+
+    async def get(self, source_path: str) -> str | None:
+        """Returns the PCM file for `source_path`, decoding it first if needed. None if the source has no decodable audio."""
+        pcm_path = self.path_for(source_path)
+        if pcm_path is None: return None
+        if os.path.exists(pcm_path): return pcm_path
+        async with self._locks.setdefault(pcm_path, asyncio.Lock()):
+            if os.path.exists(pcm_path): return pcm_path
+            temp_path = pcm_path + ".part"
+            with metrics.span('audio_extract'):
+                async with supervisor.SUPERVISOR.supervise('audio', 'ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', source_path, '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', PCM_FORMAT, temp_path,
+                                                           cleanup=[temp_path], stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE) as process:
+                    _, stderr = await process.communicate()
+            if process.returncode != 0 or not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+                logging.warning(f"⚠️ Could not extract audio from {os.path.basename(source_path)}: {stderr.decode('utf-8', errors='ignore').strip()[-300:]}")
+                if os.path.exists(temp_path): os.remove(temp_path)
+                return None
+            os.replace(temp_path, pcm_path); metrics.count('bytes_pcm_extracted', os.path.getsize(pcm_path))
+            logging.info(f"🔊 Extracted audio of {os.path.basename(source_path)} ({os.path.getsize(pcm_path) / 4 / SAMPLE_RATE:.0f}s of PCM).")
+            return pcm_path
+
+    def discard(self, source_path: str):
+        pcm_path = self.path_for(source_path)
+        if pcm_path and os.path.exists(pcm_path): os.remove(pcm_path)
+
+    def prune(self, source_paths) -> int:
+        """Deletes PCM files that belong to none of `source_paths` (e.g. sources that were finished or removed). A .part file
+        is only deleted once no decode is writing it: a reload prunes while the previous store's decodes may still run."""
+        keep = {os.path.basename(path) for path in (self.path_for(source) for source in source_paths) if path}; removed = 0
+        live = {os.path.basename(pcm_path) + ".part" for pcm_path, lock in self._locks.items() if lock.locked()}; cutoff = time.time() - PART_GRACE_SECONDS
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name in keep or name in live: continue
+            try:
+                if name.endswith(".part") and os.path.getmtime(path) > cutoff: continue
+                os.remove(path); removed += 1
+            except FileNotFoundError: pass  # A decode finished (or cleaned up) in the meantime.
+        return removed
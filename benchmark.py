@@ -0,0 +1,215 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Offline Benchmark Suite - MEDIA & SCHEDULING HOT PATHS
+# -----------------------------------------------------------------------------
+# Usage: python benchmark.py [--output results.json] [--baseline previous.json] [--threshold 0.25] [--strict]
+# Everything runs in a temporary folder against synthetic media made with FFmpeg's lavfi sources.
+# config.yaml, schedule.yaml, progress.db, the network, Discord and YouTube are never touched.
+# A benchmark whose tools are missing (FFmpeg, a cached Whisper model, ImageMagick) is recorded as skipped; a run that
+# fails is recorded as failed and makes the suite exit non-zero. With --strict, skipped benchmarks and benchmarks in the
+# baseline that did not run this time also fail the suite.
+import argparse, asyncio, json, logging, os, platform, random, shutil, statistics, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+
+import helpers, state_store, subtitles, utils
+
+# Speech-like audio: two formant-ish tones, amplitude-modulated at a syllable rate with pauses, over a little noise.
+SPEECH_LIKE_AUDIO = ("aevalsrc='(0.35*sin(2*PI*180*t)+0.2*sin(2*PI*720*t)+0.1*sin(2*PI*2400*t))*max(0,sin(2*PI*4*t))*gt(mod(t,3),0.6)"
+                     "+0.01*(random(0)-0.5)':s=44100")
+BURN_STYLE = {'fontsize': 80, 'color': 'yellow', 'stroke_color': 'black', 'stroke_width': 3}
+# Model names whose checkpoint file is named differently.
+WHISPER_CHECKPOINTS = {'large': 'large-v3', 'turbo': 'large-v3-turbo'}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ShortsBot offline benchmarks")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON results")
+    parser.add_argument('--baseline', help="Earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per benchmark; the median is reported")
+    parser.add_argument('--source-seconds', default="30,120", help="Synthetic source video lengths")
+    parser.add_argument('--library-sizes', default="100,1000,10000", help="Clip records in the state store benchmarks")
+    parser.add_argument('--schedule-sizes', default="21,168,1008", help="Upload slots per week in the schedule benchmarks")
+    parser.add_argument('--whisper-model', default="tiny", help="Skipped unless already in the Whisper cache; nothing is fetched")
+    parser.add_argument('--skip-media', action='store_true', help="Only run the scheduling and state store benchmarks")
+    parser.add_argument('--strict', action='store_true', help="Exit non-zero when a benchmark is skipped or a baseline benchmark is missing")
+    return parser.parse_args()
+
+def _csv_ints(value): return [int(v) for v in value.split(',') if v.strip()]
+
+class Recorder:
+    def __init__(self, repeat): self.repeat = max(1, repeat); self.results = {}; self.skipped = {}; self.failed = {}
+
+    def record(self, name, runs, per=1, unit='s'):
+        runs = [run / per for run in runs]
+        self.results[name] = {'median': statistics.median(runs), 'min': min(runs), 'runs': runs, 'unit': unit}
+        logging.info(f"⏱️ {name}: median {statistics.median(runs):.6f}{unit}")
+
+    def skip(self, name, reason): self.skipped[name] = reason; logging.warning(f"⏭️ {name}: skipped ({reason})")
+
+    def fail(self, name, reason): self.failed[name] = reason; logging.error(f"❌ {name}: failed ({reason})")
+
+    async def measure(self, name, run, setup=None, per=1):
+        """Times `run()` (sync or async) `repeat` times, calling `setup()` untimed before each run.
+        A run that returns False, or an async run that returns None, records the benchmark as failed."""
+        runs = []
+        for _ in range(self.repeat):
+            if setup: setup()
+            started = time.perf_counter(); outcome = run(); is_async = asyncio.iscoroutine(outcome)
+            if is_async: outcome = await outcome
+            elapsed = time.perf_counter() - started
+            if outcome is False or (is_async and outcome is None): return self.fail(name, "run returned no result")
+            runs.append(elapsed)
+        self.record(name, runs, per)
+
+# --- Synthetic media --------------------------------------------------------
+def make_source(path, seconds):
+    command = ['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', f"testsrc2=size=1280x720:rate=30:duration={seconds}", '-f', 'lavfi', '-t', str(seconds), '-i', SPEECH_LIKE_AUDIO,
+               '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest', path]
+    subprocess.run(command, check=True, capture_output=True)
+
+def synthetic_words(duration, step=0.5):
+    return [{'start': i * step, 'end': i * step + step * 0.8, 'word': f"word{i}"} for i in range(int(duration / step))]
+
+def imagemagick_available():
+    """MoviePy's TextClip needs ImageMagick: the configured binary, the IMAGEMAGICK_BINARY override, or one on PATH."""
+    configured = subtitles.IMAGEMAGICK_BINARY or os.environ.get('IMAGEMAGICK_BINARY')
+    return bool(configured and os.path.exists(configured)) or bool(shutil.which('magick') or shutil.which('convert'))
+
+def whisper_model_cached(name):
+    """True when whisper.load_model(name) would read the model from disk; otherwise it would download it."""
+    if os.path.isfile(name): return True
+    cache = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'whisper')
+    return os.path.isfile(os.path.join(cache, f"{WHISPER_CHECKPOINTS.get(name, name)}.pt"))
+
+def _remove(*paths):
+    for path in paths:
+        if path and os.path.exists(path): os.remove(path)
+
+async def bench_media(recorder, workdir, source_lengths, whisper_model):
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        for name in ('split_clip', 'split_batch', 'burn_ffmpeg', 'burn_moviepy', 'generate_subtitles'): recorder.skip(name, "ffmpeg/ffprobe not on PATH")
+        return
+    # Clips land in the temporary folder instead of processed_clips/.
+    utils.PROCESSED_CLIPS_DIR = os.path.join(workdir, "clips"); os.makedirs(utils.PROCESSED_CLIPS_DIR, exist_ok=True)
+    service = None; moviepy = imagemagick_available()
+    if not moviepy: recorder.skip('burn_moviepy', "ImageMagick not found")
+    if whisper_model and not whisper_model_cached(whisper_model): recorder.skip('generate_subtitles', f"Whisper model '{whisper_model}' is not downloaded"); whisper_model = None
+    for seconds in source_lengths:
+        source = os.path.join(workdir, f"source_{seconds}s.mp4"); make_source(source, seconds); tag = f"[source={seconds}s]"
+        clip_duration = min(20, seconds / 2); clip_path = utils.get_clip_output_path(source, 1)
+        await recorder.measure(f"split_clip{tag}", lambda: utils.split_video_into_clip_with_progress(source, 1, 5, clip_duration), setup=lambda: _remove(clip_path))
+        windows = [(n + 1, start, clip_duration) for n, start in enumerate(range(0, int(seconds - clip_duration) + 1, int(clip_duration - 2)))][:8]
+        batch_paths = [utils.get_clip_output_path(source, n) for n, _, _ in windows]
+        async def split_batch():
+            results = await utils.split_video_into_clips_batch(source, windows); return all(results.values()) or None
+        await recorder.measure(f"split_batch{tag}[clips={len(windows)}]", split_batch, setup=lambda: _remove(*batch_paths))
+        # Split once more so the burn and transcription benchmarks have a clip to work on.
+        _remove(clip_path); await utils.split_video_into_clip_with_progress(source, 1, 5, clip_duration)
+        ass_path = os.path.join(workdir, "bench.ass"); subtitles.write_ass(synthetic_words(clip_duration), ass_path, "Arial", BURN_STYLE)
+        fused_path = utils.get_clip_output_path(source, 1, subtitled=True); subtitle_filter = subtitles.ffmpeg_subtitle_filter(ass_path, utils.FONTS_DIR)
+        await recorder.measure(f"burn_ffmpeg{tag}", lambda: utils.split_video_into_clip_with_progress(source, 1, 5, clip_duration, subtitle_filter=subtitle_filter), setup=lambda: _remove(fused_path))
+        srt_path = os.path.join(workdir, "bench.srt"); subtitles.write_srt(synthetic_words(clip_duration), srt_path)
+        font_path = subtitles.resolve_font("Arial", utils.FONTS_DIR)
+        if moviepy: await recorder.measure(f"burn_moviepy{tag}", lambda: subtitles.burn_subtitles_into_video(clip_path, srt_path, font_path, BURN_STYLE), setup=lambda: _remove(fused_path))
+        if whisper_model:
+            if service is None:
+                service = subtitles.start_transcription_service(whisper_model, workers=1)
+                if not await service.wait_ready(): recorder.skip("generate_subtitles", f"Whisper model '{whisper_model}' could not be loaded offline"); whisper_model = None
+        if whisper_model: await recorder.measure(f"generate_subtitles{tag}", lambda: subtitles.generate_subtitles(clip_path))
+        _remove(clip_path, fused_path, ass_path, srt_path)
+    if service: service.stop()
+
+# --- Scheduling and state ------------------------------------------------------
+def write_schedule(path, slots_per_week):
+    per_day = max(1, slots_per_week // 7); minutes = [int(i * 1440 / per_day) for i in range(per_day)]
+    schedule = {day: [f"{m // 60:02}:{m % 60:02}" for m in minutes] for day in range(7)}
+    with open(path, 'w') as f: json.dump({'schedule': schedule}, f)  # JSON is valid YAML.
+
+async def bench_schedule(recorder, workdir, schedule_sizes, calls=5000):
+    for slots in schedule_sizes:
+        schedule_path = os.path.join(workdir, f"schedule_{slots}.yaml"); write_schedule(schedule_path, slots)
+        helpers.SCHEDULE_INDEX = helpers.ScheduleIndex(schedule_path)
+        rng = random.Random(slots); now = time.time(); lasts = [now + rng.uniform(0, 60 * 86400) for _ in range(calls)]
+        def run():
+            for last in lasts: helpers.get_next_schedule_time(last)
+        await recorder.measure(f"get_next_schedule_time[slots={slots}]", run, per=calls)
+
+def populate_store(store, clips, clips_per_source=50):
+    now = datetime.now(timezone.utc).timestamp()
+    with store.transaction():
+        for n in range(clips):
+            source = f"Source Video {n // clips_per_source}.mp4"
+            if n % clips_per_source == 0: store.add_source(source, 'completed', f"PL{n}")
+            status = 'uploaded' if n % 10 else 'pending_upload'
+            store.set_clip(source, f"Source Video {n // clips_per_source} part {n % clips_per_source + 1}.mp4",
+                           {'status': status, 'youtube_id': f"vid{n}" if status == 'uploaded' else None,
+                            'publish_at': datetime.fromtimestamp(now + n * 3600, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ') if status == 'uploaded' else None})
+
+async def bench_store(recorder, workdir, library_sizes, writes=200):
+    """The old save_progress rewrote all of progress.json on every change. The same workload is now a single-row
+    commit to the SQLite store, so that is what gets measured, along with the queries that replaced full scans."""
+    schedule_path = os.path.join(workdir, "schedule_store.yaml"); write_schedule(schedule_path, 21); helpers.SCHEDULE_INDEX = helpers.ScheduleIndex(schedule_path)
+    for clips in library_sizes:
+        db_path = os.path.join(workdir, f"progress_{clips}.db"); tag = f"[clips={clips}]"
+        store = state_store.ProgressStore(db_path)
+        started = time.perf_counter(); populate_store(store, clips); recorder.record(f"store_populate{tag}", [time.perf_counter() - started])
+        source = "Source Video 0.mp4"
+        def write_clips():
+            for n in range(writes): store.set_clip(source, f"Bench part {n}.mp4", {'status': 'pending_upload', 'created_at': datetime.now(timezone.utc).isoformat()})
+        await recorder.measure(f"save_progress{tag}", write_clips, per=writes)
+        await recorder.measure(f"pending_clip_scan{tag}", lambda: store.clips_with_status('pending_upload'))
+        now_iso = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        await recorder.measure(f"upcoming_uploads{tag}", lambda: store.upcoming_uploads(now_iso, 10))
+        await recorder.measure(f"reserve_schedule_slots{tag}", lambda: helpers.reserve_schedule_slots(store, 5) is not None)
+        store.close()
+
+# --- Reporting -----------------------------------------------------------------
+def compare(results, baseline, threshold):
+    """Returns (name, baseline median, current median) for every benchmark that got slower than the threshold allows."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous and result['median'] > previous['median'] * (1 + threshold): regressions.append((name, previous['median'], result['median']))
+    return regressions
+
+def missing(results, baseline):
+    """Benchmarks the baseline has results for that produced none this time."""
+    return sorted(set(baseline.get('results', {})) - set(results))
+
+def environment():
+    try: ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError): ffmpeg = None
+    try: revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=utils.ROOT_DIR).stdout.strip() or None
+    except OSError: revision = None
+    return {'timestamp': datetime.now(timezone.utc).isoformat(), 'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'ffmpeg': ffmpeg, 'git_revision': revision}
+
+async def run(args):
+    recorder = Recorder(args.repeat); workdir = tempfile.mkdtemp(prefix="shortsbot-bench-")
+    try:
+        await bench_schedule(recorder, workdir, _csv_ints(args.schedule_sizes))
+        await bench_store(recorder, workdir, _csv_ints(args.library_sizes))
+        if not args.skip_media: await bench_media(recorder, workdir, _csv_ints(args.source_seconds), args.whisper_model)
+    finally: shutil.rmtree(workdir, ignore_errors=True)
+    return recorder
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s"); args = parse_args()
+    recorder = asyncio.run(run(args))
+    report = {'environment': environment(), 'threshold': args.threshold, 'results': recorder.results, 'skipped': recorder.skipped, 'failed': recorder.failed}
+    regressions = []; absent = []
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)
+        regressions = compare(recorder.results, baseline, args.threshold); absent = missing(recorder.results, baseline); report['missing'] = absent
+    with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+    logging.info(f"📄 Results written to {args.output}")
+    for name, before, after in regressions: logging.error(f"🐢 Regression: {name} {before:.6f}s -> {after:.6f}s ({(after / before - 1) * 100:+.0f}%)")
+    # A benchmark that did not run cannot show a regression, so it is never reported as passing.
+    log_gap = logging.error if args.strict else logging.warning
+    # Skips and failures are recorded under the benchmark's base name, results under the tagged one.
+    def why(name): return next((reason for base, reason in {**recorder.skipped, **recorder.failed}.items() if name.split('[')[0] == base.split('[')[0]), 'not run')
+    for name in absent: log_gap(f"❔ {name}: in the baseline but not measured this time ({why(name)})")
+    if recorder.skipped: log_gap(f"⏭️ {len(recorder.skipped)} benchmarks were skipped: {', '.join(sorted(recorder.skipped))}")
+    if regressions or recorder.failed or (args.strict and (absent or recorder.skipped)):
+        logging.error(f"❌ Benchmarks failed: {len(regressions)} regressions, {len(recorder.failed)} failed runs, {len(recorder.skipped)} skipped, {len(absent)} missing."); sys.exit(1)
+    if args.baseline: logging.info(f"✅ No benchmark slowed down by more than {args.threshold:.0%}.")
+
+if __name__ == "__main__": main()
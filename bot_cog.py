@@ -7,8 +7,14 @@ from datetime import datetime, timezone
 import os
 import discord
 from discord.ext import commands, tasks
-import utils, subtitles, helpers
+import utils, subtitles, helpers, metrics, quota, supervisor
 from workflows import WorkflowManager
+from watcher import FolderWatcher
+from media_cache import MediaProbeCache
+from encoding_policy import EncodingPolicy
+from leasing import LeaseManager
+from fingerprint import SourceRegistry
+from disk_budget import DiskBudget
 
 async def is_in_correct_channel(ctx):
     cog = ctx.bot.get_cog('BotCog');
@@ -18,11 +24,21 @@ async def is_in_correct_channel(ctx):
 class BotCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot; self.is_manual_processing_running = False; self.is_waiting_for_user_response = False
-        self.cog_is_ready = False; self.youtube = None; self.config = None; self.progress = None
-        self.session_ignore_list = set(); self.workflows = None
+        self.cog_is_ready = False; self.youtube = None; self.config = None; self.store = None; self.quota = None; self.encoding = None
+        self.session_ignore_list = set(); self.workflows = None; self.watcher = None; self.media = None; self.metrics_server = None; self.leases = None; self.is_standby = False; self.sources = None; self.disk = None
+        self.warmup = {}; self.warmup_tasks = {}; self.startup_timings = []; self._startup_task = None
     def is_ready(self): return self.cog_is_ready
     def cog_unload(self):
         if self.main_processing_loop.is_running(): self.main_processing_loop.cancel()
+        if self._startup_task and not self._startup_task.done(): self._startup_task.cancel()
+        # Reloads and shutdowns must not leave encodes running behind the new cog; Whisper workers are kept across reloads.
+        if self.workflows: self.workflows.stop_rendering()
+        supervisor.SUPERVISOR.kill_all(stages=('split', 'audio'))
+        if self.watcher: self.watcher.stop()
+        if self.metrics_server: self.metrics_server.close()
+        if self.quota: self.quota.flush(force=True)
+        if self.leases: self.leases.stop()
+        if self.store: self.store.close()
         self.cog_is_ready = False
     
     @commands.Cog.listener()
@@ -31,31 +47,100 @@ class BotCog(commands.Cog):
         await self.setup_cog()
 
     async def setup_cog(self):
+        """Light setup only: everything here finishes in well under a second. The YouTube client and the Whisper workers
+        warm up in background tasks; self.warmup says how far along each is."""
+        setup_started = time.perf_counter(); first_start = not getattr(self.bot, 'startup_reported', False)
+        self.startup_timings = [("Launch + Discord handshake", setup_started - self.bot.launch_time)] if first_start and hasattr(self.bot, 'launch_time') else []
+        phase_started = setup_started
+        def lap(phase):
+            nonlocal phase_started; now = time.perf_counter(); self.startup_timings.append((phase, now - phase_started)); phase_started = now
         self.cog_is_ready = False; utils.setup_folders(); utils.setup_logger(); logging.info("⚙️ Performing cog setup...")
         self.config = utils.load_config()
         if not self.config: logging.critical("Config could not be loaded."); return
-        self.workflows = WorkflowManager(self.bot, self)
+        # Cluster mode: shared folders and database live under cluster.shared_root, and this node competes for the coordinator lease.
+        clustered = bool(self.config.get('cluster', {}).get('enabled')); shared_root = utils.configure_cluster(self.config)
+        if shared_root: utils.setup_folders()
+        self.workflows = WorkflowManager(self.bot, self); supervisor.SUPERVISOR.configure(self.config); lap("Config")
+        metrics_config = self.config.get('metrics', {})
+        metrics.METRICS.configure(metrics_config.get('window_size', 2048), metrics_config.get('trace_file') or None)
+        if metrics_config.get('port') and not self.metrics_server:
+            try: self.metrics_server = await metrics.start_http_server(metrics_config['port'])
+            except OSError as e: logging.error(f"❌ Could not serve metrics on port {metrics_config['port']}: {e}")
         channel = self.bot.get_channel(int(self.config['bot']['channel_id']))
         is_online_mode = self.config['youtube'].get('youtube_online_mode', True)
         startup_message = await channel.send(f"🤖 **Initializing ({'Online' if is_online_mode else 'Offline'})...**") if channel else None
-        if self.config.get('subtitles', {}).get('enabled'):
-            if 'imagemagick_path' in self.config['subtitles']: subtitles.configure_moviepy(self.config['subtitles']['imagemagick_path'])
-            subtitles.load_whisper_model(self.config['subtitles']['whisper_model'])
-        if is_online_mode:
-            self.progress = utils.load_progress(); self.youtube = await asyncio.to_thread(helpers.get_youtube_service, self.config)
-            if self.youtube:
-                if startup_message: await startup_message.edit(content="✅ **ShortsBot is ONLINE and ready!**")
-                await self.bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="for work..."))
-            else:
-                if startup_message: await startup_message.edit(content="❌ **CRITICAL ERROR:** Could not connect to YouTube.")
-        else:
-            self.progress = {"source_videos": {}, "last_scheduled_time": None, "quota_tracker": {}}
-            self.youtube = None;
-            if startup_message: await startup_message.edit(content="✅ **ShortsBot is in OFFLINE mode.**")
-            await self.bot.change_presence(activity=discord.Game(name="in Offline Mode"))
+        self.store = utils.open_progress_store(persistent=is_online_mode or clustered, wal=not shared_root)
+        self.media = MediaProbeCache(self.store); self.store.prune_probes(); self.sources = SourceRegistry(self.store, self.media)
+        self.leases = LeaseManager.from_config(self.config, self.store, 'coordinator')
+        if self.leases: self.leases.start()
+        self.quota = quota.QuotaLedger.from_config(self.config, self.store); self.encoding = EncodingPolicy.from_config(self.config, self.store, self.leases.node_id if self.leases else None); lap("State store")
+        # An in-memory (offline) store has no records, so every file would look orphaned; offline clips are left alone.
+        self.disk = DiskBudget.from_config(self.config).enable()
+        if is_online_mode or clustered: self.disk.clean_orphans(self.store, shared=clustered)
+        lap("Storage cleanup")
+        self.warmup = {}; self.warmup_tasks = {}
+        service = self.configure_subtitles()
+        if service: self._start_warmup('whisper', f"Whisper '{self.config['subtitles']['whisper_model']}'", self._warm_whisper(service))
+        if is_online_mode: self._start_warmup('youtube', "YouTube client", self._warm_youtube())
+        else: self.youtube = None
+        watcher_config = self.config.get('watcher', {})
+        if self.watcher: self.watcher.stop()
+        self.watcher = FolderWatcher([utils.INPUT_VIDEOS_DIR, utils.FAILED_UPLOADS_DIR], watcher_config.get('settle_seconds', 3), watcher_config.get('poll_interval_seconds', 10)).start(); lap("Folder watcher")
+        if startup_message:
+            warming = ", ".join(name for name in self.warmup if self.warmup[name] == 'warming')
+            await startup_message.edit(content=f"✅ **ShortsBot is {'ONLINE' if is_online_mode else 'in OFFLINE mode'} and ready!**" + (f" (warming up: {warming})" if warming else ""))
+        await self.bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="for work...") if is_online_mode else discord.Game(name="in Offline Mode"))
         if not self.main_processing_loop.is_running(): self.main_processing_loop.start()
-        self.cog_is_ready = True; logging.info("✅ Cog setup complete.")
-        
+        self.cog_is_ready = True; lap("Ready message"); logging.info(f"✅ Cog setup complete in {time.perf_counter() - setup_started:.2f}s.")
+        # Kept on the cog: the event loop only holds a weak reference to a task.
+        self._startup_task = asyncio.create_task(self._report_startup(first_start))
+
+    def configure_subtitles(self):
+        """Sets up MoviePy, the caption cache, the audio store and the Whisper workers. Returns the transcription service, or None when subtitles are off."""
+        subtitle_config = self.config.get('subtitles', {})
+        if not subtitle_config.get('enabled'): return None
+        if 'imagemagick_path' in subtitle_config: subtitles.configure_moviepy(subtitle_config['imagemagick_path'])
+        subtitles.configure_caption_cache(subtitle_config.get('caption_cache_mb', 256))
+        service = subtitles.start_transcription_service(subtitle_config['whisper_model'], subtitle_config.get('whisper_workers', 1), subtitle_config.get('whisper_threads', 0),
+                                                        subtitle_config.get('whisper_batch_size', 4), subtitle_config.get('whisper_max_memory_mb', 0), subtitle_config.get('vad_margin_db', 12))
+        audio_store = subtitles.configure_audio_store(utils.AUDIO_CACHE_DIR if subtitle_config.get('audio_cache', True) else None)
+        if audio_store: audio_store.prune(os.path.join(utils.INPUT_VIDEOS_DIR, name) for name in os.listdir(utils.INPUT_VIDEOS_DIR))
+        return service
+
+    # --- Background warm-up -------------------------------------------------
+    def _start_warmup(self, name, label, coroutine):
+        self.warmup[name] = 'warming'; started = time.perf_counter()
+        async def run():
+            try: ok = await coroutine
+            except Exception as e: logging.error(f"💥 {label} warm-up failed: {e}", exc_info=True); ok = False
+            self.warmup[name] = 'ready' if ok else 'failed'; self.startup_timings.append((f"{label} (background)", time.perf_counter() - started))
+            return ok
+        self.warmup_tasks[name] = asyncio.create_task(run())
+
+    async def wait_for_warmup(self, name) -> bool:
+        """True once `name` has warmed up successfully; False if it failed or was never started."""
+        task = self.warmup_tasks.get(name)
+        return await asyncio.shield(task) if task else False
+
+    async def _warm_youtube(self):
+        # The client survives !reload on the bot object, so reloads do not redo the OAuth and discovery round trips.
+        self.youtube = getattr(self.bot, 'youtube_service', None) or await asyncio.to_thread(helpers.get_youtube_service, self.config)
+        self.bot.youtube_service = self.youtube
+        if not self.youtube:
+            channel = self.bot.get_channel(int(self.config['bot']['channel_id']))
+            if channel: await channel.send("❌ **CRITICAL ERROR:** Could not connect to YouTube.")
+        return bool(self.youtube)
+
+    async def _warm_whisper(self, service): return await service.wait_ready()
+
+    async def _report_startup(self, first_start):
+        await asyncio.gather(*self.warmup_tasks.values(), return_exceptions=True)
+        report = " · ".join(f"{phase} {seconds:.1f}s" for phase, seconds in self.startup_timings)
+        logging.info(f"⏱️ Startup timings: {report}")
+        channel = self.bot.get_channel(int(self.config['bot']['channel_id']))
+        if channel and first_start: await channel.send(f"⏱️ **Startup:** {report}")
+        self.bot.startup_reported = True
+
     @commands.command(name="start")
     @commands.check(is_in_correct_channel)
     async def start_processing(self, ctx):
@@ -64,16 +149,30 @@ class BotCog(commands.Cog):
         self.main_processing_loop.restart()
         await ctx.send("✅ **Manual Start:** Checking for new videos to process...")
     
-    @tasks.loop(minutes=5)
+    @tasks.loop(seconds=0)
     async def main_processing_loop(self):
-        if self.is_waiting_for_user_response: return
-        self.is_waiting_for_user_response = True
-        try:
-            await self.workflows.run_autonomous_workflow(process_new=self.is_manual_processing_running)
-        except Exception as e: logging.error(f"💥 Main loop error: {e}", exc_info=True)
-        finally:
-            self.is_waiting_for_user_response = False
-            self.is_manual_processing_running = False
+        standby = bool(self.leases) and not await self.leases.claim_coordinator()
+        if standby != self.is_standby:
+            self.is_standby = standby; logging.info("🛰️ Another node holds the coordinator lease; this bot stays on standby." if standby else "🛰️ This node is now the cluster coordinator.")
+            # The previous coordinator kept its own quota totals; start from what it last wrote.
+            if not standby: self.quota = quota.QuotaLedger.from_config(self.config, self.store)
+        if not standby and not self.is_waiting_for_user_response:
+            self.is_waiting_for_user_response = True
+            try:
+                await self.workflows.run_autonomous_workflow(process_new=self.is_manual_processing_running)
+            except Exception as e: logging.error(f"💥 Main loop error: {e}", exc_info=True)
+            finally:
+                self.is_waiting_for_user_response = False
+                self.is_manual_processing_running = False
+        # Sleep until the watcher sees a finished file; the idle timeout still re-checks parked and failed uploads.
+        watcher_config = self.config.get('watcher', {})
+        # Also wake right after the quota reset so deferred uploads start as soon as they are admitted.
+        idle_timeout = watcher_config.get('idle_recheck_minutes', 5) * 60
+        if self.quota: idle_timeout = min(idle_timeout, self.quota.seconds_until_reset() + 5)
+        # Render nodes add clips without touching the watched folders (and network filesystems send no events), so poll too.
+        if self.leases: idle_timeout = min(idle_timeout, self.config['cluster'].get('poll_seconds', 15))
+        arrivals = await self.watcher.wait_for_changes(idle_timeout)
+        if utils.INPUT_VIDEOS_DIR in arrivals and watcher_config.get('auto_process_new', True): self.is_manual_processing_running = True
 
     @main_processing_loop.before_loop
     async def before_main_loop(self): await self.bot.wait_until_ready()
@@ -83,41 +182,68 @@ class BotCog(commands.Cog):
     @commands.check(is_in_correct_channel)
     async def status(self, ctx):
         online_status = "🟢 ONLINE" if self.config['youtube'].get('youtube_online_mode') else "⚪ OFFLINE"; processing_status = "▶️ ACTIVE" if self.is_manual_processing_running or self.is_waiting_for_user_response else "⏹️ IDLE"
-        status_message = f"**Mode:** `{online_status}` | **Status:** `{processing_status}`"
+        status_message = f"**Mode:** `{online_status}` | **Status:** `{processing_status}` | **Watcher:** `{self.watcher.mode if self.watcher else 'off'}`"
+        if self.encoding: status_message += f"\n**Encoding:** preset `{self.encoding.current[0]}`, CRF `{self.encoding.current[1]}`"
+        running = supervisor.SUPERVISOR.running()
+        if running: status_message += "\n**Child processes:** " + " | ".join(f"{stage} `{count}`" for stage, count in sorted(running.items()))
+        if self.disk: status_message += f"\n**Storage:** {self.disk.describe()}"
+        if self.leases: status_message += f"\n**Cluster{' (standby)' if self.is_standby else ''}:** " + " | ".join(f"`{node}` {role} ({age:.0f}s ago)" for node, role, age in await self.leases.nodes())
+        if self.warmup: status_message += "\n**Warm-up:** " + " | ".join(f"{name} `{state}`" for name, state in self.warmup.items())
         await ctx.send(f"**ShortsBot Status:**\n{status_message}")
+    @commands.command(name="metrics")
+    @commands.check(is_in_correct_channel)
+    async def metrics_report(self, ctx):
+        stages = metrics.METRICS.stages()
+        if not stages: await ctx.send("📈 No metrics recorded yet."); return
+        def fmt(window):
+            n, p50, p95 = metrics.METRICS.percentiles(stage, window)
+            return f"`{p50:.2f}s / {p95:.2f}s` ({n})" if n else "`-`"
+        embed = discord.Embed(title="📈 Stage Timings (p50 / p95)", color=discord.Color.blue())
+        for stage in stages[:24]: embed.add_field(name=stage, value=f"5m {fmt(300)}\n1h {fmt(3600)}", inline=True)
+        counters = metrics.METRICS.counters; gauges = metrics.METRICS.gauges
+        footer = [f"{name} {value / 1048576:.1f} MB" if name.startswith('bytes_') else f"{name} {value:g}" for name, value in sorted(counters.items())]
+        footer += [f"{name} {value:g}" for name, value in sorted(gauges.items())]
+        if footer: embed.set_footer(text=" · ".join(footer)[:2048])
+        await ctx.send(embed=embed)
     @commands.command(name="stop")
     @commands.check(is_in_correct_channel)
     async def stop_processing(self, ctx):
         if not (self.is_manual_processing_running or self.is_waiting_for_user_response): await ctx.send("⚠️ Bot is already idle.")
         else:
-            self.is_manual_processing_running = False
-            await ctx.send("✅ **Processing stopped!** Bot will finish its current action and return to idle.")
+            self.is_manual_processing_running = False; stopped = self.workflows.stop_rendering()
+            await ctx.send("✅ **Processing stopped!** " + ("Running encodes were cancelled; unfinished clips resume on the next run." if stopped else "Bot will finish its current action and return to idle."))
     @commands.command(name="end")
     @commands.check(is_in_correct_channel)
     async def end_bot(self, ctx): await self.bot.close()
     @commands.command(name="quota")
     @commands.check(is_in_correct_channel)
-    async def quota(self, ctx):
+    async def quota_status(self, ctx):
         if not self.config['youtube'].get('youtube_online_mode'): await ctx.send("⚪ Bot is in offline mode."); return
-        total_limit = self.config['youtube']['daily_quota_limit']; today_utc_str = datetime.now(timezone.utc).strftime('%Y-%m-%d'); quota_data = self.progress.get('quota_tracker', {}); spent_today = 0
-        if quota_data.get('date') == today_utc_str: spent_today = quota_data.get('spent', 0)
-        remaining = total_limit - spent_today; embed = discord.Embed(title="📊 YouTube API Quota Status", color=discord.Color.blue()); embed.add_field(name="Daily Limit", value=f"`{total_limit:,}` units", inline=False); embed.add_field(name="Spent Today (Estimated)", value=f"`{spent_today:,}` units", inline=False); embed.add_field(name="Remaining (Estimated)", value=f"`{remaining:,}` units", inline=False)
-        embed.set_footer(text="This is an estimate. Quota resets daily at midnight PST."); await ctx.send(embed=embed)
+        ledger = self.quota; remaining = ledger.remaining(); reset_at = quota.next_reset()
+        embed = discord.Embed(title="📊 YouTube API Quota Status", color=discord.Color.blue()); embed.add_field(name="Daily Limit", value=f"`{ledger.daily_limit:,}` units", inline=False)
+        embed.add_field(name=f"Spent Today ({ledger.day}, Pacific)", value=f"`{ledger.spent:,}` units, `{ledger.uploads}` uploads" + (f" (`{ledger.reserved_units:,}` reserved)" if ledger.reserved_units else ""), inline=False)
+        embed.add_field(name="Remaining (Estimated)", value=f"`{remaining:,}` units, room for `{ledger.upload_capacity()}` more uploads", inline=False)
+        pending = len(self.store.clips_with_status('pending_upload'))
+        if pending:
+            slots = helpers.upcoming_schedule_slots(self.store, pending)
+            lines = []
+            for day in ledger.plan(pending, slots)[:7]:
+                publish = f" → publish {datetime.fromtimestamp(day['first_slot'], tz=timezone.utc).strftime('%b %d %H:%M')} - {datetime.fromtimestamp(day['last_slot'], tz=timezone.utc).strftime('%b %d %H:%M')}" if day['first_slot'] else ""
+                lines.append(f"`{day['day']}`: **{day['uploads']}** uploads{publish}")
+            embed.add_field(name=f"Upload Plan ({pending} pending)", value="\n".join(lines) or "No uploads fit within the next two weeks.", inline=False)
+        embed.set_footer(text=f"This is an estimate. Quota resets at midnight Pacific ({reset_at.strftime('%H:%M')} UTC)."); await ctx.send(embed=embed)
     @commands.command(name="schedule")
     @commands.check(is_in_correct_channel)
     async def schedule(self, ctx):
         if not self.config['youtube'].get('youtube_online_mode'): await ctx.send("⚪ Bot is in offline mode."); return
-        scheduled_videos = []; now_utc = datetime.now(timezone.utc)
-        for source_video, data in self.progress.get('source_videos', {}).items():
-            for clip_filename, clip_data in data.get('clips', {}).items():
-                if clip_data.get('status') == 'uploaded' and 'publish_at' in clip_data:
-                    publish_time = datetime.fromisoformat(clip_data['publish_at'].replace('Z', '+00:00'))
-                    if publish_time > now_utc: scheduled_videos.append((publish_time, clip_filename, clip_data['youtube_id']))
+        now_utc_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        total_scheduled, upcoming = self.store.upcoming_uploads(now_utc_str, limit=10)
+        scheduled_videos = [(datetime.fromisoformat(publish_at.replace('Z', '+00:00')), clip_filename, video_id) for publish_at, clip_filename, video_id in upcoming]
         if not scheduled_videos: await ctx.send("🗓️ No videos currently scheduled."); return
-        scheduled_videos.sort(key=lambda x: x[0]); embed = discord.Embed(title="🗓️ Upcoming Video Schedule", color=discord.Color.green()); description = ""
+        embed = discord.Embed(title="🗓️ Upcoming Video Schedule", color=discord.Color.green()); description = ""
         for publish_time, clip_filename, video_id in scheduled_videos[:10]:
             display_time = publish_time.strftime('%b %d, %Y at %I:%M %p (UTC)'); base_title = Path(clip_filename).stem.replace('_', ' ').title(); video_url = f"https://www.youtube.com/watch?v={video_id}"; description += f"**[{base_title}]({video_url})**\n> {display_time}\n"
-        embed.description = description; embed.set_footer(text=f"Showing {len(scheduled_videos)} upcoming videos."); await ctx.send(embed=embed)
+        embed.description = description; embed.set_footer(text=f"Showing {total_scheduled} upcoming videos."); await ctx.send(embed=embed)
     @commands.command(name="preview")
     @commands.check(is_in_correct_channel)
     async def preview(self, ctx, *, video_name: str = None):
@@ -133,17 +259,9 @@ class BotCog(commands.Cog):
             preview_text += f"**Part {i+1}:** `{start_time_str}` - `{end_time_str}`\n"
             if i >= 14: preview_text += f"\n...and {total_clips - 15} more."; break
         embed.add_field(name="Clip Timestamps", value=preview_text, inline=False); await ctx.send(embed=embed)
-    async def _log_quota_usage(self, action: str):
-        if not self.config['youtube'].get('youtube_online_mode'): return
-        cost = self.config['youtube']['api_costs'].get(action, 0);
-        if cost == 0: return
-        today_utc = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        if 'quota_tracker' not in self.progress or self.progress['quota_tracker'].get('date') != today_utc:
-            self.progress['quota_tracker'] = {'date': today_utc, 'spent': 0, 'uploads_today': 0}
-        self.progress['quota_tracker']['spent'] += cost
-        if action == 'upload': self.progress['quota_tracker']['uploads_today'] = self.progress['quota_tracker'].get('uploads_today', 0) + 1
-        total_spent = self.progress['quota_tracker']['spent']; total_limit = self.config['youtube']['daily_quota_limit']; remaining = total_limit - total_spent
+    async def _post_quota_notice(self, force: bool = False):
+        """Posts the ledger's batched quota summary when one is due."""
+        notice = self.quota.take_notice(force) if self.quota else None
         channel = self.bot.get_channel(int(self.config['bot']['channel_id']))
-        if channel: await channel.send(f"📊 Quota Update: `{action}` cost **{cost}**. Est. usage: **{total_spent:,} / {total_limit:,}** (`{remaining:,}` remaining).")
-        utils.save_progress(self.progress)
+        if notice and channel: await channel.send(notice)
 async def setup(bot): await bot.add_cog(BotCog(bot))
\ No newline at end of file
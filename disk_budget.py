@@ -0,0 +1,135 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Disk Budget - RAM STAGING, RENDER THROTTLING AND ORPHAN CLEANUP
+# -----------------------------------------------------------------------------
+import asyncio, logging, os, shutil, time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import utils
+
+MB = 1024 * 1024
+# Until a clip has been measured: about 8 Mbit/s, the size of a 1080x1920 x264 clip at the default CRF.
+DEFAULT_BYTES_PER_SECOND = 1 * MB
+ESTIMATE_MARGIN = 1.25
+# In cluster mode other nodes may be writing into the shared processed_clips, so only files this old count as orphans.
+CLUSTER_ORPHAN_AGE_SECONDS = 3600
+
+class DiskBudget:
+    """Keeps rendering inside a storage budget. With a staging folder (e.g. on /dev/shm) clips are rendered there and
+    uploaded straight from memory, so a clip that goes out on the same run never touches the disk. Clips that have
+    to wait (no quota, offline, render nodes) are spilled to processed_clips so they outlive a reboot. Before an encode
+    starts, room() reserves the clip's estimated size and waits while the staging folder would exceed its cap or free
+    disk space is below the minimum. At least one encode is always let through the staging cap, so the pipeline never
+    deadlocks on clips it has itself staged."""
+    def __init__(self, staging_dir=None, staging_bytes=0, min_free_bytes=0, poll_seconds=2.0):
+        self.staging_dir = staging_dir; self.staging_bytes = staging_bytes; self.min_free_bytes = min_free_bytes; self.poll_seconds = poll_seconds
+        self.in_flight = 0; self.bytes_per_second = DEFAULT_BYTES_PER_SECOND; self.waits = 0
+
+    @classmethod
+    def from_config(cls, config):
+        storage = config.get('storage', {}); staging_dir = storage.get('staging_dir') or None; staging_bytes = 0
+        if staging_dir:
+            try:
+                os.makedirs(staging_dir, exist_ok=True)
+                # The cap can never be more than the staging filesystem (a tmpfs is usually half the RAM) actually holds.
+                staging_bytes = min(int(storage.get('staging_max_mb', 2048) * MB), shutil.disk_usage(staging_dir).free + _folder_bytes(staging_dir))
+            except OSError as e: logging.error(f"❌ Staging folder {staging_dir} is unusable ({e}); clips are rendered to processed_clips."); staging_dir = None
+        return cls(staging_dir, staging_bytes, int(storage.get('min_free_disk_mb', 2048) * MB), storage.get('poll_seconds', 2))
+
+    def enable(self):
+        """Points clip output at the staging folder (or back at processed_clips when there is none)."""
+        utils.CLIP_STAGING_DIR = self.staging_dir
+        if self.staging_dir: logging.info(f"💾 Rendering clips in {self.staging_dir} (cap {self.staging_bytes / MB:.0f} MB) and uploading them from memory.")
+        return self
+
+    # --- Accounting ------------------------------------------------------------
+    def staged_bytes(self) -> int: return _folder_bytes(self.staging_dir) if self.staging_dir else 0
+
+    def free_bytes(self) -> int:
+        try: return shutil.disk_usage(utils.PROCESSED_CLIPS_DIR).free
+        except OSError: return 0
+
+    def record(self, nbytes: int, media_seconds: float):
+        """Learns the bytes per second of rendered clips from a finished one."""
+        if nbytes > 0 and media_seconds > 0: self.bytes_per_second = 0.8 * self.bytes_per_second + 0.2 * nbytes / media_seconds
+
+    def clip_estimate(self, clip_seconds: float) -> int: return int(clip_seconds * self.bytes_per_second * ESTIMATE_MARGIN)
+
+    def shortage(self, nbytes: int) -> str | None:
+        """Why `nbytes` more would not fit right now, or None when it does."""
+        if self.staging_dir and self.in_flight:
+            staged = self.staged_bytes()
+            if staged + self.in_flight + nbytes > self.staging_bytes: return f"staging {staged / MB:.0f}/{self.staging_bytes / MB:.0f} MB"
+        if self.min_free_bytes:
+            # Encodes to processed_clips have not written their full size yet.
+            free = self.free_bytes() - (0 if self.staging_dir else self.in_flight + nbytes)
+            if free < self.min_free_bytes: return f"{max(0, free) / MB:.0f} MB free on disk"
+        return None
+
+    @asynccontextmanager
+    async def room(self, clips: int, clip_seconds: float, reporter=None):
+        """Reserves room for `clips` clip encodes for the length of the block, waiting until they fit."""
+        nbytes = clips * self.clip_estimate(clip_seconds); reason = self.shortage(nbytes) if clips else None
+        if reason:
+            self.waits += 1; logging.warning(f"⏸️ Rendering paused for storage: {reason}.")
+            while reason:
+                if reporter: reporter.report('storage', f"⏸️ Waiting for storage ({reason})...")
+                await asyncio.sleep(self.poll_seconds); reason = self.shortage(nbytes)
+            if reporter: reporter.remove('storage')
+        self.in_flight += nbytes
+        try: yield
+        finally: self.in_flight -= nbytes
+
+    # --- Staging -----------------------------------------------------------------
+    def spill(self, path: str) -> str:
+        """Moves a staged file to processed_clips, where it survives a reboot. Returns its new path."""
+        if not utils.is_staged(path) or not os.path.exists(path): return path
+        destination = os.path.join(utils.PROCESSED_CLIPS_DIR, os.path.basename(path)); shutil.move(path, destination)
+        return destination
+
+    def spill_all(self, prefix: str = '') -> int:
+        """Spills the staged files whose names start with `prefix`, e.g. when a pipeline ends with clips it did not upload."""
+        if not utils.CLIP_STAGING_DIR or not os.path.isdir(utils.CLIP_STAGING_DIR): return 0
+        names = [entry.name for entry in os.scandir(utils.CLIP_STAGING_DIR) if entry.is_file() and entry.name.startswith(prefix)]
+        for name in names: self.spill(os.path.join(utils.CLIP_STAGING_DIR, name))
+        return len(names)
+
+    # --- Startup cleanup -------------------------------------------------------------
+    def clean_orphans(self, store, shared=False) -> dict:
+        """Removes intermediates no clip record points to: partial encodes left by a crash, stray .ass/.srt tracks and
+        clips whose record is gone. Staged files a record still needs are spilled to disk. Clips left 'pending_upload'
+        without a file (a staging folder lost on reboot) go back to rendering, as long as their source is still in
+        input_videos. `shared` (cluster mode) only touches files that have not changed for an hour and leaves lost
+        clips alone, since other nodes may still be writing or staging them."""
+        live = {}
+        for status in ('rendering', 'pending_upload'):
+            for source, name, record in store.clips_with_status(status): live[name] = (source, status, record)
+        keep = set(live) | {os.path.basename(record['srt_path']) for _, _, record in live.values() if record.get('srt_path')}
+        cutoff = time.time() - (CLUSTER_ORPHAN_AGE_SECONDS if shared else 0); summary = {'removed': 0, 'bytes': 0, 'spilled': 0, 'rerender': 0}
+        if self.staging_dir and os.path.isdir(self.staging_dir):
+            for entry in os.scandir(self.staging_dir):
+                if not entry.is_file(): continue
+                if entry.name in keep: self.spill(entry.path); summary['spilled'] += 1
+                else: summary['bytes'] += _remove(entry); summary['removed'] += 1
+        for entry in os.scandir(utils.PROCESSED_CLIPS_DIR):
+            if entry.is_file() and entry.name not in keep and entry.stat().st_mtime < cutoff: summary['bytes'] += _remove(entry); summary['removed'] += 1
+        if not shared:
+            with store.transaction():
+                for name, (source, status, record) in live.items():
+                    if status != 'pending_upload' or os.path.exists(utils.find_clip(name)) or not os.path.exists(os.path.join(utils.INPUT_VIDEOS_DIR, source)): continue
+                    store.set_clip(source, name, {'status': 'rendering', 'stage': 'cancelled', 'created_at': datetime.now(timezone.utc).isoformat()}); summary['rerender'] += 1
+        if summary['removed'] or summary['spilled'] or summary['rerender']:
+            logging.info(f"🧹 Storage cleanup: removed {summary['removed']} orphaned files ({summary['bytes'] / MB:.1f} MB), kept {summary['spilled']} staged clips on disk, {summary['rerender']} lost clips will be rendered again.")
+        return summary
+
+    def describe(self) -> str:
+        staging = f"staging `{self.staged_bytes() / MB:.0f}/{self.staging_bytes / MB:.0f} MB` | " if self.staging_dir else ""
+        return f"{staging}disk `{self.free_bytes() / (1024 * MB):.1f} GB` free" + (f" | paused `{self.waits}`x" if self.waits else "")
+
+def _folder_bytes(folder: str) -> int:
+    try: return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+    except OSError: return 0
+
+def _remove(entry) -> int:
+    try: size = entry.stat().st_size; os.remove(entry.path); return size
+    except OSError: return 0
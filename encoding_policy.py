@@ -0,0 +1,65 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Encoding Policy - DEADLINE-AWARE x264 PRESET / CRF LADDER
+# -----------------------------------------------------------------------------
+import logging, math, time
+
+import helpers
+
+# (preset, crf) from fastest to most compressed. The fast presets get a higher CRF so their larger files stay in check.
+DEFAULT_LADDER = [['ultrafast', 26], ['superfast', 25], ['veryfast', 24], ['faster', 23], ['fast', 23], ['medium', 23], ['slow', 23], ['slower', 23]]
+# Rough encode speed of each preset relative to 'fast'. Used until a preset has its own measurements.
+RELATIVE_SPEED = {'ultrafast': 4.0, 'superfast': 3.0, 'veryfast': 2.2, 'faster': 1.3, 'fast': 1.0, 'medium': 0.8, 'slow': 0.45, 'slower': 0.2, 'veryslow': 0.1}
+SPEEDS_KEY = 'encode_speeds'
+
+class EncodingPolicy:
+    """Picks the x264 preset and CRF for the next encode. Queued renders are lined up against the upcoming schedule slots
+    (after the clips already waiting to upload). The policy takes the most compressed rung whose expected finish still
+    leaves every clip `lead_seconds` before its slot. Encode speed is kept per preset as an EWMA of media seconds per
+    wall second, stored in the state store so it survives restarts. Cluster nodes share that store, so each keeps its own speeds."""
+    def __init__(self, store, ladder=None, lead_seconds: float = 3600, safety: float = 1.5, smoothing: float = 0.3, default_speed: float = 1.0, speeds_key: str = SPEEDS_KEY):
+        self.store = store; self.speeds_key = speeds_key; self.ladder = [tuple(rung) for rung in (ladder or DEFAULT_LADDER)]; self.lead_seconds = lead_seconds
+        self.safety = safety; self.smoothing = smoothing; self.default_speed = default_speed
+        self.speeds = store.get_meta(speeds_key, {}); self.current = self._fallback_rung()
+
+    @classmethod
+    def from_config(cls, config, store, node_id: str | None = None):
+        encoding = config['video'].get('encoding', {})
+        return cls(store, encoding.get('ladder'), encoding.get('upload_lead_minutes', 60) * 60, encoding.get('safety_factor', 1.5), speeds_key=f"{SPEEDS_KEY}:{node_id}" if node_id else SPEEDS_KEY)
+
+    def _fallback_rung(self):
+        return next((rung for rung in self.ladder if rung[0] == 'fast'), self.ladder[len(self.ladder) // 2])
+
+    # --- Speed model -------------------------------------------------------------
+    def speed(self, preset: str) -> float:
+        """Expected media seconds encoded per wall second for one clip at `preset`."""
+        if preset in self.speeds: return self.speeds[preset]
+        # Scale from the closest measured preset using the relative speed table.
+        measured = [(p, s) for p, s in self.speeds.items() if p in RELATIVE_SPEED]
+        if not measured: return self.default_speed * RELATIVE_SPEED.get(preset, 1.0)
+        reference, reference_speed = min(measured, key=lambda item: abs(math.log(RELATIVE_SPEED[item[0]] / RELATIVE_SPEED.get(preset, 1.0))))
+        return reference_speed * RELATIVE_SPEED.get(preset, 1.0) / RELATIVE_SPEED[reference]
+
+    def record(self, preset: str, media_seconds: float, wall_seconds: float):
+        if media_seconds <= 0 or wall_seconds <= 0: return
+        observed = media_seconds / wall_seconds; previous = self.speeds.get(preset)
+        self.speeds[preset] = observed if previous is None else previous + self.smoothing * (observed - previous)
+        self.store.set_meta(self.speeds_key, self.speeds)
+
+    # --- Decision ------------------------------------------------------------------
+    def choose(self, clips_to_render: int, clip_seconds: float, parallel: int = 1) -> tuple[str, int]:
+        """(preset, crf) for the next encode, given the clips this run still has to render (including this one)."""
+        clips_to_render = max(1, clips_to_render); parallel = max(1, parallel)
+        backlog = len(self.store.clips_with_status('pending_upload'))
+        slots = helpers.upcoming_schedule_slots(self.store, backlog + clips_to_render)
+        if not slots: return self._switch(self._fallback_rung(), "no schedule slots")
+        now = time.time(); deadlines = [slot - self.lead_seconds - now for slot in slots[backlog:]]
+        for rung in reversed(self.ladder):
+            per_clip = clip_seconds / self.speed(rung[0]) * self.safety
+            # Clip i finishes after ceil((i + 1) / parallel) rounds of encodes.
+            if all(math.ceil((i + 1) / parallel) * per_clip <= deadline for i, deadline in enumerate(deadlines)):
+                return self._switch(rung, f"{clips_to_render} clips to render, next slot in {max(0, deadlines[0]) / 3600:.1f}h")
+        return self._switch(self.ladder[0], "behind schedule")
+
+    def _switch(self, rung, reason):
+        if rung != self.current: logging.info(f"🎚️ Encoding now at preset '{rung[0]}', CRF {rung[1]} ({reason}).")
+        self.current = rung; return rung
@@ -0,0 +1,138 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Fake YouTube Service - LOCAL API STAND-IN FOR LOAD TESTS
+# -----------------------------------------------------------------------------
+# Enabled with youtube.fake_service.enabled in config.yaml (helpers.get_youtube_service then returns it instead of the
+# real client). It mimics the parts of the YouTube Data API v3 client the bot uses: videos().insert as a resumable
+# upload driven by next_chunk, plus playlists().insert and playlistItems().insert. Nothing leaves the machine.
+import itertools, json, logging, random, threading, time
+
+class _UploadProgress:
+    def __init__(self, received, total): self.resumable_progress = received; self.total_size = total
+    def progress(self): return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+def _http_error(status, reason):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    return HttpError(httplib2.Response({'status': status}), json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode())
+
+class FakeYouTubeService:
+    """Thread-safe in-memory YouTube. Each call sleeps for the configured latency and may fail at the configured rates:
+    a 5xx response, a dropped connection (an upload chunk is then only half committed), or a 403 quotaExceeded.
+    Quota is charged from `api_costs`, and once `daily_quota_limit` is spent every call is refused with quotaExceeded."""
+    def __init__(self, api_costs, daily_quota_limit, latency_ms=0, server_error_rate=0.0, dropped_connection_rate=0.0, quota_exceeded_rate=0.0, seed=None):
+        self.api_costs = api_costs; self.daily_quota_limit = daily_quota_limit; self.latency = latency_ms / 1000
+        self.server_error_rate = server_error_rate; self.dropped_connection_rate = dropped_connection_rate; self.quota_exceeded_rate = quota_exceeded_rate
+        self.quota_spent = 0; self.videos_by_id = {}; self.playlists_by_id = {}; self.sessions = {}
+        self.stats = {'requests': 0, 'chunks': 0, 'bytes_received': 0, 'bytes_committed': 0, 'server_errors': 0, 'dropped_connections': 0, 'quota_exceeded': 0, 'session_resumes': 0, 'playlist_items_refused': 0}
+        self._random = random.Random(seed); self._ids = itertools.count(1); self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        fake = config['youtube'].get('fake_service', {})
+        logging.warning("🧪 Using the local fake YouTube service. Nothing will really be uploaded.")
+        return cls(config['youtube']['api_costs'], config['youtube']['daily_quota_limit'], fake.get('latency_ms', 0), fake.get('server_error_rate', 0.0),
+                   fake.get('dropped_connection_rate', 0.0), fake.get('quota_exceeded_rate', 0.0), fake.get('seed'))
+
+    def new_http(self): return _FakeHttp(self)
+
+    def videos(self): return _Resource(self, 'videos')
+    def playlists(self): return _Resource(self, 'playlists')
+    def playlistItems(self): return _Resource(self, 'playlistItems')
+
+    def seed_playlist(self, title) -> str:
+        """Creates a playlist directly, with no latency, faults or quota charge. Used to set up load tests."""
+        playlist_id = self._new_id('PLfake')
+        with self._lock: self.playlists_by_id[playlist_id] = {'title': title, 'items': []}
+        return playlist_id
+
+    # --- Simulated server ------------------------------------------------------
+    def _new_id(self, prefix): return f"{prefix}{next(self._ids):08d}"
+
+    def _roll(self, rate):
+        with self._lock: return rate > 0 and self._random.random() < rate
+
+    def _begin_call(self):
+        """Latency and fault injection shared by every request. Returns 'drop' when the caller should drop the connection."""
+        if self.latency: time.sleep(self.latency * (0.5 + self._random.random()))
+        with self._lock: self.stats['requests'] += 1
+        if self._roll(self.quota_exceeded_rate): self._count('quota_exceeded'); raise _http_error(403, 'quotaExceeded')
+        if self._roll(self.server_error_rate): self._count('server_errors'); raise _http_error(self._random.choice([500, 502, 503]), 'backendError')
+        if self._roll(self.dropped_connection_rate): self._count('dropped_connections'); return 'drop'
+        return None
+
+    def _count(self, key, amount=1):
+        with self._lock: self.stats[key] += amount
+
+    def _charge(self, action):
+        cost = self.api_costs.get(action, 0)
+        with self._lock:
+            if self.quota_spent + cost > self.daily_quota_limit: self.stats['quota_exceeded'] += 1; raise _http_error(403, 'quotaExceeded')
+            self.quota_spent += cost
+
+class _Resource:
+    def __init__(self, service, kind): self.service = service; self.kind = kind
+    def insert(self, part, body, media_body=None):
+        if self.kind == 'videos': return _FakeUploadRequest(self.service, body, media_body)
+        return _FakeRequest(self.service, self.kind, body)
+
+class _FakeRequest:
+    def __init__(self, service, kind, body): self.service = service; self.kind = kind; self.body = body
+    def execute(self, http=None, num_retries=0):
+        try: return self._execute()
+        except Exception as e:
+            # Lets load tests tell playlist items refused for quota from ones that went missing.
+            if self.kind == 'playlistItems' and b'quotaExceeded' in (getattr(e, 'content', None) or b''): self.service._count('playlist_items_refused')
+            raise
+
+    def _execute(self):
+        service = self.service
+        if service._begin_call() == 'drop': raise ConnectionResetError("Connection dropped by fake YouTube service")
+        if self.kind == 'playlists':
+            service._charge('playlist_insert'); return {'id': service.seed_playlist(self.body['snippet']['title'])}
+        playlist_id = self.body['snippet']['playlistId']; video_id = self.body['snippet']['resourceId']['videoId']
+        if playlist_id not in service.playlists_by_id: raise _http_error(404, 'playlistNotFound')
+        if video_id not in service.videos_by_id: raise _http_error(404, 'videoNotFound')
+        service._charge('playlist_item_insert')
+        with service._lock: service.playlists_by_id[playlist_id]['items'].append(video_id)
+        return {'id': service._new_id('PLIfake')}
+
+class _FakeHttp:
+    """Answers the resumable upload status query (an empty PUT to the session URI) that resumes a saved session."""
+    def __init__(self, service): self.service = service
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        import httplib2
+        service = self.service
+        if service._begin_call() == 'drop': raise ConnectionResetError("Connection dropped by fake YouTube service")
+        with service._lock: session = dict(service.sessions.get(uri) or {})
+        if not session: return httplib2.Response({'status': 404}), json.dumps({'error': {'code': 404, 'errors': [{'reason': 'uploadSessionNotFound'}]}}).encode()
+        service._count('session_resumes')
+        return httplib2.Response({'status': 308, **({'range': f"bytes=0-{session['received'] - 1}"} if session['received'] else {})}), b''
+
+class _FakeUploadRequest:
+    """Speaks the resumable protocol the way googleapiclient's HttpRequest does. After a failure in the error state,
+    the next next_chunk asks the server how many bytes it committed, and the upload carries on from there. A saved
+    session is resumed by setting resumable_uri and resumable_progress after a status query (see _FakeHttp)."""
+    def __init__(self, service, body, media_body):
+        self.service = service; self.body = body; self.media = media_body; self.resumable_uri = None; self.resumable_progress = 0; self._in_error_state = False
+
+    def next_chunk(self, http=None, num_retries=0):
+        service = self.service; fault = service._begin_call()
+        if self.resumable_uri is None:
+            # Opening the session is where the real API charges the upload quota.
+            service._charge('upload'); self.resumable_uri = f"https://fake.youtube.local/upload/{service._new_id('session')}"
+            with service._lock: service.sessions[self.resumable_uri] = {'received': 0, 'size': self.media.size()}
+        with service._lock: session = service.sessions.get(self.resumable_uri)
+        if session is None: raise _http_error(404, 'uploadSessionNotFound')
+        if self._in_error_state: service._count('session_resumes'); self._in_error_state = False
+        with service._lock: offset = session['received']
+        chunk = self.media.getbytes(offset, self.media.chunksize()); service._count('chunks'); service._count('bytes_received', len(chunk))
+        # Half of a dropped chunk made it before the connection died; the client must ask where to resume.
+        committed = len(chunk) // 2 if fault == 'drop' else len(chunk)
+        with service._lock: session['received'] = offset + committed; received = session['received']
+        service._count('bytes_committed', committed)
+        if fault == 'drop': self._in_error_state = True; raise ConnectionResetError("Connection dropped by fake YouTube service")
+        if received < session['size']: return _UploadProgress(received, session['size']), None
+        video_id = service._new_id('fakevid')
+        with service._lock: service.videos_by_id[video_id] = {'snippet': self.body['snippet'], 'status': self.body['status'], 'size': session['size']}; del service.sessions[self.resumable_uri]
+        return None, {'id': video_id}
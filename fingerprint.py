@@ -0,0 +1,64 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Source Fingerprints - RENAME AND DUPLICATE DETECTION
+# -----------------------------------------------------------------------------
+import asyncio, hashlib, logging, os
+
+import subtitles, utils
+
+SAMPLE_BYTES = 1024 * 1024
+SAMPLE_COUNT = 8
+
+def sampled_digest(path: str, size: int) -> str:
+    """blake2b of SAMPLE_COUNT evenly spaced 1 MiB samples (always including the first and last MiB). Reads at most 8 MiB
+    however long the film is, so it stays fast on network shares; size and duration in the fingerprint cover the rest."""
+    digest = hashlib.blake2b(digest_size=16); digest.update(size.to_bytes(8, 'little'))
+    offsets = sorted({round(i * max(0, size - SAMPLE_BYTES) / (SAMPLE_COUNT - 1)) for i in range(SAMPLE_COUNT)})
+    with open(path, 'rb') as f:
+        for offset in offsets: f.seek(offset); digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+class SourceRegistry:
+    """Recognises source videos by content instead of file name. A fingerprint is a sampled blake2b hash plus the file
+    size and ffprobe duration. It is computed once per file version (path, size, mtime) and stored per source. A new
+    file whose fingerprint belongs to a known source is either that source renamed (its old file is gone from
+    input_videos) or a duplicate of it (the old file is still there, or the source is already completed)."""
+    def __init__(self, store, media):
+        self.store = store; self.media = media; self._memory = {}
+
+    async def fingerprint(self, path: str) -> str | None:
+        path = os.path.abspath(path)
+        try: stat = os.stat(path)
+        except OSError: return None
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key in self._memory: return self._memory[key]
+        try: digest = await asyncio.to_thread(sampled_digest, path, stat.st_size)
+        except OSError as e: logging.warning(f"⚠️ Could not fingerprint {os.path.basename(path)}: {e}"); return None
+        info = await self.media.get(path)
+        if info is None: return None
+        fingerprint = f"{digest}-{stat.st_size:x}-{round(info['duration'] * 10):x}"
+        self._memory = {k: v for k, v in self._memory.items() if k[0] != path}; self._memory[key] = fingerprint
+        return fingerprint
+
+    async def register(self, source_name: str):
+        """Records the fingerprint of a source's file in input_videos, so later renames and copies of it are recognised."""
+        fingerprint = await self.fingerprint(os.path.join(utils.INPUT_VIDEOS_DIR, source_name))
+        if fingerprint and self.store.has_source(source_name): self.store.set_source_fingerprint(source_name, fingerprint)
+        return fingerprint
+
+    async def identify(self, file_name: str) -> tuple[str | None, str | None]:
+        """('renamed' or 'duplicate', known source name) for a file in input_videos that has no record of its own, else (None, None)."""
+        fingerprint = await self.fingerprint(os.path.join(utils.INPUT_VIDEOS_DIR, file_name))
+        known = self.store.source_with_fingerprint(fingerprint) if fingerprint else None
+        if not known or known == file_name: return None, None
+        if os.path.exists(os.path.join(utils.INPUT_VIDEOS_DIR, known)) or self.store.get_source_status(known) == 'completed': return 'duplicate', known
+        return 'renamed', known
+
+    def apply_rename(self, old_name: str, new_name: str):
+        """Moves a source's progress, clips, cached probe and transcript over to its new file name."""
+        self.store.rename_source(old_name, new_name)
+        self.store.move_probe(os.path.abspath(os.path.join(utils.INPUT_VIDEOS_DIR, old_name)), os.path.abspath(os.path.join(utils.INPUT_VIDEOS_DIR, new_name)))
+        # A moved file keeps its size and mtime, so its transcript is found under the old name with the new file's stat.
+        try: stat = os.stat(os.path.join(utils.INPUT_VIDEOS_DIR, new_name))
+        except OSError: return
+        old_transcript = os.path.join(utils.TRANSCRIPTS_DIR, subtitles.transcript_name(old_name, stat)); new_transcript = os.path.join(utils.TRANSCRIPTS_DIR, subtitles.transcript_name(new_name, stat))
+        if os.path.exists(old_transcript) and not os.path.exists(new_transcript): os.replace(old_transcript, new_transcript)
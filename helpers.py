@@ -1,20 +1,23 @@
 # -----------------------------------------------------------------------------
 # ShortsBot API Helper Functions - STABLE VERSION
 # -----------------------------------------------------------------------------
-import asyncio, logging, os, json
+import asyncio, bisect, hashlib, logging, mmap, os, json, random, threading, time
 from datetime import datetime, timedelta, timezone
 import yaml
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from googleapiclient.errors import HttpError
+import metrics
+# The Google client libraries take seconds to import, so they are imported inside the functions that need them.
 
 TOKEN_FILE = 'token.json'
 SCHEDULE_FILE = 'schedule.yaml'
 
 def get_youtube_service(config):
+    if config['youtube'].get('fake_service', {}).get('enabled'):
+        from fake_youtube import FakeYouTubeService
+        return FakeYouTubeService.from_config(config)
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
     credentials = None; client_secrets_file = config['youtube']['client_secrets_file']; scopes = config['youtube']['scopes']
     if os.path.exists(TOKEN_FILE): credentials = Credentials.from_authorized_user_file(TOKEN_FILE, scopes)
     if not credentials or not credentials.valid:
@@ -22,59 +25,193 @@ def get_youtube_service(config):
         else:
             flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, scopes); credentials = flow.run_local_server(port=0)
         with open(TOKEN_FILE, 'w') as token: token.write(credentials.to_json())
-    return build('youtube', 'v3', credentials=credentials)
+    return YouTubeClient(build('youtube', 'v3', credentials=credentials), credentials)
 
-def get_next_schedule_time(last_scheduled_timestamp: float | None):
-    try:
-        with open(SCHEDULE_FILE, 'r') as f: weekly_schedule = yaml.safe_load(f)['schedule']
-    except (FileNotFoundError, KeyError):
-        logging.error(f"❌ '{SCHEDULE_FILE}' not found or invalid."); return None
-    now_utc = datetime.now(timezone.utc); start_time = now_utc
-    if last_scheduled_timestamp:
+class YouTubeClient:
+    """The API client together with the credentials it was built with. Everything else is delegated to the client."""
+    def __init__(self, service, credentials):
+        self.service = service; self.credentials = credentials
+
+    def __getattr__(self, name): return getattr(self.service, name)
+
+    def new_http(self):
+        """httplib2 connections are not thread-safe, so each concurrent API call gets its own authorized connection."""
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        return AuthorizedHttp(self.credentials, http=httplib2.Http())
+
+def _thread_http(youtube): return youtube.new_http()
+
+class ScheduleIndex:
+    """schedule.yaml compiled into sorted slot offsets from Monday 00:00 UTC. Reloaded only when the file's mtime changes."""
+    WEEK_SECONDS = 7 * 86400; EPOCH_MONDAY = 4 * 86400  # 1970-01-05 was a Monday.
+    def __init__(self, schedule_file):
+        self.schedule_file = schedule_file; self._mtime = None; self._offsets = []; self._lock = threading.Lock()
+    def _refresh(self):
+        try: mtime = os.stat(self.schedule_file).st_mtime
+        except FileNotFoundError: self._mtime = None; self._offsets = []; return
+        if mtime == self._mtime: return
         try:
-            timestamp = float(last_scheduled_timestamp)
-            last_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
-            if last_time > start_time: start_time = last_time
-        except (ValueError, TypeError):
-             logging.warning("Could not parse last_scheduled_time. Starting from now.")
-    for i in range(365):
-        current_day = start_time + timedelta(days=i); day_of_week = current_day.weekday()
-        day_schedule = weekly_schedule.get(day_of_week, [])
-        for time_str in day_schedule:
-            hour, minute = map(int, time_str.split(':'))
-            next_slot = current_day.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if next_slot > start_time:
-                return next_slot.timestamp()
-    return None
+            with open(self.schedule_file, 'r') as f: weekly_schedule = yaml.safe_load(f)['schedule']
+            offsets = set()
+            for day_of_week, day_schedule in weekly_schedule.items():
+                for time_str in day_schedule or []:
+                    hour, minute = map(int, time_str.split(':')); offsets.add(int(day_of_week) * 86400 + hour * 3600 + minute * 60)
+            self._offsets = sorted(offsets)
+        except (KeyError, TypeError, ValueError, AttributeError, yaml.YAMLError) as e:
+            logging.error(f"❌ Could not parse '{self.schedule_file}': {e}"); self._offsets = []
+        self._mtime = mtime
+    def next_slots(self, after_timestamp: float, count: int) -> list | None:
+        """Returns the next `count` slot timestamps strictly after `after_timestamp`, or None if there are no slots."""
+        with self._lock:
+            self._refresh(); offsets = self._offsets
+            if not offsets: return None
+            week_start = after_timestamp - (after_timestamp - self.EPOCH_MONDAY) % self.WEEK_SECONDS
+            i = bisect.bisect_right(offsets, after_timestamp - week_start); slots = []
+            while len(slots) < count:
+                if i == len(offsets): i = 0; week_start += self.WEEK_SECONDS
+                slots.append(float(week_start + offsets[i])); i += 1
+            return slots
+
+SCHEDULE_INDEX = ScheduleIndex(SCHEDULE_FILE)
+
+def _schedule_start(last_scheduled_timestamp):
+    start_time = datetime.now(timezone.utc).timestamp()
+    if last_scheduled_timestamp:
+        try: start_time = max(start_time, float(last_scheduled_timestamp))
+        except (ValueError, TypeError): logging.warning("Could not parse last_scheduled_time. Starting from now.")
+    return start_time
+
+def get_next_schedule_time(last_scheduled_timestamp: float | None):
+    slots = SCHEDULE_INDEX.next_slots(_schedule_start(last_scheduled_timestamp), 1)
+    if not slots: logging.error(f"❌ '{SCHEDULE_FILE}' not found or invalid."); return None
+    return slots[0]
+
+def upcoming_schedule_slots(store, count: int) -> list:
+    """The next `count` slots after last_scheduled_time, without reserving them (for planning and estimates)."""
+    return SCHEDULE_INDEX.next_slots(_schedule_start(store.get_meta('last_scheduled_time')), count)
+
+def reserve_schedule_slots(store, count: int) -> list | None:
+    """Atomically takes the next `count` slots after last_scheduled_time and advances it past them."""
+    with store.transaction():
+        slots = upcoming_schedule_slots(store, count)
+        if not slots: logging.error(f"❌ '{SCHEDULE_FILE}' not found or invalid."); return None
+        store.set_meta('last_scheduled_time', slots[-1]); return slots
+
+def release_schedule_slot(store, slot: float):
+    """Hands back a slot whose upload failed, as long as no later slot has been reserved since."""
+    with store.transaction():
+        # One second before the slot, so the next reservation returns this slot again.
+        if store.get_meta('last_scheduled_time') == slot: store.set_meta('last_scheduled_time', slot - 1)
 
 async def create_youtube_playlist(youtube, title):
+    from googleapiclient.errors import HttpError
     logging.info(f"Creating new YouTube playlist titled: '{title}'")
     try:
         request_body = {'snippet': {'title': title}, 'status': {'privacyStatus': 'public'}}
         request = youtube.playlists().insert(part='snippet,status', body=request_body)
-        response = await asyncio.to_thread(request.execute); return response.get('id')
-    except HttpError as e: logging.error(f"❌ Could not create playlist: {e}"); return None
+        with metrics.span('youtube_playlist_insert'): response = await asyncio.to_thread(request.execute, http=_thread_http(youtube))
+        return response.get('id')
+    except (HttpError, ConnectionError, TimeoutError) as e: metrics.count('youtube_api_errors'); logging.error(f"❌ Could not create playlist: {e}"); return None
+
+def _backoff_delay(config, failures: int) -> float:
+    """Exponential backoff with full jitter, capped at retry_delay_minutes."""
+    base = config['bot'].get('upload_backoff_base_seconds', 2); cap = config['bot']['retry_delay_minutes'] * 60
+    return random.uniform(0, min(cap, base * 2 ** (failures - 1)))
+
+def _http_error_details(e):
+    try: reason = json.loads(e.content.decode('utf-8')).get('error', {}).get('errors', [{}])[0].get('reason', 'Unknown reason')
+    except (ValueError, AttributeError): reason = 'Unknown reason'
+    return e.resp.status, f"{reason} (Error {e.resp.status})"
 
-async def upload_video(youtube, config, file_path, title, description, category_id, tags, publish_at_timestamp: float):
+def _query_upload_status(http, session_uri: str, size: int):
+    """Asks where a resumable session stands with an empty PUT carrying `Content-Range: bytes */size`. Returns (bytes the
+    server holds, the finished video resource or None); an unknown or expired session raises HttpError."""
+    from googleapiclient.errors import HttpError
+    resp, content = http.request(session_uri, method='PUT', body=b'', headers={'Content-Length': '0', 'Content-Range': f"bytes */{size}"})
+    if resp.status in (200, 201): return size, json.loads(content)
+    if resp.status == 308: committed = resp.get('range'); return (int(committed.rsplit('-', 1)[1]) + 1 if committed else 0), None
+    raise HttpError(resp, content, uri=session_uri)
+
+async def upload_video(youtube, config, file_path, title, description, category_id, tags, publish_at_timestamp: float, store=None, progress_callback=None, in_memory=False):
+    """Uploads in chunks with next_chunk. Transient failures resume from the last byte the server committed, and the
+    session URI is kept in the store so a restarted bot continues a partial upload instead of re-sending it. With
+    `in_memory` (a clip in the RAM staging folder) the file is memory-mapped and sent with MediaIoBaseUpload. Each chunk
+    is still copied out of the mapping into a new bytes object; the mapping only saves the buffered file reads."""
+    if not in_memory: return await _upload_media(youtube, config, file_path, None, title, description, category_id, tags, publish_at_timestamp, store, progress_callback)
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        return await _upload_media(youtube, config, file_path, mapping, title, description, category_id, tags, publish_at_timestamp, store, progress_callback)
+
+async def _upload_media(youtube, config, file_path, mapping, title, description, category_id, tags, publish_at_timestamp, store, progress_callback):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
     publish_at_iso = datetime.fromtimestamp(publish_at_timestamp, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
     request_body = {'snippet': {'categoryId': category_id, 'title': title, 'description': description, 'tags': tags}, 'status': {'privacyStatus': 'private', 'publishAt': publish_at_iso, 'selfDeclaredMadeForKids': False}}
-    media_file = MediaFileUpload(file_path, chunksize=-1, resumable=True)
-    max_retries = config['bot']['upload_retry_attempts']
-    for attempt in range(max_retries):
+    chunk_size = max(1, int(config['bot'].get('upload_chunk_size_mb', 8) * 4)) * 256 * 1024  # Chunks must be multiples of 256 KiB.
+    size = os.path.getsize(file_path); session_key = f"upload_session:{os.path.basename(file_path)}:{size}"
+    # A session carries the metadata it was opened with, so a new title or publish slot needs a new session.
+    metadata = hashlib.blake2b(json.dumps(request_body, sort_keys=True).encode(), digest_size=8).hexdigest()
+    def new_request():
+        if mapping is not None: media_file = MediaIoBaseUpload(mapping, mimetype='video/mp4', chunksize=chunk_size, resumable=True)
+        else: media_file = MediaFileUpload(file_path, chunksize=chunk_size, resumable=True)
+        return youtube.videos().insert(part='snippet,status', body=request_body, media_body=media_file)
+    request = new_request(); saved_session = store.get_meta(session_key) if store else None
+    if saved_session and saved_session.get('metadata') != metadata:
+        logging.info(f"🔁 Upload metadata of {os.path.basename(file_path)} changed. Starting a new upload session."); store.delete_meta(session_key); saved_session = None
+    resuming = bool(saved_session)
+    if resuming: request.resumable_uri = saved_session['uri']; logging.info(f"⏯️ Resuming upload session for {os.path.basename(file_path)}")
+    def remember_session():
+        if store and request.resumable_uri and request.resumable_uri != (saved_session or {}).get('uri'):
+            saved = {'uri': request.resumable_uri, 'metadata': metadata}; store.set_meta(session_key, saved); return saved
+        return saved_session
+    def give_up(error_message):
+        # A session that failed for good is not resumed by a later retry, which gets a new publish slot.
+        if store: store.delete_meta(session_key)
+        return None, error_message
+    max_retries = config['bot']['upload_retry_attempts']; failures = 0; response = None; http = _thread_http(youtube); started = time.perf_counter()
+    while response is None:
         try:
-            request = youtube.videos().insert(part='snippet,status', body=request_body, media_body=media_file)
-            response = await asyncio.to_thread(request.execute); return response.get('id'), None
+            if resuming and http is not None:
+                # The server says how many bytes of the saved session it holds; next_chunk carries on from there.
+                with metrics.span('youtube_upload_status'): request.resumable_progress, response = await asyncio.to_thread(_query_upload_status, http, request.resumable_uri, size)
+                resuming = False
+                if response is not None: break
+            with metrics.span('youtube_upload_chunk'): status, response = await asyncio.to_thread(request.next_chunk, http=http)
+            failures = 0; resuming = False; saved_session = remember_session()
+            if status and progress_callback: await progress_callback(status.progress() * 100)
         except HttpError as e:
-            error_details = json.loads(e.content.decode('utf-8')); reason = error_details.get('error', {}).get('errors', [{}])[0].get('reason', 'Unknown reason')
-            status_code = e.resp.status; error_message = f"{reason} (Error {status_code})"
-            if status_code in [400, 401, 403]: return None, error_message
-            if attempt < max_retries - 1: await asyncio.sleep(config['bot']['retry_delay_minutes'] * 60)
-            else: return None, error_message
-        except Exception as e: return None, str(e)
-    return None, "Max retries reached."
-
-async def add_video_to_playlist(youtube, playlist_id, video_id):
-    try:
-        request = youtube.playlistItems().insert(part="snippet", body={"snippet": {"playlistId": playlist_id, "resourceId": {"kind": "youtube#video", "videoId": video_id}}})
-        await asyncio.to_thread(request.execute); return True
-    except HttpError as e: logging.error(f"❌ Could not add video to playlist: {e}"); return False
\ No newline at end of file
+            saved_session = remember_session(); status_code, error_message = _http_error_details(e); metrics.count('youtube_api_errors')
+            if resuming and status_code in [404, 410]:
+                logging.warning("⚠️ Saved upload session expired. Starting a new one.")
+                if store: store.delete_meta(session_key)
+                request = new_request(); saved_session = None; resuming = False; continue
+            if status_code in [400, 401, 403]: return give_up(error_message)
+            failures += 1
+            if failures >= max_retries: return give_up(error_message)
+            await asyncio.sleep(_backoff_delay(config, failures))
+        except (ConnectionError, TimeoutError, httplib2.HttpLib2Error) as e:
+            saved_session = remember_session(); failures += 1; metrics.count('youtube_api_errors')
+            if failures >= max_retries: return give_up(str(e))
+            await asyncio.sleep(_backoff_delay(config, failures))
+        except Exception as e: return give_up(str(e))
+    if store and saved_session: store.delete_meta(session_key)
+    metrics.observe('youtube_upload', time.perf_counter() - started); metrics.count('bytes_uploaded', size)
+    return response.get('id'), None
+
+async def add_video_to_playlist(youtube, config, playlist_id, video_id):
+    """Returns (True, None), or (False, error message) once the insert has failed for good. Server errors and dropped
+    connections are retried with the upload backoff, up to bot.upload_retry_attempts tries."""
+    import httplib2
+    from googleapiclient.errors import HttpError
+    max_retries = config['bot']['upload_retry_attempts']; failures = 0
+    request = youtube.playlistItems().insert(part="snippet", body={"snippet": {"playlistId": playlist_id, "resourceId": {"kind": "youtube#video", "videoId": video_id}}})
+    while True:
+        try:
+            with metrics.span('youtube_playlist_item_insert'): await asyncio.to_thread(request.execute, http=_thread_http(youtube))
+            return True, None
+        except (HttpError, ConnectionError, TimeoutError, httplib2.HttpLib2Error) as e:
+            metrics.count('youtube_api_errors'); failures += 1
+            status_code, error_message = _http_error_details(e) if isinstance(e, HttpError) else (None, str(e))
+            if status_code in [400, 401, 403, 404] or failures >= max_retries: logging.error(f"❌ Could not add video to playlist: {error_message}"); return False, error_message
+            await asyncio.sleep(_backoff_delay(config, failures))
\ No newline at end of file
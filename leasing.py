@@ -0,0 +1,79 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Work Leasing - SHARED STATE FOR SEVERAL RENDER NODES
+# -----------------------------------------------------------------------------
+import asyncio, functools, logging, os, socket, time
+from concurrent.futures import ThreadPoolExecutor
+
+COORDINATOR = 'coordinator'
+
+def node_resource(node_id: str) -> str: return f"node:{node_id}"
+def clip_resource(source_name: str, clip_number: int) -> str: return f"clip:{source_name}#{clip_number}"
+def clip_prefix(source_name: str) -> str: return f"clip:{source_name}#"
+def transcript_resource(source_name: str) -> str: return f"transcript:{source_name}"
+
+class LeaseManager:
+    """Expiring leases in the shared progress store, so several ShortsBot nodes can work from one input folder and one
+    database. A node leases a clip just before rendering it and other nodes skip that clip. A heartbeat renews every
+    lease the node holds in a single write. When a node dies, its leases expire after `ttl` seconds and its clips are
+    picked up again. The 'coordinator' lease marks the one node that talks to Discord and YouTube.
+    A shared database can keep a write waiting for up to 30 seconds on another node's lock, so every lease call (and,
+    through run(), every store call of a cluster pipeline) goes to one dedicated thread instead of the event loop.
+    Lease expiry compares wall clocks, so the nodes' clocks must be kept in sync (NTP)."""
+    def __init__(self, store, node_id: str, ttl: float = 60, role: str = 'render'):
+        self.store = store; self.node_id = node_id; self.ttl = max(5.0, float(ttl)); self.role = role; self._task = None; self._executor = None
+
+    @classmethod
+    def from_config(cls, config, store, role: str):
+        """The node's lease manager, or None when cluster mode is off."""
+        cluster = config.get('cluster', {})
+        if not cluster.get('enabled'): return None
+        return cls(store, cluster.get('node_id') or socket.gethostname(), cluster.get('lease_seconds', 60), role)
+
+    def start(self):
+        self.store.acquire_lease(node_resource(self.node_id), self.node_id, self.ttl, {'role': self.role, 'host': socket.gethostname(), 'pid': os.getpid(), 'started': time.time()})
+        if self._executor is None: self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shortsbot-leases")
+        if self._task is None or self._task.done(): self._task = asyncio.create_task(self._heartbeat())
+        logging.info(f"🛰️ Cluster node '{self.node_id}' joined as {self.role} (leases last {self.ttl:.0f}s).")
+        return self
+
+    def stop(self):
+        """Stops the heartbeat and hands back every lease, so other nodes can take this node's clips at once."""
+        if self._task: self._task.cancel(); self._task = None
+        self.store.release_leases(self.node_id)
+        if self._executor: self._executor.shutdown(wait=False); self._executor = None
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs a blocking store call on the lease thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                # Re-registers the node if its lease lapsed (e.g. the machine was suspended) and renews everything else it holds.
+                if not await self.run(self.store.renew_leases, self.node_id, self.ttl): await self.run(self.store.acquire_lease, node_resource(self.node_id), self.node_id, self.ttl, {'role': self.role, 'host': socket.gethostname(), 'pid': os.getpid()})
+            except Exception as e: logging.error(f"❌ Lease heartbeat failed: {e}")
+
+    # --- Leases ------------------------------------------------------------
+    async def acquire(self, resource: str, **data) -> bool: return await self.run(self.store.acquire_lease, resource, self.node_id, self.ttl, data)
+
+    async def release(self, resource: str): await self.run(self.store.release_lease, resource, self.node_id)
+
+    async def holds(self, resource: str) -> bool: return any(held == resource and owner == self.node_id for held, owner, _, _ in await self.run(self.store.live_leases, resource))
+
+    async def held_elsewhere(self, prefix: str) -> set:
+        """Resources starting with `prefix` that another node currently holds."""
+        return {resource for resource, owner, _, _ in await self.run(self.store.live_leases, prefix) if owner != self.node_id}
+
+    async def claim_coordinator(self) -> bool:
+        """Takes (or keeps) the coordinator lease. Only its holder may prompt on Discord, upload, or move finished sources."""
+        return await self.acquire(COORDINATOR)
+
+    async def wait_released(self, resource: str, poll_seconds: float = 5):
+        while resource in await self.held_elsewhere(resource): await asyncio.sleep(poll_seconds)
+
+    async def nodes(self) -> list:
+        """(node id, role, seconds since the last heartbeat) for every live node, coordinator first."""
+        coordinator = next((owner for _, owner, _, _ in await self.run(self.store.live_leases, COORDINATOR)), None); now = time.time()
+        nodes = [(resource.split(':', 1)[1], data.get('role', 'render'), max(0.0, now - (expires_at - self.ttl))) for resource, _, expires_at, data in await self.run(self.store.live_leases, 'node:')]
+        return sorted(nodes, key=lambda node: (node[0] != coordinator, node[0]))
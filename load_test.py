@@ -0,0 +1,103 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Upload Load Test - FAKE YOUTUBE END TO END
+# -----------------------------------------------------------------------------
+# Usage: python load_test.py --clips 2000 --server-error-rate 0.02 --dropped-connection-rate 0.01
+# Queues thousands of dummy clips as pending uploads in a temporary store and drains them through
+# WorkflowManager.process_pending_uploads against fake_youtube.FakeYouTubeService. The real upload, scheduling,
+# playlist and quota accounting code all runs. Only Discord is replaced, by a channel that counts messages.
+import argparse, asyncio, copy, json, logging, os, shutil, sys, tempfile, time
+
+import yaml
+import helpers, metrics, quota, state_store, utils
+from bot_cog import BotCog
+from workflows import WorkflowManager
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ShortsBot upload load test against the fake YouTube service")
+    parser.add_argument('--clips', type=int, default=1000); parser.add_argument('--sources', type=int, default=20)
+    parser.add_argument('--clip-kb', type=int, default=768, help="Size of each dummy clip file")
+    parser.add_argument('--chunk-mb', type=float, default=0.25, help="Upload chunk size (rounded to 256 KiB)")
+    parser.add_argument('--concurrency', type=int, default=8); parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--server-error-rate', type=float, default=0.0); parser.add_argument('--dropped-connection-rate', type=float, default=0.0)
+    parser.add_argument('--quota-exceeded-rate', type=float, default=0.0); parser.add_argument('--retries', type=int, default=5)
+    parser.add_argument('--quota-limit', type=int, default=0, help="Daily quota of the fake API (0 = enough for every clip)")
+    parser.add_argument('--seed', type=int, default=1); parser.add_argument('--output', help="Also write the report as JSON here")
+    return parser.parse_args()
+
+class CountingChannel:
+    def __init__(self): self.messages = 0; self.last = None
+    async def send(self, content=None, **kwargs): self.messages += 1; self.last = content
+
+class LoadTestBot:
+    def __init__(self, channel): self.channel = channel
+    def get_channel(self, channel_id): return self.channel
+
+def build_config(args):
+    with open(os.path.join(utils.ROOT_DIR, "config.template.yaml"), 'r', encoding='utf-8') as f: config = copy.deepcopy(yaml.safe_load(f))
+    costs = config['youtube']['api_costs']; per_clip = costs.get('upload', 0) + costs.get('playlist_item_insert', 0)
+    config['youtube'].update(youtube_online_mode=True, daily_quota_limit=args.quota_limit or per_clip * args.clips)
+    config['youtube']['fake_service'] = {'enabled': True, 'latency_ms': args.latency_ms, 'server_error_rate': args.server_error_rate,
+                                         'dropped_connection_rate': args.dropped_connection_rate, 'quota_exceeded_rate': args.quota_exceeded_rate, 'seed': args.seed}
+    config['bot'].update(channel_id=0, max_uploads_per_day=args.clips, max_concurrent_uploads=args.concurrency, upload_retry_attempts=args.retries,
+                         upload_chunk_size_mb=args.chunk_mb, upload_backoff_base_seconds=0.05, retry_delay_minutes=0.01)
+    return config
+
+def prepare(workdir, args, store, youtube):
+    """Creates the dummy clips and their pending_upload records, plus one playlist per source."""
+    utils.PROCESSED_CLIPS_DIR = os.path.join(workdir, "processed_clips"); utils.FAILED_UPLOADS_DIR = os.path.join(workdir, "failed_uploads")
+    for directory in (utils.PROCESSED_CLIPS_DIR, utils.FAILED_UPLOADS_DIR): os.makedirs(directory, exist_ok=True)
+    schedule_path = os.path.join(workdir, "schedule.yaml")
+    with open(schedule_path, 'w') as f: yaml.safe_dump({'schedule': {day: [f"{hour:02}:00" for hour in range(24)] for day in range(7)}}, f)
+    helpers.SCHEDULE_INDEX = helpers.ScheduleIndex(schedule_path)
+    payload = os.urandom(args.clip_kb * 1024)
+    with store.transaction():
+        for source_index in range(args.sources):
+            store.add_source(f"Load Test {source_index}.mp4", 'completed', youtube.seed_playlist(f"Load Test {source_index}"))
+        for n in range(args.clips):
+            source_index = n % args.sources; clip_name = f"Load Test {source_index} part {n // args.sources + 1}.mp4"
+            with open(os.path.join(utils.PROCESSED_CLIPS_DIR, clip_name), 'wb') as f: f.write(payload)
+            store.set_clip(f"Load Test {source_index}.mp4", clip_name, {'status': 'pending_upload'})
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="shortsbot-load-")
+    try:
+        config = build_config(args); store = state_store.ProgressStore(os.path.join(workdir, "progress.db"))
+        channel = CountingChannel(); bot = LoadTestBot(channel); youtube = helpers.get_youtube_service(config)
+        cog = BotCog(bot); cog.config = config; cog.store = store; cog.youtube = youtube; cog.quota = quota.QuotaLedger.from_config(config, store)
+        prepare(workdir, args, store, youtube)
+        workflow = WorkflowManager(bot, cog); pending = workflow._get_pending_clips()
+        logging.info(f"🚚 Uploading {len(pending)} clips through the fake API ({args.concurrency} at a time)...")
+        started = time.perf_counter()
+        await workflow.process_pending_uploads(pending)
+        elapsed = time.perf_counter() - started
+        uploaded = len(store.clips_with_status('uploaded')); failed = len(store.clips_with_status('upload_failed')); deferred = len(store.clips_with_status('pending_upload')); stats = youtube.stats
+        minimal_chunks = uploaded * -(-args.clip_kb * 1024 // (max(1, int(args.chunk_mb * 4)) * 256 * 1024))
+        report = {'clips': args.clips, 'uploaded': uploaded, 'failed': failed, 'deferred': deferred, 'seconds': round(elapsed, 3),
+                  'clips_per_second': round(uploaded / elapsed, 2) if elapsed else None, 'megabytes_per_second': round(stats['bytes_committed'] / 1048576 / elapsed, 2) if elapsed else None,
+                  'requests': stats['requests'], 'chunk_requests': stats['chunks'], 'minimal_chunk_requests': minimal_chunks,
+                  'retry_overhead': round(stats['chunks'] / minimal_chunks - 1, 4) if minimal_chunks else None,
+                  'resent_bytes': stats['bytes_received'] - stats['bytes_committed'], 'session_resumes': stats['session_resumes'],
+                  'injected_faults': {key: stats[key] for key in ('server_errors', 'dropped_connections', 'quota_exceeded')},
+                  'playlist_items': sum(len(playlist['items']) for playlist in youtube.playlists_by_id.values()), 'playlist_items_refused': stats['playlist_items_refused'],
+                  # What the ledger charged for calls; its `spent` jumps to the daily limit once the API answers quotaExceeded.
+                  'quota_spent': youtube.quota_spent, 'tracked_quota': sum(config['youtube']['api_costs'].get(action, 0) * count for action, count in cog.quota.calls.items()), 'discord_messages': channel.messages,
+                  'stage_seconds': {stage: dict(zip(('count', 'p50', 'p95'), metrics.METRICS.percentiles(stage))) for stage in metrics.METRICS.stages()}}
+        store.close(); return report
+    finally: shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s"); args = parse_args()
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+    problems = []
+    if report['uploaded'] + report['failed'] + report['deferred'] < report['clips']: problems.append("clips went missing")
+    # A playlist insert refused with quotaExceeded is expected to be missing; anything else means an insert was lost.
+    if report['playlist_items'] + report['playlist_items_refused'] != report['uploaded']: problems.append(f"{report['uploaded']} uploads but {report['playlist_items']} playlist items ({report['playlist_items_refused']} refused for quota)")
+    # The ledger charges calls the API refused with quotaExceeded before spending anything, so the totals only match without them.
+    if not report['injected_faults']['quota_exceeded'] and report['tracked_quota'] != report['quota_spent']: problems.append(f"tracked quota {report['tracked_quota']} but the API spent {report['quota_spent']}")
+    for problem in problems: logging.error(f"❌ {problem}")
+    if problems: sys.exit(1)
+
+if __name__ == "__main__": main()
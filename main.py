@@ -1,6 +1,8 @@
 # -----------------------------------------------------------------------------
 # ShortsBot Main Application Loader - FINAL RELOAD FIX
 # -----------------------------------------------------------------------------
+import time
+LAUNCH_TIME = time.perf_counter()  # Taken before the heavy imports so the startup report includes them.
 import asyncio
 import logging
 import discord
@@ -9,6 +11,11 @@ from discord.ext import commands
 class ShortsBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Every Discord REST call (sends, edits, reactions) goes through http.request, so one wrapper times them all.
+        import metrics; send_request = self.http.request
+        async def timed_request(route, **kwargs):
+            with metrics.span(f"discord {route.method} {route.path}"): return await send_request(route, **kwargs)
+        self.http.request = timed_request
         try:
             import yaml; self.config = yaml.safe_load(open("config.yaml", "r", encoding='utf-8'))
         except Exception: self.config = None
@@ -21,6 +28,8 @@ class ShortsBot(commands.Bot):
                 except Exception: pass
         if self.http: await self.http.close()
         await super().close()
+        # Anything the cog did not stop on unload (Whisper workers included) must not outlive the bot.
+        import supervisor; supervisor.SUPERVISOR.kill_all()
 
 async def main():
     try:
@@ -29,6 +38,7 @@ async def main():
     
     intents = discord.Intents.default(); intents.messages = True; intents.message_content = True
     bot = ShortsBot(command_prefix="!", intents=intents, owner_id=int(config['bot']['owner_id']))
+    bot.launch_time = LAUNCH_TIME
 
     @bot.command(name="reload")
     @commands.is_owner()
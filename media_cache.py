@@ -0,0 +1,33 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Media Probe Cache - ONE FFPROBE PER FILE VERSION
+# -----------------------------------------------------------------------------
+import asyncio, logging, os
+
+import utils
+
+class MediaProbeCache:
+    """Caches ffprobe results keyed by (path, size, mtime), in memory and in the progress store, so they survive restarts.
+    A repeat lookup costs one stat. If a file is replaced or edited, its size or mtime changes and it is probed again.
+    Concurrent lookups of the same file share one ffprobe run."""
+    def __init__(self, store):
+        self.store = store; self._memory = {}; self._locks = {}
+
+    async def get(self, path: str) -> dict | None:
+        """Returns the probe info for `path` (see utils.probe_media), or None if the file is missing or unreadable."""
+        path = os.path.abspath(path)
+        try: stat = os.stat(path)
+        except OSError: return None
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key in self._memory: return self._memory[key]
+        async with self._locks.setdefault(path, asyncio.Lock()):
+            if key in self._memory: return self._memory[key]
+            info = self.store.get_probe(*key)
+            if info is None:
+                info = await utils.probe_media(path)
+                if info is None: return None
+                self.store.set_probe(*key, info); logging.info(f"🔎 Probed {os.path.basename(path)}: {info['duration']:.1f}s, {info['width']}x{info['height']} @ {info['fps']} fps.")
+            self._memory = {k: v for k, v in self._memory.items() if k[0] != path}; self._memory[key] = info
+            return info
+
+    async def duration(self, path: str) -> float | None:
+        info = await self.get(path); return info['duration'] if info else None
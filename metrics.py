@@ -0,0 +1,107 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Metrics - TIMING SPANS, COUNTERS & PROMETHEUS ENDPOINT
+# -----------------------------------------------------------------------------
+import asyncio, json, logging, os, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+class MetricsRegistry:
+    """In-process metrics shared by every module. Spans time one stage of work. Per stage, the recent durations feed
+    the p50/p95 shown by !metrics, and running totals feed Prometheus. Counters only go up (bytes, calls, errors).
+    Gauges hold the latest value (queue depths). Safe to use from worker threads."""
+    def __init__(self, window_size: int = 2048):
+        self.window_size = window_size; self.started_at = time.time(); self._lock = threading.Lock()
+        self._recent = {}; self._totals = {}; self.counters = {}; self.gauges = {}
+        self._trace = None; self._trace_lanes = {}
+
+    def configure(self, window_size: int = 2048, trace_file: str | None = None):
+        with self._lock:
+            if window_size != self.window_size:
+                self.window_size = window_size; self._recent = {stage: deque(spans, maxlen=window_size) for stage, spans in self._recent.items()}
+            if self._trace: self._trace.close(); self._trace = None; self._trace_lanes = {}
+            if trace_file:
+                # Chrome trace event format. The array is left open, which Perfetto and speedscope accept,
+                # so a crash never leaves the file unreadable.
+                new_file = not os.path.exists(trace_file) or os.path.getsize(trace_file) == 0
+                self._trace = open(trace_file, 'a', encoding='utf-8')
+                if new_file: self._trace.write("[\n")
+
+    # --- Recording -------------------------------------------------------------
+    @contextmanager
+    def span(self, stage: str):
+        """Times the enclosed block (including any awaits inside it) as one `stage` span."""
+        started_wall = time.time(); started = time.perf_counter()
+        try: yield
+        finally: self.observe(stage, time.perf_counter() - started, started_wall)
+
+    def observe(self, stage: str, seconds: float, started_wall: float | None = None):
+        ended = time.time()
+        with self._lock:
+            self._recent.setdefault(stage, deque(maxlen=self.window_size)).append((ended, seconds))
+            totals = self._totals.setdefault(stage, [0, 0.0]); totals[0] += 1; totals[1] += seconds
+            if self._trace: self._write_trace(stage, started_wall or ended - seconds, seconds)
+
+    def _write_trace(self, stage, started_wall, seconds):
+        lane = self._trace_lanes.get(stage)
+        if lane is None:
+            # One named lane per stage keeps concurrent spans of different stages from nesting into each other.
+            lane = self._trace_lanes[stage] = len(self._trace_lanes) + 1
+            self._trace.write(json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': lane, 'args': {'name': stage}}) + ",\n")
+        self._trace.write(json.dumps({'name': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': lane, 'ts': int(started_wall * 1e6), 'dur': int(seconds * 1e6)}) + ",\n")
+        self._trace.flush()
+
+    def count(self, name: str, amount: float = 1):
+        with self._lock: self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock: self.gauges[name] = value
+
+    # --- Reading -----------------------------------------------------------------
+    def stages(self) -> list:
+        with self._lock: return sorted(self._totals)
+
+    def percentiles(self, stage: str, window_seconds: float | None = None) -> tuple[int, float | None, float | None]:
+        """(span count, p50, p95) over the spans that ended in the last `window_seconds` (all retained spans if None)."""
+        cutoff = time.time() - window_seconds if window_seconds else 0
+        with self._lock: durations = sorted(seconds for ended, seconds in self._recent.get(stage, ()) if ended >= cutoff)
+        if not durations: return 0, None, None
+        def rank(q): return durations[min(len(durations) - 1, max(0, int(round(q * len(durations))) - 1))]
+        return len(durations), rank(0.5), rank(0.95)
+
+    def render_prometheus(self) -> str:
+        def name_of(metric): return ''.join(c if c.isalnum() else '_' for c in metric)
+        def label(value): return str(value).replace('\\', '\\\\').replace('"', '\\"')
+        lines = ["# HELP shortsbot_stage_seconds Duration of pipeline stages (quantiles over the recent window).", "# TYPE shortsbot_stage_seconds summary"]
+        for stage in self.stages():
+            _, p50, p95 = self.percentiles(stage)
+            with self._lock: count, total = self._totals[stage]
+            if p50 is not None: lines += [f'shortsbot_stage_seconds{{stage="{label(stage)}",quantile="0.5"}} {p50:.6f}', f'shortsbot_stage_seconds{{stage="{label(stage)}",quantile="0.95"}} {p95:.6f}']
+            lines += [f'shortsbot_stage_seconds_sum{{stage="{label(stage)}"}} {total:.6f}', f'shortsbot_stage_seconds_count{{stage="{label(stage)}"}} {count}']
+        with self._lock: counters = dict(self.counters); gauges = dict(self.gauges)
+        for name, value in sorted(counters.items()): lines += [f"# TYPE shortsbot_{name_of(name)}_total counter", f"shortsbot_{name_of(name)}_total {value}"]
+        for name, value in sorted(gauges.items()): lines += [f"# TYPE shortsbot_{name_of(name)} gauge", f"shortsbot_{name_of(name)} {value}"]
+        lines += ["# TYPE shortsbot_uptime_seconds gauge", f"shortsbot_uptime_seconds {time.time() - self.started_at:.0f}"]
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+
+def span(stage: str): return METRICS.span(stage)
+def observe(stage: str, seconds: float): METRICS.observe(stage, seconds)
+def count(name: str, amount: float = 1): METRICS.count(name, amount)
+def set_gauge(name: str, value: float): METRICS.set_gauge(name, value)
+
+async def start_http_server(port: int, host: str = "127.0.0.1"):
+    """Serves METRICS.render_prometheus() as text on http://host:port/metrics. Returns the asyncio server."""
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""): pass
+            path = request_line.split()[1].decode() if len(request_line.split()) > 1 else "/"
+            status, body = ("200 OK", METRICS.render_prometheus()) if path.split('?')[0] in ("/", "/metrics") else ("404 Not Found", "not found\n")
+            payload = body.encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError): pass
+        finally: writer.close()
+    server = await asyncio.start_server(handle, host, port)
+    logging.info(f"📈 Metrics served on http://{host}:{port}/metrics"); return server
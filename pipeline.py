@@ -0,0 +1,174 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Streaming Clip Pipeline - SPLIT > SUBTITLE > BURN > UPLOAD
+# -----------------------------------------------------------------------------
+import asyncio, contextlib, logging, os
+from datetime import datetime, timezone
+
+import helpers, leasing, metrics, utils
+
+class ClipPipeline:
+    """Streams clips through split, subtitle, burn and upload stages connected by bounded queues. Clip N can upload while
+    N+1 burns and N+2 splits, and a full queue holds the stage before it back. Each finished stage is saved on the clip
+    record (status 'rendering' plus 'stage'), so after a restart a clip resumes from the last stage it completed.
+    In cluster mode each clip is leased just before it is split and released once it is rendered or has failed, so
+    several nodes can run pipelines over the same source and render disjoint clips. Every encode first takes room from
+    the disk budget (see DiskBudget), so rendering slows down instead of filling the staging folder or the disk."""
+    def __init__(self, workflow, reporter, channel, source_video_name, source_video_path, transcript=None):
+        self.workflow = workflow; self.reporter = reporter; self.channel = channel; self.config = workflow.cog.config; self.store = workflow.cog.store; self.leases = workflow.cog.leases; self.disk = workflow.cog.disk
+        self.source_video_name = source_video_name; self.source_video_path = source_video_path; self.transcript = transcript
+        queue_size = max(1, int(self.config.get('pipeline', {}).get('queue_size', 2)))
+        self.queues = {stage: asyncio.Queue(maxsize=queue_size) for stage in ('split', 'subtitle', 'burn', 'upload')}
+        # Split and burn both run encoders, so they share one CPU budget.
+        self.render_slots = asyncio.Semaphore(workflow._max_parallel_clips())
+        self.results = {}; self.failed = False; self.uploaded = 0; self.parked = 0; self.background_tasks = set(); self.to_render = 0
+        self.claimed = set(); self.stopped = False; self._render_tasks = []
+
+    # --- Stage persistence -------------------------------------------------
+    async def _save_stage(self, clip_path, stage, **extra):
+        await self.workflow._db(self.store.set_clip, self.source_video_name, os.path.basename(clip_path), {'status': 'rendering', 'stage': stage, 'created_at': datetime.now(timezone.utc).isoformat(), **extra})
+
+    async def _finish_render(self, clip_number, in_flight_path, final_path):
+        def write():
+            with self.store.transaction():
+                if in_flight_path and os.path.basename(in_flight_path) != os.path.basename(final_path): self.store.delete_clip(self.source_video_name, os.path.basename(in_flight_path))
+                self.store.set_clip(self.source_video_name, os.path.basename(final_path), {'status': 'pending_upload', 'created_at': datetime.now(timezone.utc).isoformat()})
+        await self.workflow._db(write)
+        if self.disk and os.path.exists(final_path): self.disk.record(os.path.getsize(final_path), self.config['video']['clip_duration_seconds'])
+        await self._done(clip_number, final_path)
+
+    async def _done(self, clip_number, final_path):
+        """Records the clip's result and hands back its lease. A failed clip has no record, so any node can lease it again."""
+        self.results[clip_number] = final_path
+        if self.leases: await self.leases.release(leasing.clip_resource(self.source_video_name, clip_number))
+
+    async def _claim(self, clip_numbers):
+        """The clips this node should render: those with no record yet and, in cluster mode, whose lease it could take."""
+        recorded = {self.workflow._parse_clip_number(name) for name in await self.workflow._db(self.store.get_clips, self.source_video_name)}
+        claimed = [n for n in clip_numbers if n not in recorded and (not self.leases or await self.leases.acquire(leasing.clip_resource(self.source_video_name, n)))]
+        self.claimed.update(claimed); return claimed
+
+    def _room(self, clips):
+        return self.disk.room(clips, self.config['video']['clip_duration_seconds'], self.reporter) if self.disk else contextlib.nullcontext()
+
+    def _rendered(self, clip_number):
+        """True when the clip's encode is already on disk (pre-split by a batch, or left by an earlier run)."""
+        return any(os.path.exists(utils.get_clip_output_path(self.source_video_path, clip_number, subtitled)) for subtitled in (True, False))
+
+    def cancel(self):
+        """!stop: cancels the render stages at once, which terminates their running FFmpeg encodes. Clips already queued
+        for upload still go out. A MoviePy burn cannot be interrupted; its clip is burned again on the next run."""
+        self.stopped = True
+        for task in self._render_tasks: task.cancel()
+
+    async def _park(self):
+        """After a stop, leaves the clips this run took but did not finish resumable. Clips still being split have no record
+        yet, so they get a 'cancelled' one; resume_items() re-splits those on the next run."""
+        recorded = {self.workflow._parse_clip_number(name) for name in await self.workflow._db(self.store.get_clips, self.source_video_name)}
+        for clip_number in sorted(self.claimed - set(self.results)):
+            if clip_number not in recorded: await self._save_stage(utils.get_clip_output_path(self.source_video_path, clip_number), 'cancelled')
+            if self.leases: await self.leases.release(leasing.clip_resource(self.source_video_name, clip_number))
+
+    async def resume_items(self):
+        """Returns (stage queue, item) pairs for clips a previous run left mid-pipeline, plus clip numbers that must be re-split."""
+        resumable = []; resplit = []
+        for source, clip_name, record in await self.workflow._db(self.store.clips_with_status, 'rendering'):
+            if source != self.source_video_name: continue
+            clip_path = utils.find_clip(clip_name); clip_number = self.workflow._parse_clip_number(clip_name)
+            if clip_number is None: continue
+            # Another node's clip mid-pipeline: it is still working on it.
+            if self.leases and not await self.leases.acquire(leasing.clip_resource(self.source_video_name, clip_number)): continue
+            self.claimed.add(clip_number)
+            srt_path = record.get('srt_path')
+            if record.get('stage') == 'subtitled' and os.path.exists(clip_path) and srt_path and os.path.exists(srt_path):
+                resumable.append(('burn', {'clip_number': clip_number, 'path': clip_path, 'srt_path': srt_path}))
+            elif record.get('stage') == 'split' and os.path.exists(clip_path):
+                resumable.append(('subtitle', {'clip_number': clip_number, 'path': clip_path}))
+            else: await self.workflow._db(self.store.delete_clip, self.source_video_name, clip_name); resplit.append(clip_number)
+        return resumable, resplit
+
+    # --- Stages ------------------------------------------------------------
+    async def _split(self, item):
+        clip_number = item['clip_number']
+        if self.failed: await self._done(clip_number, None); return  # Like the old sequential loop, stop starting new clips once one has failed.
+        async with self._room(0 if self._rendered(clip_number) else 1), self.render_slots: clip_path, subtitled = await self.workflow.split_clip(self.reporter, self.source_video_path, clip_number, self.transcript, self.to_render)
+        self.to_render -= 1
+        if not clip_path: self.failed = True; await self._done(clip_number, None); return
+        if subtitled or not self.config['subtitles']['enabled']: await self._finish_render(clip_number, None, clip_path); await self._put('upload', {'clip_number': clip_number, 'path': clip_path}); return
+        await self._save_stage(clip_path, 'split'); await self._put('subtitle', {'clip_number': clip_number, 'path': clip_path})
+
+    async def _subtitle(self, item):
+        clip_number, clip_path = item['clip_number'], item['path']
+        srt_path = await self.workflow.subtitle_clip(self.reporter, self.source_video_path, clip_number, clip_path, self.transcript)
+        if not srt_path: await self._finish_render(clip_number, clip_path, clip_path); await self._put('upload', item); return
+        await self._save_stage(clip_path, 'subtitled', srt_path=srt_path); await self._put('burn', {**item, 'srt_path': srt_path})
+
+    async def _burn(self, item):
+        clip_number, clip_path = item['clip_number'], item['path']
+        async with self._room(1), self.render_slots: final_path = await self.workflow.burn_clip(self.reporter, clip_number, clip_path, item['srt_path'])
+        await self._finish_render(clip_number, clip_path, final_path); await self._put('upload', {'clip_number': clip_number, 'path': final_path})
+
+    async def _upload(self, item):
+        # Without quota the clip stays 'pending_upload' on disk; the regular upload pass picks it up after the reset.
+        if not self.workflow.is_online or not self.workflow.cog.quota.admit_upload(): self._park_upload(item); return
+        slots = await self.workflow._db(helpers.reserve_schedule_slots, self.store, 1)
+        if not slots: self.workflow.cog.quota.release_upload(); self._park_upload(item); return
+        await self.workflow.upload_clip_task(self.channel, self.source_video_name, item['path'], item['clip_number'], next_schedule_timestamp=slots[0], background_tasks=self.background_tasks)
+        self.uploaded += 1
+
+    def _park_upload(self, item):
+        # A staged clip that cannot go out now is moved to disk, so the staging folder only holds clips about to upload.
+        if self.disk: self.disk.spill(item['path'])
+        self.parked += 1
+
+    async def _put(self, stage, item):
+        await self.queues[stage].put(item); metrics.set_gauge(f"queue_depth_{stage}", self.queues[stage].qsize())
+
+    async def _worker(self, stage, handler):
+        queue = self.queues[stage]
+        while True:
+            item = await queue.get(); metrics.set_gauge(f"queue_depth_{stage}", queue.qsize())
+            try: await handler(item)
+            except Exception as e:
+                logging.error(f"💥 Pipeline {stage} stage crashed on clip #{item.get('clip_number')}: {e}", exc_info=True)
+                if stage != 'upload': self.failed = True; await self._done(item['clip_number'], None)
+            finally: queue.task_done()
+
+    async def run(self, clip_numbers, resumable=()):
+        """Pushes `clip_numbers` (plus any resumed items) through every stage. Returns {clip_number: final clip path or None}."""
+        render_workers = self.workflow._max_parallel_clips(); upload_workers = max(1, int(self.config['bot'].get('max_concurrent_uploads', 3)))
+        workers = [asyncio.create_task(self._worker('split', self._split)) for _ in range(render_workers)]
+        # Enough subtitle workers to fill a transcription batch when clips fall back to per-clip Whisper.
+        subtitle_config = self.config['subtitles']; subtitle_workers = max(1, int(subtitle_config.get('whisper_workers', 1)) * int(subtitle_config.get('whisper_batch_size', 4)))
+        workers += [asyncio.create_task(self._worker('subtitle', self._subtitle)) for _ in range(subtitle_workers)]
+        workers += [asyncio.create_task(self._worker('burn', self._burn)) for _ in range(render_workers)]
+        feeder = asyncio.create_task(self._feed(clip_numbers, resumable)); self._render_tasks = workers + [feeder]
+        if self.stopped: self.cancel()
+        workers += [asyncio.create_task(self._worker('upload', self._upload)) for _ in range(upload_workers)]
+        try:
+            try: await feeder
+            except asyncio.CancelledError:
+                if not self.stopped: raise
+            if self.stopped: await self._park()
+            await self.queues['upload'].join()
+            if self.background_tasks: await asyncio.gather(*list(self.background_tasks), return_exceptions=True)
+        finally:
+            for worker in workers: worker.cancel()
+            # Whatever this run left in the staging folder (base clips of a stopped run, failed uploads) is kept on disk.
+            if self.disk: self.disk.spill_all(f"{os.path.splitext(self.source_video_name)[0]} part ")
+        return self.results
+
+    async def _feed(self, clip_numbers, resumable):
+        """Claims and splits clips chunk by chunk, then waits for every render stage to drain."""
+        self.to_render = len(clip_numbers)
+        for stage, item in resumable: await self._put(stage, item)
+        batch_mode = self.config['video'].get('split_mode', 'batch') == 'batch'
+        batch_size = max(1, int(self.config['video'].get('batch_split_size', 8))) if batch_mode else 1
+        for offset in range(0, len(clip_numbers), batch_size):
+            if self.failed: break
+            chunk = await self._claim(clip_numbers[offset:offset + batch_size]); self.to_render -= min(batch_size, len(clip_numbers) - offset) - len(chunk)
+            if not chunk: continue
+            if batch_mode:
+                async with self._room(sum(1 for n in chunk if not self._rendered(n))), self.render_slots: await self.workflow.batch_split_clips(self.reporter, self.source_video_path, chunk, self.transcript, clips_to_render=len(clip_numbers) - offset)
+            for clip_number in chunk: await self._put('split', {'clip_number': clip_number})
+        # Items only move forward, so draining the queues in stage order drains the whole pipeline.
+        for stage in ('split', 'subtitle', 'burn'): await self.queues[stage].join()
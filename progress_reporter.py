@@ -0,0 +1,58 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Progress Reporter - COALESCING DISCORD DASHBOARD
+# -----------------------------------------------------------------------------
+import asyncio, contextlib, logging
+
+import discord
+
+class ProgressReporter:
+    """One Discord dashboard message shared by every running stage. report() only records the newest line for a key and
+    never waits on Discord. A background task edits the message at most once per interval with whatever is newest."""
+    MAX_MESSAGE_LENGTH = 2000
+
+    def __init__(self, channel, title: str, interval: float = 3.0):
+        self.channel = channel; self.title = title; self.interval = interval
+        self._lines = {}; self._dirty = False; self._message = None; self._task = None
+
+    async def start(self):
+        if self.channel: self._message = await self.channel.send(self.title)
+        self._task = asyncio.create_task(self._flush_loop())
+        return self
+
+    def report(self, key: str, text: str):
+        if self._lines.get(key) != text: self._lines[key] = text; self._dirty = True
+
+    def remove(self, key: str):
+        if self._lines.pop(key, None) is not None: self._dirty = True
+
+    def _render(self) -> str:
+        content = self.title; shown = 0
+        for text in self._lines.values():
+            if len(content) + len(text) + 40 > self.MAX_MESSAGE_LENGTH: break
+            content += f"\n{text}"; shown += 1
+        if shown < len(self._lines): content += f"\n...and {len(self._lines) - shown} more."
+        return content
+
+    async def _flush(self):
+        if not self._dirty or not self._message: return
+        self._dirty = False
+        try: await self._message.edit(content=self._render())
+        except asyncio.CancelledError: self._dirty = True; raise  # close() cancelled this edit; its final flush sends it again.
+        except discord.NotFound: self._message = await self.channel.send(self._render())
+        except discord.HTTPException as e: logging.warning(f"⚠️ Could not update progress dashboard: {e}"); self._dirty = True
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try: await self._flush()
+            except Exception as e: logging.error(f"💥 Progress dashboard error: {e}", exc_info=True)
+
+    async def close(self, final_line: str | None = None):
+        """Stops the flush task and writes the final state once."""
+        if self._task:
+            # Waiting for the cancelled task means its edit cannot land after (and overwrite) the final one.
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError): await self._task
+            self._task = None
+        if final_line: self.report('_final', final_line)
+        await self._flush()
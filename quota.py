@@ -0,0 +1,122 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Quota Ledger - PACIFIC-DAY ACCOUNTING & UPLOAD PLANNER
+# -----------------------------------------------------------------------------
+import logging, time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# YouTube Data API quota resets at midnight Pacific time, not UTC.
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+LEDGER_KEY = 'quota_ledger'
+
+def quota_day(now: datetime | None = None) -> str:
+    return (now or datetime.now(timezone.utc)).astimezone(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+def next_reset(now: datetime | None = None) -> datetime:
+    """The next quota reset (Pacific midnight) as an aware UTC datetime."""
+    local = (now or datetime.now(timezone.utc)).astimezone(QUOTA_TIMEZONE)
+    midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time(), tzinfo=QUOTA_TIMEZONE)
+    return midnight.astimezone(timezone.utc)
+
+class QuotaLedger:
+    """Per-day quota accounting that every YouTube call goes through. admit() reserves the cost of the calls an operation
+    will make, or returns False so the caller can defer it to the next reset. charge() turns a reservation into real spend
+    once the call has been attempted. Failed calls still cost quota, so they are charged too. The ledger is written to the
+    store at most every `flush_seconds`, and charges are summed into one Discord notice per `notice_seconds`."""
+    def __init__(self, store, daily_limit: int, max_uploads_per_day: int, api_costs: dict, flush_seconds: float = 30, notice_seconds: float = 600):
+        self.store = store; self.daily_limit = daily_limit; self.max_uploads_per_day = max_uploads_per_day; self.api_costs = api_costs
+        self.flush_seconds = flush_seconds; self.notice_seconds = notice_seconds
+        self.reserved_units = 0; self.reserved_uploads = 0; self._dirty = False; self._last_flush = time.monotonic(); self._last_notice = 0.0; self._unreported = {}
+        saved = store.get_meta(LEDGER_KEY)
+        if saved is None:
+            # Carry over the old UTC-dated tracker once, so upgrading mid-day does not forget what was already spent.
+            legacy = store.get_meta('quota_tracker') or {}
+            saved = {'day': quota_day(), 'spent': legacy.get('spent', 0), 'uploads': legacy.get('uploads_today', 0)} if legacy.get('date') == datetime.now(timezone.utc).strftime('%Y-%m-%d') else {}
+        if saved.get('day') == quota_day(): self.day = saved['day']; self.spent = saved.get('spent', 0); self.uploads = saved.get('uploads', 0); self.calls = saved.get('calls', {})
+        else: self.day = quota_day(); self.spent = 0; self.uploads = 0; self.calls = {}
+
+    @classmethod
+    def from_config(cls, config, store):
+        youtube = config['youtube']
+        return cls(store, youtube['daily_quota_limit'], config['bot']['max_uploads_per_day'], youtube['api_costs'],
+                   youtube.get('quota_flush_seconds', 30), youtube.get('quota_notice_minutes', 10) * 60)
+
+    @property
+    def upload_cost(self) -> int: return self.api_costs.get('upload', 0) + self.api_costs.get('playlist_item_insert', 0)
+
+    def _roll_over(self):
+        if quota_day() == self.day: return
+        logging.info(f"🌅 Quota reset: {self.day} closed at {self.spent:,} units and {self.uploads} uploads.")
+        self.flush(force=True); self.day = quota_day(); self.spent = 0; self.uploads = 0; self.calls = {}; self._dirty = True
+
+    # --- Admission -------------------------------------------------------------
+    def remaining(self) -> int:
+        self._roll_over(); return self.daily_limit - self.spent - self.reserved_units
+
+    def upload_capacity(self) -> int:
+        """Uploads (insert plus playlist item) that can still be admitted today."""
+        remaining = self.remaining(); by_units = remaining // self.upload_cost if self.upload_cost else remaining
+        return max(0, min(by_units, self.max_uploads_per_day - self.uploads - self.reserved_uploads))
+
+    def admit(self, *actions: str) -> bool:
+        """Reserves quota for `actions` (one API call each). False means the calls do not fit today and must wait."""
+        cost = sum(self.api_costs.get(action, 0) for action in actions); uploads = actions.count('upload')
+        if cost > self.remaining() or (uploads and self.uploads + self.reserved_uploads + uploads > self.max_uploads_per_day): return False
+        self.reserved_units += cost; self.reserved_uploads += uploads; return True
+
+    def admit_upload(self) -> bool: return self.admit('upload', 'playlist_item_insert')
+
+    def release(self, action: str):
+        """Returns an admitted call's reservation without charging it (the call was never made)."""
+        self.reserved_units = max(0, self.reserved_units - self.api_costs.get(action, 0))
+        if action == 'upload': self.reserved_uploads = max(0, self.reserved_uploads - 1)
+
+    def release_upload(self): self.release('upload'); self.release('playlist_item_insert')
+
+    def charge(self, action: str, reserved: bool = True):
+        """Records an attempted call. Pass reserved=False for calls made without admit()."""
+        if reserved: self.release(action)
+        self._roll_over(); cost = self.api_costs.get(action, 0)
+        self.spent += cost; self.calls[action] = self.calls.get(action, 0) + 1
+        if action == 'upload': self.uploads += 1
+        count, units = self._unreported.get(action, (0, 0)); self._unreported[action] = (count + 1, units + cost)
+        self._dirty = True; self.flush()
+
+    def exhaust(self):
+        """The API answered quotaExceeded: whatever our estimate says, nothing more fits today."""
+        self._roll_over(); self.spent = max(self.spent, self.daily_limit); self._dirty = True; self.flush(force=True)
+
+    @property
+    def exhausted(self) -> bool: return self.remaining() + self.reserved_units <= 0
+
+    def seconds_until_reset(self) -> float: return max(0.0, (next_reset() - datetime.now(timezone.utc)).total_seconds())
+
+    # --- Persistence and notices -------------------------------------------------
+    def flush(self, force: bool = False):
+        if not self._dirty or (not force and time.monotonic() - self._last_flush < self.flush_seconds): return
+        self.store.set_meta(LEDGER_KEY, {'day': self.day, 'spent': self.spent, 'uploads': self.uploads, 'calls': self.calls})
+        self._dirty = False; self._last_flush = time.monotonic()
+
+    def take_notice(self, force: bool = False) -> str | None:
+        """One summary of the charges since the last notice, at most once per notice interval (or now, with force)."""
+        if not self._unreported or (not force and time.monotonic() - self._last_notice < self.notice_seconds): return None
+        parts = ", ".join(f"{count}× `{action}` ({units:,})" for action, (count, units) in self._unreported.items())
+        self._unreported = {}; self._last_notice = time.monotonic()
+        return f"📊 Quota Update: {parts}. Est. usage: **{self.spent:,} / {self.daily_limit:,}** (`{self.daily_limit - self.spent:,}` remaining)."
+
+    # --- Planning ------------------------------------------------------------------
+    def plan(self, pending: int, slots: list | None, max_days: int = 14) -> list:
+        """Spreads `pending` uploads over quota days, as many per day as quota and max_uploads_per_day allow. Each day gets
+        the next unused publish slots in order, so the schedule fills as densely as the quota permits.
+        Returns [{'day', 'uploads', 'first_slot', 'last_slot'}], today first."""
+        per_day = min(self.max_uploads_per_day, self.daily_limit // self.upload_cost if self.upload_cost else self.max_uploads_per_day)
+        plan = []; planned = 0; day = datetime.now(timezone.utc).astimezone(QUOTA_TIMEZONE).date(); capacity = self.upload_capacity()
+        while planned < pending and len(plan) < max_days:
+            uploads = min(capacity, pending - planned)
+            if uploads:
+                entry = {'day': day.isoformat(), 'uploads': uploads, 'first_slot': None, 'last_slot': None}
+                if slots and len(slots) >= planned + uploads: entry.update(first_slot=slots[planned], last_slot=slots[planned + uploads - 1])
+                plan.append(entry); planned += uploads
+            if per_day <= 0: break
+            day += timedelta(days=1); capacity = per_day
+        return plan
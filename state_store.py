@@ -0,0 +1,209 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Progress State Store - SQLITE WAL VERSION
+# -----------------------------------------------------------------------------
+import json, logging, os, sqlite3, threading, time
+from contextlib import contextmanager
+
+import metrics
+
+CLIP_COLUMNS = ('status', 'youtube_id', 'publish_at', 'reason', 'created_at')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, status TEXT, playlist_id TEXT, data TEXT NOT NULL DEFAULT '{}');
+CREATE TABLE IF NOT EXISTS clips (
+    source TEXT NOT NULL REFERENCES sources(name) ON DELETE CASCADE ON UPDATE CASCADE, name TEXT NOT NULL,
+    status TEXT, youtube_id TEXT, publish_at TEXT, reason TEXT, created_at TEXT, data TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (source, name));
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS media_probes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS source_fingerprints (source TEXT PRIMARY KEY REFERENCES sources(name) ON DELETE CASCADE ON UPDATE CASCADE, fingerprint TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS source_aliases (alias TEXT PRIMARY KEY, source TEXT NOT NULL REFERENCES sources(name) ON DELETE CASCADE ON UPDATE CASCADE);
+CREATE TABLE IF NOT EXISTS leases (resource TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, data TEXT NOT NULL DEFAULT '{}');
+CREATE INDEX IF NOT EXISTS sources_by_status ON sources(status);
+CREATE INDEX IF NOT EXISTS sources_by_fingerprint ON source_fingerprints(fingerprint);
+CREATE INDEX IF NOT EXISTS clips_by_status ON clips(status);
+CREATE INDEX IF NOT EXISTS clips_by_publish_at ON clips(publish_at) WHERE status = 'uploaded';
+"""
+
+class ProgressStore:
+    """Transactional replacement for progress.json. Every write is committed on its own, so a crash never leaves half-written state."""
+    def __init__(self, db_path: str, wal: bool = True):
+        self.db_path = db_path; self._lock = threading.RLock(); self._depth = 0
+        # Render nodes may share the file, so a writer waits for another's lock instead of failing at once.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        # WAL relies on shared memory, which network filesystems do not provide; a shared database uses a rollback journal.
+        if db_path != ':memory:': self._conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}"); self._conn.execute(f"PRAGMA synchronous={'NORMAL' if wal else 'FULL'}")
+        self._conn.execute("PRAGMA foreign_keys=ON"); self._conn.executescript(SCHEMA)
+
+    def close(self): self._conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Groups several writes into one commit. Nested calls join the outer transaction."""
+        with self._lock:
+            if self._depth == 0: self._conn.execute("BEGIN IMMEDIATE"); started = time.perf_counter()
+            self._depth += 1
+            try: yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0: self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._depth -= 1
+                if self._depth == 0: self._conn.execute("COMMIT"); metrics.observe('store_commit', time.perf_counter() - started)
+
+    def _execute(self, sql, params=()):
+        with self.transaction(): return self._conn.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._lock: return self._conn.execute(sql, params).fetchall()
+
+    # --- One-time migration -------------------------------------------------
+    def migrate_from_json(self, json_path: str) -> bool:
+        """Imports an existing progress.json into an empty store, then renames the JSON so it is never imported twice."""
+        if not os.path.exists(json_path) or self._query("SELECT 1 FROM sources LIMIT 1"): return False
+        try:
+            with open(json_path, "r") as f: progress = json.load(f)
+        except (OSError, json.JSONDecodeError) as e: logging.error(f"❌ Could not migrate {json_path}: {e}"); return False
+        with self.transaction():
+            for source_name, source_data in progress.get('source_videos', {}).items():
+                self.add_source(source_name, source_data.get('status'), source_data.get('playlist_id'))
+                for clip_name, clip_data in source_data.get('clips', {}).items(): self.set_clip(source_name, clip_name, clip_data)
+            for key in ('last_scheduled_time', 'quota_tracker'):
+                if progress.get(key) is not None: self.set_meta(key, progress[key])
+        os.replace(json_path, json_path + ".migrated")
+        logging.info(f"✅ Migrated {len(progress.get('source_videos', {}))} source videos from {os.path.basename(json_path)}."); return True
+
+    # --- Source videos ------------------------------------------------------
+    def get_source(self, name: str) -> dict | None:
+        rows = self._query("SELECT status, playlist_id, data FROM sources WHERE name = ?", (name,))
+        if not rows: return None
+        return {**json.loads(rows[0]['data']), 'status': rows[0]['status'], 'playlist_id': rows[0]['playlist_id']}
+
+    def has_source(self, name: str) -> bool: return bool(self._query("SELECT 1 FROM sources WHERE name = ?", (name,)))
+
+    def get_source_status(self, name: str) -> str | None:
+        rows = self._query("SELECT status FROM sources WHERE name = ?", (name,)); return rows[0]['status'] if rows else None
+
+    def sources_with_status(self, status: str) -> list:
+        return [row['name'] for row in self._query("SELECT name FROM sources WHERE status = ? ORDER BY rowid", (status,))]
+
+    def add_source(self, name: str, status: str, playlist_id: str | None = None):
+        """Creates (or resets) a source video record, dropping any clips it had."""
+        with self.transaction():
+            self._conn.execute("DELETE FROM sources WHERE name = ?", (name,))
+            self._conn.execute("INSERT INTO sources (name, status, playlist_id) VALUES (?, ?, ?)", (name, status, playlist_id))
+
+    def update_source_data(self, name: str, **fields):
+        """Merges `fields` into the source's free-form data (e.g. its render plan)."""
+        with self.transaction():
+            rows = self._conn.execute("SELECT data FROM sources WHERE name = ?", (name,)).fetchall()
+            if rows: self._conn.execute("UPDATE sources SET data = ? WHERE name = ?", (json.dumps({**json.loads(rows[0]['data']), **fields}), name))
+
+    def set_source_status(self, name: str, status: str): self._execute("UPDATE sources SET status = ? WHERE name = ?", (status, name))
+
+    def delete_source(self, name: str): self._execute("DELETE FROM sources WHERE name = ?", (name,))
+
+    def rename_source(self, old_name: str, new_name: str):
+        """Moves a source and everything hanging off it (clips, fingerprint, aliases) to `new_name`. The old name stays as an alias."""
+        with self.transaction():
+            self._conn.execute("UPDATE sources SET name = ? WHERE name = ?", (new_name, old_name))
+            self._conn.execute("INSERT INTO source_aliases (alias, source) VALUES (?, ?) ON CONFLICT (alias) DO UPDATE SET source = excluded.source", (old_name, new_name))
+            self._conn.execute("DELETE FROM source_aliases WHERE alias = ?", (new_name,))
+
+    def resolve_source(self, name: str) -> str | None:
+        """The current name of a source known as `name`, following renames. None if it is unknown."""
+        if self.has_source(name): return name
+        rows = self._query("SELECT source FROM source_aliases WHERE alias = ?", (name,)); return rows[0]['source'] if rows else None
+
+    # --- Content fingerprints -------------------------------------------------
+    def set_source_fingerprint(self, name: str, fingerprint: str):
+        self._execute("INSERT INTO source_fingerprints (source, fingerprint) VALUES (?, ?) ON CONFLICT (source) DO UPDATE SET fingerprint = excluded.fingerprint", (name, fingerprint))
+
+    def get_source_fingerprint(self, name: str) -> str | None:
+        rows = self._query("SELECT fingerprint FROM source_fingerprints WHERE source = ?", (name,)); return rows[0]['fingerprint'] if rows else None
+
+    def source_with_fingerprint(self, fingerprint: str) -> str | None:
+        rows = self._query("SELECT source FROM source_fingerprints WHERE fingerprint = ? ORDER BY rowid LIMIT 1", (fingerprint,)); return rows[0]['source'] if rows else None
+
+    # --- Clips --------------------------------------------------------------
+    def _clip_from_row(self, row) -> dict:
+        record = json.loads(row['data'])
+        record.update({column: row[column] for column in CLIP_COLUMNS if row[column] is not None})
+        return record
+
+    def set_clip(self, source: str, name: str, record: dict):
+        """Replaces a clip record, like assigning progress['source_videos'][source]['clips'][name] used to."""
+        columns = [record.get(column) for column in CLIP_COLUMNS]; extra = json.dumps({k: v for k, v in record.items() if k not in CLIP_COLUMNS})
+        self._execute(
+            f"INSERT INTO clips (source, name, {', '.join(CLIP_COLUMNS)}, data) VALUES (?, ?, {', '.join('?' * len(CLIP_COLUMNS))}, ?) "
+            f"ON CONFLICT (source, name) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in CLIP_COLUMNS)}, data = excluded.data",
+            (source, name, *columns, extra))
+
+    def delete_clip(self, source: str, name: str): self._execute("DELETE FROM clips WHERE source = ? AND name = ?", (source, name))
+
+    def get_clips(self, source: str) -> dict:
+        return {row['name']: self._clip_from_row(row) for row in self._query("SELECT * FROM clips WHERE source = ? ORDER BY rowid", (source,))}
+
+    def count_clips(self, source: str) -> int: return self._query("SELECT COUNT(*) AS n FROM clips WHERE source = ?", (source,))[0]['n']
+
+    def clips_with_status(self, status: str) -> list:
+        """Returns (source, clip name, record) tuples in creation order, using the status index."""
+        return [(row['source'], row['name'], self._clip_from_row(row)) for row in self._query("SELECT * FROM clips WHERE status = ? ORDER BY rowid", (status,))]
+
+    def upcoming_uploads(self, after_iso: str, limit: int) -> tuple[int, list]:
+        """Returns (total count, first `limit` (publish_at, clip name, youtube_id) rows) of uploads scheduled after `after_iso`."""
+        total = self._query("SELECT COUNT(*) AS n FROM clips WHERE status = 'uploaded' AND publish_at > ?", (after_iso,))[0]['n']
+        rows = self._query("SELECT publish_at, name, youtube_id FROM clips WHERE status = 'uploaded' AND publish_at > ? ORDER BY publish_at LIMIT ?", (after_iso, limit))
+        return total, [(row['publish_at'], row['name'], row['youtube_id']) for row in rows]
+
+    # --- Media probe cache ----------------------------------------------------
+    def get_probe(self, path: str, size: int, mtime_ns: int) -> dict | None:
+        rows = self._query("SELECT data FROM media_probes WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns))
+        return json.loads(rows[0]['data']) if rows else None
+
+    def set_probe(self, path: str, size: int, mtime_ns: int, info: dict):
+        self._execute("INSERT INTO media_probes (path, size, mtime_ns, data) VALUES (?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                      "size = excluded.size, mtime_ns = excluded.mtime_ns, data = excluded.data", (path, size, mtime_ns, json.dumps(info)))
+
+    def move_probe(self, old_path: str, new_path: str):
+        """Carries a cached probe over to a renamed file (a rename keeps size and mtime, so the entry stays valid)."""
+        with self.transaction():
+            if not self._conn.execute("SELECT 1 FROM media_probes WHERE path = ?", (new_path,)).fetchall(): self._conn.execute("UPDATE media_probes SET path = ? WHERE path = ?", (new_path, old_path))
+
+    def prune_probes(self) -> int:
+        """Drops cached probes for files that no longer exist at their recorded path."""
+        stale = [row['path'] for row in self._query("SELECT path FROM media_probes") if not os.path.exists(row['path'])]
+        with self.transaction():
+            for path in stale: self._conn.execute("DELETE FROM media_probes WHERE path = ?", (path,))
+        return len(stale)
+
+    # --- Leases (cluster mode) -----------------------------------------------
+    def acquire_lease(self, resource: str, owner: str, ttl: float, data: dict | None = None) -> bool:
+        """Takes `resource` for `owner` until now + ttl. Succeeds if it is free, expired, or already held by `owner`."""
+        now = time.time()
+        with self.transaction():
+            self._conn.execute("INSERT INTO leases (resource, owner, expires_at, data) VALUES (?, ?, ?, ?) ON CONFLICT (resource) DO UPDATE SET "
+                               "owner = excluded.owner, expires_at = excluded.expires_at, data = excluded.data WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                               (resource, owner, now + ttl, json.dumps(data or {}), now))
+            return self._conn.execute("SELECT owner FROM leases WHERE resource = ?", (resource,)).fetchone()['owner'] == owner
+
+    def renew_leases(self, owner: str, ttl: float) -> int:
+        return self._execute("UPDATE leases SET expires_at = ? WHERE owner = ?", (time.time() + ttl, owner)).rowcount
+
+    def release_lease(self, resource: str, owner: str): self._execute("DELETE FROM leases WHERE resource = ? AND owner = ?", (resource, owner))
+
+    def release_leases(self, owner: str): self._execute("DELETE FROM leases WHERE owner = ?", (owner,))
+
+    def live_leases(self, prefix: str = '') -> list:
+        """(resource, owner, expires_at, data) of the unexpired leases whose resource starts with `prefix`."""
+        rows = self._query("SELECT * FROM leases WHERE resource >= ? AND resource < ? AND expires_at >= ? ORDER BY resource", (prefix, prefix + '\uffff', time.time()))
+        return [(row['resource'], row['owner'], row['expires_at'], json.loads(row['data'])) for row in rows]
+
+    # --- Scalar state (last_scheduled_time, quota_tracker, ...) -------------
+    def get_meta(self, key: str, default=None):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,)); return json.loads(rows[0]['value']) if rows else default
+
+    def set_meta(self, key: str, value): self._execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, json.dumps(value)))
+
+    def delete_meta(self, key: str): self._execute("DELETE FROM meta WHERE key = ?", (key,))
@@ -2,80 +2,220 @@
 # ShortsBot Subtitle Generation Module - COMPLETE MOVIEPY VERSION
 # -----------------------------------------------------------------------------
 import asyncio
+import bisect
+import json
 import logging
 import os
-from moviepy.config import change_settings
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
-from moviepy.video.tools.subtitles import SubtitlesClip
+import threading
+from collections import OrderedDict
+import metrics, supervisor
+from audio_store import AudioStore
+from transcription import TranscriptionService
 
-WHISPER_MODEL = None
+TRANSCRIPTION_SERVICE = None
+AUDIO_STORE = None
+IMAGEMAGICK_BINARY = None
 MOVIEPY_CONFIGURED = False
 
 def configure_moviepy(imagemagick_path: str):
-    """Explicitly tells MoviePy where to find the ImageMagick binary."""
-    global MOVIEPY_CONFIGURED
-    if MOVIEPY_CONFIGURED: return
+    """Records where the ImageMagick binary is. MoviePy is only imported (and pointed at it) on first use."""
+    global IMAGEMAGICK_BINARY
     if not os.path.exists(imagemagick_path):
         logging.warning(f"⚠️ ImageMagick path not found: {imagemagick_path}. Subtitles may fail.")
         return
-    try:
-        change_settings({"IMAGEMAGICK_BINARY": imagemagick_path})
-        MOVIEPY_CONFIGURED = True
-        logging.info("✅ MoviePy configuration updated successfully.")
-    except Exception as e: logging.error(f"❌ Failed to configure MoviePy path: {e}")
-
-def load_whisper_model(model_name="base"):
-    """Loads a specified Whisper model into memory."""
-    global WHISPER_MODEL
-    if WHISPER_MODEL is None:
+    IMAGEMAGICK_BINARY = imagemagick_path
+
+def _moviepy():
+    """Imports moviepy.editor on first use, which is slow because it pulls in imageio and numpy. Call it from a worker
+    thread, never from the event loop."""
+    global MOVIEPY_CONFIGURED
+    import moviepy.editor as editor
+    if IMAGEMAGICK_BINARY and not MOVIEPY_CONFIGURED:
+        from moviepy.config import change_settings
         try:
-            import whisper; WHISPER_MODEL = whisper.load_model(model_name)
-            logging.info(f"✅ Whisper model '{model_name}' loaded.")
-        except Exception as e:
-            logging.error(f"❌ Failed to load Whisper model: {e}"); WHISPER_MODEL = "failed"
-    return WHISPER_MODEL
-
-async def generate_subtitles(video_path: str) -> str | None:
-    """Takes a video file path, transcribes it, and returns the path to a sanitized .srt file."""
-    if WHISPER_MODEL == "failed" or WHISPER_MODEL is None: return None
+            change_settings({"IMAGEMAGICK_BINARY": IMAGEMAGICK_BINARY})
+            MOVIEPY_CONFIGURED = True
+            logging.info("✅ MoviePy configuration updated successfully.")
+        except Exception as e: logging.error(f"❌ Failed to configure MoviePy path: {e}")
+    return editor
+
+class CaptionCache:
+    """LRU cache of rendered caption bitmaps, keyed by text and style and bounded by memory."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes; self.current_bytes = 0; self.hits = 0; self.misses = 0
+        self._entries = OrderedDict(); self._lock = threading.Lock()
+    def get(self, key, render):
+        with self._lock:
+            if key in self._entries: self._entries.move_to_end(key); self.hits += 1; return self._entries[key]
+        entry = render(); size = sum(array.nbytes for array in entry)
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries and size <= self.max_bytes:
+                self._entries[key] = entry; self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False); self.current_bytes -= sum(array.nbytes for array in evicted)
+        return entry
+
+# Shared by every clip and source video, so common words are rasterized by ImageMagick only once.
+CAPTION_CACHE = CaptionCache(256 * 1024 * 1024)
+
+def configure_caption_cache(max_megabytes: int):
+    CAPTION_CACHE.max_bytes = int(max_megabytes * 1024 * 1024)
+
+def _render_caption(text: str, font_path: str, style: dict):
+    """Returns the (rgb, mask) arrays for a caption, rendering it through ImageMagick only on a cache miss."""
+    fontsize = style.get("fontsize", 42); color = style.get("color", 'white'); stroke_color = style.get("stroke_color", 'black'); stroke_width = style.get("stroke_width", 2.0)
+    def render():
+        clip = _moviepy().TextClip(text, font=font_path, fontsize=fontsize, color=color, stroke_color=stroke_color, stroke_width=stroke_width, method='caption', size=(1000, None))
+        rgb, mask = clip.get_frame(0), clip.mask.get_frame(0); clip.close(); return rgb, mask
+    return CAPTION_CACHE.get((text, font_path, fontsize, color, stroke_color, stroke_width), render)
+
+def start_transcription_service(model_name="base", workers=1, threads=0, batch_size=4, max_memory_mb=0, vad_margin_db=0):
+    """Starts the Whisper worker processes once; later calls (e.g. after a cog reload) reuse the running, warm service."""
+    global TRANSCRIPTION_SERVICE
+    if TRANSCRIPTION_SERVICE is None or TRANSCRIPTION_SERVICE.failed:
+        TRANSCRIPTION_SERVICE = TranscriptionService(model_name, workers, threads, batch_size, max_memory_mb, vad_margin_db).start()
+    return TRANSCRIPTION_SERVICE
+
+def configure_audio_store(directory: str | None) -> AudioStore | None:
+    """Enables the decoded-audio cache (None turns it off, and workers decode media files themselves)."""
+    global AUDIO_STORE
+    AUDIO_STORE = AudioStore(directory) if directory else None
+    return AUDIO_STORE
+
+def _srt_timestamp(seconds: float) -> str:
+    return f"{int(seconds//3600):02}:{int(seconds%3600//60):02}:{int(seconds%60):02},{int(seconds%1*1000):03}"
+
+def _srt_path_for(video_path: str) -> str:
     base_name_no_spaces = os.path.splitext(os.path.basename(video_path))[0].replace(' ', '_')
-    srt_filename = f"{base_name_no_spaces}.srt"
-    srt_path = os.path.join(os.path.dirname(video_path), srt_filename)
+    return os.path.join(os.path.dirname(video_path), f"{base_name_no_spaces}.srt")
+
+def write_srt(words: list, srt_path: str):
+    """Writes one SRT cue per word."""
+    with open(srt_path, "w", encoding="utf-8") as srt_file:
+        for word_index, word in enumerate(words, start=1):
+            srt_file.write(f"{word_index}\n{_srt_timestamp(word['start'])} --> {_srt_timestamp(word['end'])}\n{word['word']}\n\n")
+
+async def generate_subtitles(video_path: str, source_path: str | None = None, start: float | None = None, duration: float | None = None) -> str | None:
+    """Takes a video file path, transcribes it, and returns the path to a sanitized .srt file. When the clip's source and
+    window are given and the audio store is on, the window is read from the source's cached PCM instead of the clip."""
+    if TRANSCRIPTION_SERVICE is None: return None
+    srt_path = _srt_path_for(video_path)
     logging.info(f"🎤 Transcribing: {os.path.basename(video_path)}")
     try:
-        import whisper; result = await asyncio.to_thread(WHISPER_MODEL.transcribe, video_path, fp16=False, word_timestamps=True)
-        with open(srt_path, "w", encoding="utf-8") as srt_file:
-            word_index = 1
-            for segment in result['segments']:
-                for word in segment['words']:
-                    start, end, text = word['start'], word['end'], word['word'].strip()
-                    start_srt = f"{int(start//3600):02}:{int(start%3600//60):02}:{int(start%60):02},{int(start%1*1000):03}"
-                    end_srt = f"{int(end//3600):02}:{int(end%3600//60):02}:{int(end%60):02},{int(end%1*1000):03}"
-                    srt_file.write(f"{word_index}\n{start_srt} --> {end_srt}\n{text}\n\n")
-                    word_index += 1
+        audio = await AUDIO_STORE.get(source_path) if AUDIO_STORE and source_path else None
+        words = await (TRANSCRIPTION_SERVICE.transcribe(video_path, start, duration, audio=audio) if audio else TRANSCRIPTION_SERVICE.transcribe(video_path))
+        if words is None: return None
+        write_srt(words, srt_path)
         logging.info(f"✅ Subtitles generated: {os.path.basename(srt_path)}"); return srt_path
     except Exception as e:
         logging.error(f"❌ Whisper transcription failed: {e}", exc_info=True)
         if os.path.exists(srt_path): os.remove(srt_path)
         return None
 
-async def burn_subtitles_into_video(video_path: str, srt_path: str, font_path: str, style: dict) -> str | None:
+def transcript_name(source_name: str, stat) -> str:
+    """Cache file name of a source's transcript. Size and mtime are part of it, so a replaced file is transcribed again."""
+    return f"{os.path.splitext(os.path.basename(source_name))[0]}-{stat.st_size}-{stat.st_mtime_ns}.json"
+
+async def transcribe_source(source_path: str, transcripts_dir: str) -> list | None:
+    """Transcribes a whole source video once and caches its word timestamps as JSON next to the other transcripts."""
+    try: transcript_path = os.path.join(transcripts_dir, transcript_name(source_path, os.stat(source_path)))
+    except OSError as e: logging.error(f"❌ Cannot read source for transcription: {e}"); return None
+    if os.path.exists(transcript_path):
+        try:
+            with open(transcript_path, "r", encoding="utf-8") as f: return json.load(f)
+        except (OSError, json.JSONDecodeError): logging.warning(f"⚠️ Discarding unreadable transcript: {os.path.basename(transcript_path)}")
+    if TRANSCRIPTION_SERVICE is None: return None
+    logging.info(f"🎤 Transcribing source: {os.path.basename(source_path)}")
+    try:
+        audio = await AUDIO_STORE.get(source_path) if AUDIO_STORE else None
+        words = await TRANSCRIPTION_SERVICE.transcribe(source_path, audio=audio)
+        if words is None: return None
+        with open(transcript_path, "w", encoding="utf-8") as f: json.dump(words, f)
+        logging.info(f"✅ Source transcribed: {len(words)} words."); return words
+    except Exception as e:
+        logging.error(f"❌ Whisper transcription failed: {e}", exc_info=True); return None
+
+def slice_words(words: list, start_time: float, duration: float) -> list:
+    """Returns the words starting inside [start_time, start_time + duration), shifted to clip time."""
+    end_time = start_time + duration
+    first = bisect.bisect_left(words, start_time, key=lambda w: w['start']); clip_words = []
+    for word in words[first:]:
+        if word['start'] >= end_time: break
+        clip_words.append({'start': word['start'] - start_time, 'end': min(word['end'], end_time) - start_time, 'word': word['word']})
+    return clip_words
+
+def generate_clip_subtitles(words: list, video_path: str) -> str | None:
+    """Writes an already-sliced clip transcript to an .srt next to the clip."""
+    if not words: return None
+    srt_path = _srt_path_for(video_path); write_srt(words, srt_path); return srt_path
+
+ASS_COLOR_NAMES = {'white': 'FFFFFF', 'black': '000000', 'yellow': 'FFFF00', 'red': 'FF0000', 'green': '00FF00', 'blue': '0000FF',
+                   'cyan': '00FFFF', 'magenta': 'FF00FF', 'orange': 'FFA500', 'purple': '800080', 'pink': 'FFC0CB', 'gray': '808080', 'grey': '808080'}
+
+def resolve_font(font_filename: str, fonts_dir: str) -> str:
+    """Returns the font file in /fonts/ matching the configured name, or the bare name for a system font lookup."""
+    for candidate in (font_filename, f"{font_filename}.ttf", f"{font_filename}.otf"):
+        font_path = os.path.join(fonts_dir, candidate)
+        if os.path.isfile(font_path): return font_path
+    return font_filename
+
+def _ass_color(color: str) -> str:
+    hex_rgb = ASS_COLOR_NAMES.get(str(color).lower(), str(color).lstrip('#'))
+    if len(hex_rgb) != 6: logging.warning(f"⚠️ Unknown subtitle color '{color}', using white."); hex_rgb = 'FFFFFF'
+    return f"&H00{hex_rgb[4:6]}{hex_rgb[2:4]}{hex_rgb[0:2]}".upper()
+
+def _ass_timestamp(seconds: float) -> str:
+    centiseconds = int(round(seconds * 100))
+    return f"{centiseconds // 360000}:{centiseconds // 6000 % 60:02}:{centiseconds // 100 % 60:02}.{centiseconds % 100:02}"
+
+def write_ass(words: list, ass_path: str, font_name: str, style: dict):
+    """Writes clip words as an ASS track laid out like the MoviePy captions: centred, 1000px wide, bottom edge at y=1500."""
+    header = (
+        "[Script Info]\nScriptType: v4.00+\nPlayResX: 1080\nPlayResY: 1920\nWrapStyle: 0\nScaledBorderAndShadow: yes\n\n"
+        "[V4+ Styles]\nFormat: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, "
+        "ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n"
+        f"Style: Default,{font_name},{style.get('fontsize', 42)},{_ass_color(style.get('color', 'white'))},&H000000FF,"
+        f"{_ass_color(style.get('stroke_color', 'black'))},&H00000000,0,0,0,0,100,100,0,0,1,{style.get('stroke_width', 2.0)},0,2,40,40,420,1\n\n"
+        "[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+    )
+    with open(ass_path, "w", encoding="utf-8") as ass_file:
+        ass_file.write(header)
+        for word in words:
+            text = word['word'].replace('\\', '').replace('{', '').replace('}', '')
+            ass_file.write(f"Dialogue: 0,{_ass_timestamp(word['start'])},{_ass_timestamp(word['end'])},Default,,0,0,0,,{text}\n")
+
+def _escape_filter_path(path: str) -> str:
+    return path.replace('\\', '/').replace(':', '\\:')
+
+def ffmpeg_subtitle_filter(ass_path: str, fonts_dir: str) -> str:
+    """Builds the libass filter that burns an ASS track inside the split encode."""
+    return f"subtitles=filename='{_escape_filter_path(ass_path)}':fontsdir='{_escape_filter_path(fonts_dir)}'"
+
+async def burn_subtitles_into_video(video_path: str, srt_path: str, font_path: str, style: dict, threads: int = 4, preset: str = 'medium', crf: int | None = None) -> str | None:
     """Burns subtitles onto a video using the MoviePy library."""
     output_path = os.path.splitext(video_path)[0] + "_subtitled.mp4"
     logging.info(f"🔥 Burning subtitles into: {os.path.basename(video_path)} using MoviePy...")
     try:
-        generator = lambda txt: TextClip(
-            txt, font=font_path, fontsize=style.get("fontsize", 42),
-            color=style.get("color", 'white'), stroke_color=style.get("stroke_color", 'black'),
-            stroke_width=style.get("stroke_width", 2.0), method='caption', size=(1000, None)
-        )
+        def generator(txt):
+            rgb, mask = _render_caption(txt, font_path, style); editor = _moviepy()
+            return editor.ImageClip(rgb).set_mask(editor.ImageClip(mask, ismask=True))
         def process_with_moviepy():
-            video = VideoFileClip(video_path)
+            editor = _moviepy(); from moviepy.video.tools.subtitles import SubtitlesClip
+            video = editor.VideoFileClip(video_path)
             subtitles = SubtitlesClip(srt_path, generator)
-            result = CompositeVideoClip([video, subtitles.set_position(lambda t: ('center', 1500 - subtitles.get_frame(t).shape[0]))])
-            result.write_videofile(output_path, audio_codec='aac', threads=4, logger=None)
+            cues = sorted(subtitles.subtitles); cue_starts = [start for (start, _), _ in cues]
+            def caption_position(t):
+                # Position from the cached caption size instead of rendering the subtitle frame a second time.
+                i = bisect.bisect_right(cue_starts, t) - 1
+                height = _render_caption(cues[i][1], font_path, style)[0].shape[0] if i >= 0 and t < cues[i][0][1] else 1
+                return ('center', 1500 - height)
+            result = editor.CompositeVideoClip([video, subtitles.set_position(caption_position)])
+            result.write_videofile(output_path, audio_codec='aac', threads=threads, preset=preset, ffmpeg_params=['-crf', str(crf)] if crf is not None else None, logger=None)
             video.close(); result.close()
-        await asyncio.to_thread(process_with_moviepy)
+        # MoviePy's own FFmpeg cannot be cancelled, but it inherits the burn budget from the pool thread that starts it.
+        with metrics.span('moviepy_burn'): await asyncio.get_running_loop().run_in_executor(supervisor.SUPERVISOR.executor('burn'), process_with_moviepy)
+        metrics.count('bytes_rendered', os.path.getsize(output_path))
         logging.info(f"✅ Subtitles burned successfully: {os.path.basename(output_path)}")
         return output_path
     except Exception as e:
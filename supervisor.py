@@ -0,0 +1,110 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Process Supervisor - CPU BUDGETS AND CANCELLATION FOR CHILD WORK
+# -----------------------------------------------------------------------------
+import asyncio, logging, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+# Stages of external work: FFmpeg clip encodes, MoviePy burns, Whisper workers and audio decodes.
+STAGES = ('split', 'burn', 'whisper', 'audio')
+DEFAULT_BUDGETS = {'split': {'nice': 5}, 'burn': {'nice': 5}, 'whisper': {'nice': 10}, 'audio': {'nice': 10}}
+# Windows has priority classes instead of nice levels.
+BELOW_NORMAL_PRIORITY_CLASS = 0x00004000; IDLE_PRIORITY_CLASS = 0x00000040
+
+class ProcessSupervisor:
+    """Starts every external child process and keeps track of it by stage. Each stage has a budget: a nice level (a
+    priority class on Windows) and, on Linux, a set of CPUs that also caps its thread count. The children therefore
+    run below the bot's own priority and the Discord event loop stays responsive. A child whose caller is cancelled
+    is terminated (then killed after `kill_grace` seconds) and its partial output removed. kill_all() stops whatever
+    is still running on reload and shutdown."""
+    def __init__(self):
+        self.budgets = {stage: dict(budget) for stage, budget in DEFAULT_BUDGETS.items()}; self.kill_grace = 3.0
+        self._children = {}; self._executors = {}
+
+    def configure(self, config):
+        resources = config.get('resources', {}); self.kill_grace = float(resources.get('kill_grace_seconds', 3))
+        for stage, budget in (resources.get('stages') or {}).items(): self.budgets[stage] = {**DEFAULT_BUDGETS.get(stage, {}), **(budget or {})}
+        # Thread pools keep the budget they were created with, so a changed budget needs fresh ones.
+        for executor in self._executors.values(): executor.shutdown(wait=False)
+        self._executors = {}
+
+    # --- Budgets -------------------------------------------------------------
+    def cpus(self, stage: str) -> list:
+        if not hasattr(os, 'sched_setaffinity'): return []
+        available = os.sched_getaffinity(0); return sorted(cpu for cpu in self.budgets.get(stage, {}).get('cpus') or [] if cpu in available)
+
+    def threads(self, stage: str, requested: int) -> int:
+        """`requested` threads, capped at the stage's CPU set when it has one (0 = one per CPU in the set, or the tool's default)."""
+        cpus = self.cpus(stage)
+        return min(requested, len(cpus)) if cpus and requested else (len(cpus) if cpus else requested)
+
+    def _limit(self, stage: str, pid: int):
+        """Applies the stage's nice level and CPU set to a process (or, with a thread id on Linux, to one thread)."""
+        nice = int(self.budgets.get(stage, {}).get('nice', 0)); cpus = self.cpus(stage)
+        try:
+            if nice and hasattr(os, 'setpriority'): os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, pid) + nice))
+            if cpus: os.sched_setaffinity(pid, cpus)
+        except OSError as e: logging.warning(f"⚠️ Could not apply the '{stage}' CPU budget: {e}")
+
+    def _creation_flags(self, stage: str) -> int:
+        nice = int(self.budgets.get(stage, {}).get('nice', 0))
+        if os.name != 'nt' or nice <= 0: return 0
+        return IDLE_PRIORITY_CLASS if nice >= 10 else BELOW_NORMAL_PRIORITY_CLASS
+
+    def executor(self, stage: str) -> ThreadPoolExecutor:
+        """A thread pool whose threads carry the stage's budget. On Linux nice and affinity are per thread and inherited by
+        child processes, so this also covers the FFmpeg that MoviePy starts itself."""
+        if stage not in self._executors:
+            def limit_thread():
+                if hasattr(os, 'sched_setaffinity'): self._limit(stage, threading.get_native_id())
+            self._executors[stage] = ThreadPoolExecutor(thread_name_prefix=f"shortsbot-{stage}", initializer=limit_thread)
+        return self._executors[stage]
+
+    # --- Children --------------------------------------------------------------
+    async def spawn(self, stage: str, *command, **kwargs):
+        """Starts a long-lived child (e.g. a Whisper worker) under the stage's budget. The caller owns its lifetime."""
+        flags = self._creation_flags(stage)
+        if flags: kwargs['creationflags'] = kwargs.get('creationflags', 0) | flags
+        process = await asyncio.create_subprocess_exec(*command, **kwargs)
+        if os.name == 'posix': self._limit(stage, process.pid)
+        self._children[process] = stage; process_done = asyncio.ensure_future(process.wait())
+        process_done.add_done_callback(lambda _: self._children.pop(process, None))
+        return process
+
+    @asynccontextmanager
+    async def supervise(self, stage: str, *command, cleanup=(), **kwargs):
+        """Runs a child for the length of the block. If the block is cancelled or fails, the child is stopped and the
+        `cleanup` paths (its partial outputs) are deleted."""
+        process = await self.spawn(stage, *command, **kwargs)
+        try: yield process
+        except BaseException:
+            await self.terminate(process)
+            for path in cleanup:
+                if os.path.exists(path): os.remove(path)
+            raise
+
+    async def terminate(self, process):
+        if process.returncode is not None: return
+        try:
+            process.terminate()
+            try: await asyncio.wait_for(process.wait(), self.kill_grace)
+            except asyncio.TimeoutError: process.kill(); await process.wait()
+        except ProcessLookupError: pass
+
+    def kill_all(self, stages=None) -> int:
+        """Kills the running children of `stages` (all stages when None) at once. Returns how many were killed."""
+        killed = 0
+        for process, stage in list(self._children.items()):
+            if stages is not None and stage not in stages or process.returncode is not None: continue
+            try: process.kill(); killed += 1
+            except ProcessLookupError: pass
+        if killed: logging.info(f"🧹 Killed {killed} running child processes.")
+        return killed
+
+    def running(self) -> dict:
+        counts = {}
+        for process, stage in self._children.items():
+            if process.returncode is None: counts[stage] = counts.get(stage, 0) + 1
+        return counts
+
+SUPERVISOR = ProcessSupervisor()
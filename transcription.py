@@ -0,0 +1,117 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Transcription Service - OUT-OF-PROCESS WHISPER WORKERS
+# -----------------------------------------------------------------------------
+import asyncio, itertools, json, logging, os, sys
+
+import metrics, supervisor
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcription_worker.py")
+# Whole-source transcripts arrive as one JSON line, so the pipe reader must accept long lines.
+READ_LIMIT = 256 * 1024 * 1024
+MAX_ATTEMPTS = 2; MAX_FAILED_STARTS = 3
+
+class TranscriptionService:
+    """Keeps `workers` Whisper subprocesses warm and feeds them jobs over stdin/stdout pipes. Torch runs outside the bot
+    process, so long transcriptions cannot stall the Discord heartbeat. A worker that crashes or is OOM-killed is restarted,
+    and its in-flight jobs are retried once. transcribe() returns None if every attempt failed."""
+    def __init__(self, model_name: str = "base", workers: int = 1, threads: int = 0, batch_size: int = 4, max_memory_mb: int = 0, vad_margin_db: float = 0):
+        self.model_name = model_name; self.worker_count = max(1, workers); self.threads = threads; self.batch_size = max(1, batch_size); self.max_memory_mb = max_memory_mb
+        self.vad_margin_db = vad_margin_db
+        self.failed = False; self.ready_workers = 0
+        self._ready = asyncio.Event(); self._jobs = asyncio.Queue(); self._ids = itertools.count(1); self._tasks = []; self._processes = set(); self._in_flight = {}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run_worker(slot)) for slot in range(self.worker_count)]
+        return self
+
+    def stop(self):
+        """Stops the workers. Queued and in-flight jobs resolve to None, so their callers fall back as on a worker failure."""
+        self.failed = True; self._ready.set()
+        for task in self._tasks: task.cancel()
+        for process in list(self._processes):
+            if process.returncode is None: process.kill()
+        self._fail_jobs([entry for in_flight in self._in_flight.values() for entry in in_flight.values()])
+
+    async def wait_ready(self) -> bool:
+        """Waits until the first worker has loaded its model. Returns False if no worker could be started."""
+        await self._ready.wait(); return not self.failed
+
+    async def transcribe(self, path: str, start: float | None = None, duration: float | None = None, audio: str | None = None) -> list | None:
+        """Returns word timestamps ({'start', 'end', 'word'}, relative to `start`) for `path`, or None on failure.
+        `audio` is the source's PCM file from audio_store; when given, the worker reads its window from that instead of decoding `path`."""
+        if self.failed: return None
+        future = asyncio.get_running_loop().create_future()
+        await self._jobs.put({'job': {'id': next(self._ids), 'path': os.path.abspath(path), 'start': start, 'duration': duration, 'audio': audio}, 'future': future, 'attempts': 0})
+        metrics.set_gauge('queue_depth_transcription', self._jobs.qsize())
+        with metrics.span('whisper_transcribe'): words = await future
+        metrics.count('transcriptions' if words is not None else 'transcription_failures')
+        return words
+
+    # --- Worker management -------------------------------------------------------
+    async def _spawn(self):
+        env = dict(os.environ); threads = supervisor.SUPERVISOR.threads('whisper', self.threads)
+        # Caps the OpenMP/MKL pools too, which torch.set_num_threads alone does not cover.
+        if threads: env.update(OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        process = await supervisor.SUPERVISOR.spawn('whisper', sys.executable, WORKER_SCRIPT, '--model', self.model_name, '--threads', str(threads), '--batch-size', str(self.batch_size),
+                                                       '--max-memory-mb', str(self.max_memory_mb), '--vad-margin-db', str(self.vad_margin_db), stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env, limit=READ_LIMIT)
+        self._processes.add(process)
+        line = await process.stdout.readline()
+        if not line or not json.loads(line).get('ready'): await process.wait(); self._processes.discard(process); return None
+        return process
+
+    async def _run_worker(self, slot: int):
+        failed_starts = 0
+        while True:
+            process = await self._spawn()
+            if process is None:
+                failed_starts += 1
+                logging.error(f"❌ Transcription worker {slot} failed to start ({failed_starts}/{MAX_FAILED_STARTS}).")
+                if failed_starts >= MAX_FAILED_STARTS: return self._give_up(slot)
+                await asyncio.sleep(2 ** failed_starts); continue
+            failed_starts = 0; self.ready_workers += 1; self._ready.set()
+            logging.info(f"✅ Transcription worker {slot} ready (pid {process.pid}, model '{self.model_name}').")
+            try: await self._serve(process, slot)
+            finally: self.ready_workers -= 1; self._processes.discard(process)
+            code = await process.wait()
+            logging.warning(f"⚠️ Transcription worker {slot} exited with code {code}{' (likely killed for memory)' if code in (-9, 3, 137) else ''}. Restarting...")
+
+    async def _serve(self, process, slot: int):
+        """Sends batches to one worker until it dies. Jobs it was holding go back on the queue."""
+        in_flight = self._in_flight[slot] = {}
+        try:
+            while True:
+                batch = [await self._jobs.get()]
+                while len(batch) < self.batch_size and not self._jobs.empty(): batch.append(self._jobs.get_nowait())
+                for entry in batch: in_flight[entry['job']['id']] = entry; process.stdin.write((json.dumps(entry['job']) + "\n").encode())
+                await process.stdin.drain()
+                while in_flight:
+                    line = await process.stdout.readline()
+                    if not line: return
+                    result = json.loads(line); entry = in_flight.pop(result['id'], None)
+                    if entry is None: continue
+                    if 'audio_seconds' in result: metrics.count('audio_seconds_transcribed', result['speech_seconds']); metrics.count('audio_seconds_skipped', result['audio_seconds'] - result['speech_seconds'])
+                    if 'error' in result: logging.error(f"❌ Whisper transcription failed for {os.path.basename(entry['job']['path'])}: {result['error']}")
+                    if not entry['future'].done(): entry['future'].set_result(result.get('words'))
+        except (BrokenPipeError, ConnectionResetError): return
+        finally:
+            for entry in in_flight.values(): self._retry(entry)
+            if process.returncode is None: process.kill()
+
+    def _retry(self, entry):
+        entry['attempts'] += 1
+        if entry['future'].done(): return
+        if self.failed or entry['attempts'] >= MAX_ATTEMPTS: entry['future'].set_result(None); logging.error(f"❌ Giving up on transcribing {os.path.basename(entry['job']['path'])}.")
+        else: self._jobs.put_nowait(entry)
+
+    def _give_up(self, slot):
+        if self.ready_workers or any(not task.done() and task is not asyncio.current_task() for task in self._tasks): return
+        # No worker can start (missing whisper/torch, bad model name...): fail queued jobs like the old "failed" model did.
+        self.failed = True; self._ready.set(); logging.critical("🚨 No transcription worker could be started. Subtitles are disabled.")
+        self._fail_jobs()
+
+    def _fail_jobs(self, entries=()):
+        """Resolves `entries` and every queued job to None."""
+        entries = list(entries)
+        while not self._jobs.empty(): entries.append(self._jobs.get_nowait())
+        for entry in entries:
+            if not entry['future'].done(): entry['future'].set_result(None)
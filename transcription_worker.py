@@ -0,0 +1,130 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Transcription Worker - WARM WHISPER SUBPROCESS
+# -----------------------------------------------------------------------------
+# Started by transcription.TranscriptionService, never by hand. It loads Whisper once, then reads one JSON job per
+# line on stdin ({"id", "path", "start", "duration", "audio"}) and writes one JSON result per line on stdout
+# ({"id", "words", "audio_seconds", "speech_seconds"} or {"id", "error"}). All logging goes to stderr, so stdout only
+# ever carries results. "audio" names a 16 kHz float32 PCM file from audio_store; it is memory-mapped instead of decoding "path".
+import argparse, json, os, subprocess, sys
+
+SAMPLE_RATE = 16000
+BATCH_GAP_SECONDS = 1.0
+# Voice activity detection: 30 ms frames, speech padded by 0.3 s, and pauses under 0.6 s kept inside a region.
+VAD_FRAME_SECONDS = 0.03; VAD_PADDING_SECONDS = 0.3; VAD_MERGE_GAP_SECONDS = 0.6; VAD_SILENCE_DB = -60.0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ShortsBot Whisper worker")
+    parser.add_argument('--model', default='base'); parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=4); parser.add_argument('--max-memory-mb', type=int, default=0)
+    parser.add_argument('--vad-margin-db', type=float, default=0, help="Skip frames quieter than the noise floor plus this (0 = transcribe everything)")
+    return parser.parse_args()
+
+def load_audio(np, path, start=None, duration=None):
+    """Decodes (a window of) a file to 16 kHz mono float32 with FFmpeg."""
+    command = ['ffmpeg', '-nostdin', '-v', 'error'] + (['-ss', str(start)] if start else []) + (['-t', str(duration)] if duration else [])
+    command += ['-i', path, '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-']
+    pcm = subprocess.run(command, capture_output=True, check=True).stdout
+    return np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+
+def load_window(np, job):
+    """The job's audio. With a PCM file this is a zero-copy view into a memory map; otherwise FFmpeg decodes the file."""
+    if not job.get('audio'): return load_audio(np, job['path'], job.get('start'), job.get('duration'))
+    samples = np.memmap(job['audio'], dtype=np.float32, mode='r')
+    first = min(len(samples), int((job.get('start') or 0) * SAMPLE_RATE))
+    last = len(samples) if not job.get('duration') else min(len(samples), first + int(job['duration'] * SAMPLE_RATE))
+    return samples[first:last]
+
+def speech_regions(np, audio, margin_db):
+    """(first, last) sample ranges that hold speech, found by frame energy against the window's own noise floor.
+    Windows with no clearly quieter stretch are returned whole, and silent windows return no regions."""
+    if not margin_db or len(audio) == 0: return [(0, len(audio))]
+    frame = int(VAD_FRAME_SECONDS * SAMPLE_RATE); count = len(audio) // frame
+    if count < 2: return [(0, len(audio))]
+    frames = audio[:count * frame].reshape(count, frame); energy = np.empty(count, np.float64)
+    for i in range(0, count, 8192):
+        # einsum sums the squares without materialising a squared copy of a (possibly hours-long) window.
+        block = frames[i:i + 8192]; energy[i:i + 8192] = np.einsum('ij,ij->i', block, block) / frame
+    level = 10 * np.log10(energy + 1e-12); floor, peak = np.percentile(level, 10), level.max()
+    if peak < VAD_SILENCE_DB: return []
+    if peak - floor < margin_db: return [(0, len(audio))]
+    active = np.flatnonzero(level > floor + margin_db)
+    if len(active) == 0: return []
+    breaks = np.flatnonzero(np.diff(active) > VAD_MERGE_GAP_SECONDS / VAD_FRAME_SECONDS)
+    starts = active[np.r_[0, breaks + 1]]; ends = active[np.r_[breaks, len(active) - 1]]; padding = int(VAD_PADDING_SECONDS / VAD_FRAME_SECONDS)
+    return [(int(max(0, (start - padding) * frame)), int(min(len(audio), (end + 1 + padding) * frame))) for start, end in zip(starts, ends)]
+
+class JobReader:
+    """Splits job lines off the raw stdin fd. sys.stdin's buffered reader would pull queued jobs into its own buffer,
+    where select() cannot see them, so every batch would hold a single job."""
+    def __init__(self, fd):
+        self.fd = fd; self.buffer = b''; self.eof = False
+
+    def _next_line(self):
+        if b'\n' in self.buffer: line, self.buffer = self.buffer.split(b'\n', 1); return line
+        if self.eof and self.buffer: line, self.buffer = self.buffer, b''; return line
+        return None
+
+    def _fill(self):
+        chunk = os.read(self.fd, 65536); self.buffer += chunk; self.eof = not chunk
+
+    def read_batch(self, batch_size):
+        """Blocks for one job, then takes any further jobs already waiting on stdin, up to `batch_size`. None at EOF."""
+        jobs = []
+        while len(jobs) < batch_size:
+            line = self._next_line()
+            if line is None:
+                if self.eof or (jobs and not self._has_data()): break
+                self._fill(); continue
+            if line.strip(): jobs.append(json.loads(line))
+        return jobs or None
+
+    def _has_data(self):
+        if os.name == 'nt': return False  # select() only works on sockets on Windows; only jobs already read are batched there.
+        import select
+        return bool(select.select([self.fd], [], [], 0)[0])
+
+def transcribe_batch(np, model, jobs, vad_margin_db=0):
+    """Transcribes several jobs in one Whisper pass by joining their speech regions with short silences between them,
+    then hands each word back to the job whose audio it came from, on that job's own timeline. Only the speech
+    regions are copied into the model input; silent stretches never reach the model."""
+    results = {}; pieces = []; spans = []; offset = 0.0; gap = np.zeros(int(BATCH_GAP_SECONDS * SAMPLE_RATE), np.float32)
+    for job in jobs:
+        try: audio = load_window(np, job)
+        except subprocess.CalledProcessError as e: results[job['id']] = {'id': job['id'], 'error': e.stderr.decode(errors='ignore').strip() or 'ffmpeg failed'}; continue
+        except (OSError, ValueError) as e: results[job['id']] = {'id': job['id'], 'error': f"could not read audio: {e}"}; continue
+        regions = speech_regions(np, audio, vad_margin_db)
+        results[job['id']] = {'id': job['id'], 'words': [], 'audio_seconds': len(audio) / SAMPLE_RATE, 'speech_seconds': sum(end - start for start, end in regions) / SAMPLE_RATE}
+        for first, last in regions:
+            length = (last - first) / SAMPLE_RATE; spans.append((job, offset, offset + length, first / SAMPLE_RATE)); pieces += [audio[first:last], gap]; offset += length + BATCH_GAP_SECONDS
+    if not spans: return list(results.values())
+    # Jobs are unrelated clips, so one job's text must not become the prompt for the next.
+    result = model.transcribe(np.asarray(pieces[0]) if len(spans) == 1 else np.concatenate(pieces), fp16=False, word_timestamps=True, condition_on_previous_text=False)
+    for segment in result['segments']:
+        for word in segment.get('words', []):
+            for job, start, end, source_offset in spans:
+                if start <= word['start'] < end:
+                    results[job['id']]['words'].append({'start': word['start'] - start + source_offset, 'end': min(word['end'], end) - start + source_offset, 'word': word['word'].strip()}); break
+    return list(results.values())
+
+def main():
+    args = parse_args(); protocol = sys.stdout; sys.stdout = sys.stderr
+    if args.max_memory_mb and os.name != 'nt':
+        import resource
+        limit = args.max_memory_mb * 1024 * 1024; resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    import numpy as np, torch, whisper
+    if args.threads: torch.set_num_threads(args.threads)
+    model = whisper.load_model(args.model)
+    protocol.write(json.dumps({'ready': True, 'pid': os.getpid()}) + "\n"); protocol.flush()
+    reader = JobReader(sys.stdin.fileno())
+    while True:
+        jobs = reader.read_batch(max(1, args.batch_size))
+        if jobs is None: return
+        try: results = transcribe_batch(np, model, jobs, args.vad_margin_db)
+        except MemoryError:
+            # Exit so the service restarts this worker with a clean heap; its jobs are retried.
+            print("Worker ran out of memory.", file=sys.stderr); sys.exit(3)
+        except Exception as e: results = [{'id': job['id'], 'error': str(e)} for job in jobs]
+        for result in results: protocol.write(json.dumps(result) + "\n")
+        protocol.flush()
+
+if __name__ == "__main__": main()
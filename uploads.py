@@ -0,0 +1,39 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Upload Dispatcher - CONCURRENT, QUOTA-AWARE
+# -----------------------------------------------------------------------------
+import asyncio, logging
+
+import quota
+
+class UploadDispatcher:
+    """Uploads a batch of clips with at most bot.max_concurrent_uploads transfers in flight. Every upload is admitted
+    by the quota ledger before it starts, so extra parallelism cannot exceed the daily quota or upload limit."""
+    def __init__(self, workflow, channel):
+        self.workflow = workflow; self.channel = channel; self.config = workflow.cog.config
+        self.max_concurrent = max(1, int(self.config['bot'].get('max_concurrent_uploads', 3)))
+
+    async def run(self, items, is_retry=False):
+        """`items` are (source video name, clip path, clip number) tuples in upload order."""
+        ledger = self.workflow.cog.quota; admitted = []
+        for item in items:
+            if not ledger.admit_upload(): break
+            admitted.append(item)
+        reset_at = quota.next_reset().strftime('%I:%M %p (UTC)')
+        if not admitted: await self.channel.send(f"🚫 Daily upload limit or API quota reached. **{len(items)}** clips wait for the quota reset at {reset_at}."); return
+        if len(admitted) < len(items): await self.channel.send(f"📅 Quota admits **{len(admitted)}** of **{len(items)}** uploads today; the rest start after the reset at {reset_at}.")
+        await self.channel.send(f"   - Uploading **{len(admitted)}** clips now, up to **{self.max_concurrent}** at a time...")
+        semaphore = asyncio.Semaphore(self.max_concurrent); background_tasks = set()
+        async def upload(item):
+            source_video_name, clip_path, clip_number = item
+            async with semaphore:
+                # A quotaExceeded answer mid-batch stops the uploads that have not started; they stay queued for tomorrow.
+                if ledger.exhausted: ledger.release_upload(); return
+                # The publish slot is reserved by upload_clip_task as the upload starts, so skipped uploads take none.
+                try: await self.workflow.upload_clip_task(self.channel, source_video_name, clip_path, clip_number, is_retry=is_retry, background_tasks=background_tasks)
+                # A crash before the upload call returned has already handed back this clip's quota and slot (see upload_clip_task).
+                except Exception as e: logging.error(f"💥 Upload of clip #{clip_number} crashed: {e}", exc_info=True)
+        await asyncio.gather(*(upload(item) for item in admitted))
+        # Playlist inserts and notices overlap with later uploads; wait for the stragglers before reporting the batch done.
+        if background_tasks: await asyncio.gather(*list(background_tasks), return_exceptions=True)
+        ledger.flush(force=True); notice = ledger.take_notice(force=True)
+        if notice: await self.channel.send(notice)
@@ -1,16 +1,19 @@
 # -----------------------------------------------------------------------------
 # ShortsBot Utility Functions - ASYNC SUBPROCESS FIX
 # -----------------------------------------------------------------------------
-import asyncio, os, json, logging, sys, re, subprocess
+import asyncio, os, json, logging, sys, re, time
 from datetime import datetime
 import yaml
+import metrics, state_store, supervisor
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__)); LOGS_DIR = os.path.join(ROOT_DIR, "logs")
 INPUT_VIDEOS_DIR = os.path.join(ROOT_DIR, "input_videos"); PROCESSED_CLIPS_DIR = os.path.join(ROOT_DIR, "processed_clips")
 PROCESSED_VIDEOS_DIR = os.path.join(ROOT_DIR, "processed_videos"); FAILED_UPLOADS_DIR = os.path.join(ROOT_DIR, "failed_uploads")
 QUARANTINED_VIDEOS_DIR = os.path.join(ROOT_DIR, "quarantined_videos"); CONFIG_FILE = os.path.join(ROOT_DIR, "config.yaml")
-PROGRESS_FILE = os.path.join(ROOT_DIR, "progress.json")
+PROGRESS_FILE = os.path.join(ROOT_DIR, "progress.json"); STATE_DB_FILE = os.path.join(ROOT_DIR, "progress.db"); TRANSCRIPTS_DIR = os.path.join(ROOT_DIR, "transcripts"); AUDIO_CACHE_DIR = os.path.join(ROOT_DIR, "audio_cache"); FONTS_DIR = os.path.join(ROOT_DIR, "fonts")
+# Set by DiskBudget.enable() when storage.staging_dir is configured: clips are then rendered there instead of processed_clips.
+CLIP_STAGING_DIR = None
 def setup_folders():
-    folders_to_create = [LOGS_DIR, INPUT_VIDEOS_DIR, PROCESSED_CLIPS_DIR, PROCESSED_VIDEOS_DIR, FAILED_UPLOADS_DIR, QUARANTINED_VIDEOS_DIR]
+    folders_to_create = [LOGS_DIR, INPUT_VIDEOS_DIR, PROCESSED_CLIPS_DIR, PROCESSED_VIDEOS_DIR, FAILED_UPLOADS_DIR, QUARANTINED_VIDEOS_DIR, TRANSCRIPTS_DIR, FONTS_DIR]
     for folder_path in folders_to_create: os.makedirs(folder_path, exist_ok=True)
 def setup_logger():
     log_filename = f"{datetime.now().strftime('%Y-%m-%d')}.log"; log_filepath = os.path.join(LOGS_DIR, log_filename)
@@ -24,57 +27,146 @@ def load_config():
     try:
         with open(CONFIG_FILE, "r", encoding='utf-8') as f: return yaml.safe_load(f)
     except Exception as e: logging.error(f"❌ Error loading config.yaml: {e}"); sys.exit(1)
-def load_progress():
-    default_progress = {"source_videos": {}, "last_scheduled_time": None, "quota_tracker": {}}
-    try:
-        with open(PROGRESS_FILE, "r") as f:
-            progress = json.load(f);
-            for key, value in default_progress.items(): progress.setdefault(key, value)
-            return progress
-    except (FileNotFoundError, json.JSONDecodeError): return default_progress
-def save_progress(progress_data):
-    try:
-        with open(PROGRESS_FILE, "w") as f: json.dump(progress_data, f, indent=2)
-    except Exception as e: logging.error(f"❌ CRITICAL: Failed to save progress! Error: {e}")
+def configure_cluster(config):
+    """In cluster mode, moves the folders and the progress database every node shares under cluster.shared_root.
+    Logs, fonts and the audio cache stay local to each node."""
+    global INPUT_VIDEOS_DIR, PROCESSED_CLIPS_DIR, PROCESSED_VIDEOS_DIR, FAILED_UPLOADS_DIR, QUARANTINED_VIDEOS_DIR, TRANSCRIPTS_DIR, STATE_DB_FILE
+    cluster = config.get('cluster', {})
+    if not cluster.get('enabled') or not cluster.get('shared_root'): return False
+    root = cluster['shared_root']
+    INPUT_VIDEOS_DIR = os.path.join(root, "input_videos"); PROCESSED_CLIPS_DIR = os.path.join(root, "processed_clips"); PROCESSED_VIDEOS_DIR = os.path.join(root, "processed_videos")
+    FAILED_UPLOADS_DIR = os.path.join(root, "failed_uploads"); QUARANTINED_VIDEOS_DIR = os.path.join(root, "quarantined_videos"); TRANSCRIPTS_DIR = os.path.join(root, "transcripts"); STATE_DB_FILE = os.path.join(root, "progress.db")
+    return True
+def open_progress_store(persistent=True, wal=True):
+    """Opens the SQLite progress store, importing a legacy progress.json on first run. Offline mode keeps state in memory.
+    A database under cluster.shared_root is opened with `wal` off, since WAL does not work over network filesystems."""
+    store = state_store.ProgressStore(STATE_DB_FILE if persistent else ':memory:', wal=wal)
+    if persistent: store.migrate_from_json(PROGRESS_FILE)
+    return store
 def create_progress_bar(percentage, length=20):
     filled_length = int(length * percentage // 100); bar = '█' * filled_length + '─' * (length - filled_length)
     return f"[{bar}] {percentage:.1f}%"
-def get_video_duration(video_path):
-    command = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
+PROBE_ENTRIES = "format=duration:stream=index,codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate"
+
+def _parse_frame_rate(rate):
+    try: num, den = (rate or "0/0").split('/'); return round(int(num) / int(den), 3) if int(den) else None
+    except ValueError: return None
+
+async def probe_media(video_path):
+    """Runs ffprobe once, without blocking the event loop. Returns duration, stream layout, resolution and frame rate,
+    or None if the file cannot be read. Only the container header is read, however long the file is."""
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return float(result.stdout)
-    except Exception as e: logging.error(f"Error getting video duration for {video_path}: {e}"); return None
+        process = await asyncio.create_subprocess_exec('ffprobe', '-v', 'error', '-show_entries', PROBE_ENTRIES, '-of', 'json', video_path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0: raise RuntimeError(stderr.decode(errors='ignore').strip() or f"ffprobe exited with {process.returncode}")
+        probe = json.loads(stdout); streams = probe.get('streams', [])
+        video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+        info = {'duration': float(probe['format']['duration']),
+                'streams': [{'index': s['index'], 'type': s.get('codec_type'), 'codec': s.get('codec_name')} for s in streams],
+                'audio_streams': sum(1 for s in streams if s.get('codec_type') == 'audio'),
+                'width': video.get('width'), 'height': video.get('height'),
+                'fps': _parse_frame_rate(video.get('avg_frame_rate')) or _parse_frame_rate(video.get('r_frame_rate'))}
+        return info
+    except Exception as e: logging.error(f"Error probing {video_path}: {e}"); return None
+
+def clip_work_dir(): return CLIP_STAGING_DIR or PROCESSED_CLIPS_DIR
+
+def is_staged(path): return bool(CLIP_STAGING_DIR) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(CLIP_STAGING_DIR)
+
+def find_clip(clip_name):
+    """Path of a rendered clip: in the staging folder while it waits there, otherwise in processed_clips."""
+    staged_path = os.path.join(CLIP_STAGING_DIR, clip_name) if CLIP_STAGING_DIR else None
+    return staged_path if staged_path and os.path.exists(staged_path) else os.path.join(PROCESSED_CLIPS_DIR, clip_name)
 
-async def split_video_into_clip_with_progress(source_path, clip_number, start_time, duration, progress_callback=None):
+def get_clip_output_path(source_path, clip_number, subtitled=False):
     base_name = os.path.splitext(os.path.basename(source_path))[0]
-    output_filename = f"{base_name} part {clip_number}.mp4"
-    output_path = os.path.join(PROCESSED_CLIPS_DIR, output_filename)
+    return os.path.join(clip_work_dir(), f"{base_name} part {clip_number}{'_subtitled' if subtitled else ''}.mp4")
+
+VIDEO_FILTER = "crop=ih:ih,scale=1080:1080,pad=1080:1920:(ow-iw)/2:(oh-ih)/2:color=black"
+
+async def split_video_into_clip_with_progress(source_path, clip_number, start_time, duration, progress_callback=None, threads=0, subtitle_filter=None, preset='fast', crf=None, on_encoded=None):
+    """Encodes one clip. `on_encoded(media_seconds, wall_seconds)` is called after a successful encode (not for clips already on disk)."""
+    output_path = get_clip_output_path(source_path, clip_number, subtitled=bool(subtitle_filter))
+    video_filter = f"{VIDEO_FILTER},{subtitle_filter}" if subtitle_filter else VIDEO_FILTER
     if os.path.exists(output_path):
         if progress_callback: await progress_callback(100.0)
         return output_path
-    video_filter = "crop=ih:ih,scale=1080:1080,pad=1080:1920:(ow-iw)/2:(oh-ih)/2:color=black"
-    command = ['ffmpeg', '-y', '-progress', 'pipe:1', '-nostats', '-ss', str(start_time), '-i', source_path, '-t', str(duration), '-vf', video_filter, '-c:v', 'libx264', '-preset', 'fast', '-c:a', 'copy', output_path]
+    command = ['ffmpeg', '-y', '-progress', 'pipe:1', '-nostats', '-ss', str(start_time), '-i', source_path, '-t', str(duration), '-vf', video_filter, '-c:v', 'libx264', '-preset', preset] + (['-crf', str(crf)] if crf is not None else []) + ['-threads', str(threads), '-c:a', 'copy', output_path]
     
-    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    
-    time_pattern = re.compile(r"out_time_ms=(\d+)")
-    while process.returncode is None:
-        if process.stdout is None: await asyncio.sleep(0.1); continue
-        try:
-            line = await asyncio.wait_for(process.stdout.readline(), timeout=5.0)
-            if not line: break
-            line = line.decode('utf-8', errors='ignore').strip()
-            match = time_pattern.search(line)
+    started = time.perf_counter()
+    # A cancelled encode (!stop, reload, shutdown) is terminated and its partial clip removed, so it is never mistaken for a finished one.
+    async with supervisor.SUPERVISOR.supervise('split', *command, cleanup=[output_path], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE) as process:
+        # stderr is drained alongside the progress lines, so FFmpeg never stalls on a full pipe while stdout is read.
+        stderr_reader = asyncio.ensure_future(process.stderr.read()); time_pattern = re.compile(r"out_time_ms=(\d+)")
+        async for line in process.stdout:
+            match = time_pattern.search(line.decode('utf-8', errors='ignore').strip())
             if match:
                 processed_us = int(match.group(1)); percentage = min((processed_us / (duration * 1_000_000)) * 100, 100.0)
                 if progress_callback: await progress_callback(percentage)
-        except asyncio.TimeoutError: break
-    
-    stdout, stderr = await process.communicate()
+        await process.wait(); stderr = await stderr_reader
+    elapsed = time.perf_counter() - started; metrics.observe('ffmpeg_split_burn' if subtitle_filter else 'ffmpeg_split', elapsed)
     if process.returncode == 0:
+        metrics.count('bytes_rendered', os.path.getsize(output_path))
+        if on_encoded: on_encoded(duration, elapsed)
         if progress_callback: await progress_callback(100.0)
         return output_path
     else:
         logging.error(f"❌ FFmpeg failed to split clip #{clip_number}.\n{stderr.decode('utf-8', errors='ignore')}")
-        return None
\ No newline at end of file
+        if os.path.exists(output_path): os.remove(output_path)
+        return None
+
+async def split_video_into_clips_batch(source_path, clip_windows, progress_callback=None, threads=0, subtitle_filters=None, has_audio=None, preset='fast', crf=None, on_encoded=None):
+    """Decodes the source once and writes every (clip_number, start_time, duration) window in a single FFmpeg pass.
+    Overlapping windows are cut from the same decoded frames. Returns {clip_number: output_path or None}."""
+    results = {}; pending = []; subtitle_filters = subtitle_filters or {}
+    for clip_number, start_time, duration in clip_windows:
+        output_path = get_clip_output_path(source_path, clip_number, subtitled=clip_number in subtitle_filters)
+        if os.path.exists(output_path):
+            results[clip_number] = output_path
+            if progress_callback: await progress_callback(clip_number, 100.0)
+        else: pending.append((clip_number, start_time, duration, output_path))
+    if not pending: return results
+    batch_start = min(p[1] for p in pending); batch_end = max(p[1] + p[2] for p in pending); count = len(pending)
+    if has_audio is None: has_audio = ((await probe_media(source_path)) or {}).get('audio_streams', 0) > 0
+    # The source is seeked once to the earliest window; every trim below is relative to that point.
+    graph = [f"[0:v]{VIDEO_FILTER},split={count}" + ''.join(f"[v{i}]" for i in range(count))]
+    if has_audio: graph.append(f"[0:a]asplit={count}" + ''.join(f"[a{i}]" for i in range(count)))
+    for i, (clip_number, start_time, duration, _) in enumerate(pending):
+        rel_start = start_time - batch_start
+        subtitle_filter = f",{subtitle_filters[clip_number]}" if clip_number in subtitle_filters else ""
+        graph.append(f"[v{i}]trim=start={rel_start}:duration={duration},setpts=PTS-STARTPTS{subtitle_filter}[vo{i}]")
+        if has_audio: graph.append(f"[a{i}]atrim=start={rel_start}:duration={duration},asetpts=PTS-STARTPTS[ao{i}]")
+    command = ['ffmpeg', '-y', '-progress', 'pipe:1', '-nostats', '-ss', str(batch_start), '-t', str(batch_end - batch_start), '-i', source_path, '-filter_complex', ';'.join(graph)]
+    # The batch holds one render slot, so its encoders share that slot's threads instead of each taking them all.
+    output_threads = max(1, (threads or os.cpu_count() or 1) // count)
+    for i, (_, _, _, output_path) in enumerate(pending):
+        command += ['-map', f"[vo{i}]"] + (['-map', f"[ao{i}]", '-c:a', 'aac'] if has_audio else []) + ['-c:v', 'libx264', '-preset', preset] + (['-crf', str(crf)] if crf is not None else []) + ['-threads', str(output_threads), output_path]
+    # A stream-copied tracker output keeps out_time_ms on the source timeline; the trimmed outputs all restart at zero.
+    command += ['-map', '0:v:0', '-c', 'copy', '-f', 'null', '-']
+
+    started = time.perf_counter()
+    async with supervisor.SUPERVISOR.supervise('split', *command, cleanup=[p[3] for p in pending], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE) as process:
+        stderr_reader = asyncio.ensure_future(process.stderr.read()); time_pattern = re.compile(r"out_time_ms=(\d+)"); last_reported = {}
+        async for line in process.stdout:
+            match = time_pattern.search(line.decode('utf-8', errors='ignore').strip())
+            if match and progress_callback:
+                position = int(match.group(1)) / 1_000_000
+                for clip_number, start_time, duration, _ in pending:
+                    percentage = max(0.0, min(((position - (start_time - batch_start)) / duration) * 100, 100.0))
+                    if last_reported.get(clip_number) != percentage:
+                        last_reported[clip_number] = percentage; await progress_callback(clip_number, percentage)
+        await process.wait(); stderr = await stderr_reader
+    elapsed = time.perf_counter() - started; metrics.observe('ffmpeg_batch_split', elapsed)
+    if process.returncode == 0:
+        # Recorded per output: the policy assumes one clip per encoder and multiplies by parallel encodes itself, so the
+        # combined media time of N outputs would overstate the speed of each one N times.
+        if on_encoded: on_encoded(sum(duration for _, _, duration, _ in pending) / len(pending), elapsed)
+        for clip_number, _, _, output_path in pending:
+            results[clip_number] = output_path; metrics.count('bytes_rendered', os.path.getsize(output_path))
+            if progress_callback: await progress_callback(clip_number, 100.0)
+        return results
+    logging.error(f"❌ FFmpeg failed to batch split clips #{pending[0][0]}-#{pending[-1][0]}.\n{stderr.decode('utf-8', errors='ignore')}")
+    for clip_number, _, _, output_path in pending:
+        if os.path.exists(output_path): os.remove(output_path)
+        results[clip_number] = None
+    return results
@@ -0,0 +1,129 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Folder Watcher - EVENT DRIVEN WITH POLLING FALLBACK
+# -----------------------------------------------------------------------------
+import asyncio, logging, os, time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError: Observer = None; FileSystemEventHandler = object
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv')
+
+class _EventForwarder(FileSystemEventHandler):
+    """Hands watchdog events from the observer thread over to the event loop."""
+    def __init__(self, watcher): self.watcher = watcher
+    def on_any_event(self, event):
+        if event.is_directory: return
+        self.watcher.loop.call_soon_threadsafe(self.watcher._on_event, event.event_type, event.src_path, getattr(event, 'dest_path', ''))
+
+class FolderWatcher:
+    """Keeps an in-memory index of the video files in the watched folders. The folders are listed once at startup.
+    After that, the index follows filesystem events (inotify via watchdog). Without watchdog it falls back to a stat poll.
+    A file is 'ready' once its writer has closed it or its size has held steady for `settle_seconds`.
+    Each newly ready file wakes whoever is waiting in wait_for_changes()."""
+    def __init__(self, directories, settle_seconds: float = 3.0, poll_interval: float = 10.0):
+        self.directories = list(directories); self.settle_seconds = settle_seconds; self.poll_interval = poll_interval
+        self.index = {directory: {} for directory in self.directories}  # directory -> {name: {'size', 'mtime', 'stable_since', 'ready'}}
+        self.mode = 'inotify' if Observer else 'polling'
+        self.loop = None; self._observer = None; self._task = None; self._wake = asyncio.Event(); self._arrivals = set()
+
+    # --- Lifecycle -----------------------------------------------------------
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for directory in self.directories: self._scan(directory, startup=True)
+        if Observer:
+            try:
+                self._observer = Observer(); handler = _EventForwarder(self)
+                for directory in self.directories: self._observer.schedule(handler, directory, recursive=False)
+                self._observer.start()
+            except Exception as e: logging.warning(f"⚠️ Filesystem events unavailable ({e}), polling folders instead."); self._observer = None; self.mode = 'polling'
+        self._task = asyncio.create_task(self._settle_loop())
+        logging.info(f"👀 Watching {len(self.directories)} folders ({self.mode}).")
+        return self
+
+    def stop(self):
+        if self._task: self._task.cancel()
+        if self._observer: self._observer.stop(); self._observer.join(timeout=5)
+
+    # --- Index maintenance ---------------------------------------------------
+    def _scan(self, directory, startup=False):
+        """Lists one folder and reconciles the index with it. Runs at startup, and on every poll tick in polling mode."""
+        entries = self.index[directory]; seen = set(); now = time.time()
+        with os.scandir(directory) as listing:
+            for entry in listing:
+                if not entry.is_file() or not entry.name.endswith(VIDEO_EXTENSIONS): continue
+                seen.add(entry.name)
+                if entry.name in entries: continue
+                stat = entry.stat()
+                # Files already at rest when the bot starts are ready at once; anything newer still has to settle.
+                ready = startup and now - stat.st_mtime >= self.settle_seconds
+                entries[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'stable_since': now, 'ready': ready}
+        for name in set(entries) - seen: del entries[name]
+
+    def _locate(self, path):
+        directory, name = os.path.split(path)
+        if directory not in self.index or not name.endswith(VIDEO_EXTENSIONS): return None, None
+        return directory, name
+
+    def _track(self, path, closed=False):
+        directory, name = self._locate(path)
+        if not directory: return
+        try: stat = os.stat(path)
+        except OSError: self.index[directory].pop(name, None); return
+        entry = self.index[directory].get(name)
+        if entry and entry['ready'] and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime): return
+        self.index[directory][name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'stable_since': time.time(), 'ready': False}
+        if closed: self._mark_ready(directory, name)
+
+    def _forget(self, path):
+        directory, name = self._locate(path)
+        if directory: self.index[directory].pop(name, None)
+
+    def _on_event(self, event_type, src_path, dest_path):
+        if event_type in ('created', 'modified'): self._track(src_path)
+        elif event_type == 'closed': self._track(src_path, closed=True)
+        elif event_type == 'deleted': self._forget(src_path)
+        elif event_type == 'moved': self._forget(src_path); self._track(dest_path, closed=True)
+
+    def _mark_ready(self, directory, name):
+        entry = self.index[directory][name]
+        if entry['ready']: return
+        entry['ready'] = True; self._arrivals.add(directory); self._wake.set()
+        logging.info(f"📥 New file ready: {name}")
+
+    async def _settle_loop(self):
+        last_poll = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            try:
+                if not self._observer and time.monotonic() - last_poll >= self.poll_interval:
+                    for directory in self.directories: self._scan(directory)
+                    last_poll = time.monotonic()
+                now = time.time()
+                for directory, entries in self.index.items():
+                    for name, entry in list(entries.items()):
+                        if entry['ready']: continue
+                        try: stat = os.stat(os.path.join(directory, name))
+                        except OSError: del entries[name]; continue
+                        if (stat.st_size, stat.st_mtime) != (entry['size'], entry['mtime']): entry.update(size=stat.st_size, mtime=stat.st_mtime, stable_since=now)
+                        elif now - entry['stable_since'] >= self.settle_seconds: self._mark_ready(directory, name)
+            except Exception as e: logging.error(f"💥 Folder watcher error: {e}", exc_info=True)
+
+    # --- Queries ---------------------------------------------------------------
+    def ready_files(self, directory) -> list:
+        """Sorted names of fully written video files in `directory`. Stale entries (the bot moved or removed the file
+        before its event arrived) are dropped here with one stat each, without listing the folder again."""
+        entries = self.index[directory]; ready = []
+        for name in sorted(entries):
+            if not entries[name]['ready']: continue
+            if os.path.exists(os.path.join(directory, name)): ready.append(name)
+            else: del entries[name]
+        return ready
+
+    async def wait_for_changes(self, timeout: float) -> set:
+        """Waits until a new file is ready or `timeout` passes. Returns the folders that received new files."""
+        try: await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError: pass
+        arrivals = self._arrivals; self._arrivals = set(); self._wake.clear()
+        return arrivals
@@ -0,0 +1,59 @@
+# -----------------------------------------------------------------------------
+# ShortsBot Render Worker - HEADLESS CLUSTER NODE
+# -----------------------------------------------------------------------------
+# Usage: python worker.py [--node-id render-2] [--once]
+# Runs on any machine that sees cluster.shared_root (with cluster.enabled in its config.yaml). It never talks to Discord
+# or YouTube. It renders clips from the plans the coordinator bot stored for 'processing' sources, leasing each clip
+# first, and leaves them 'pending_upload' in the shared processed_clips folder for the coordinator to upload.
+import argparse, asyncio, logging, sys
+
+import subtitles, supervisor, utils
+from bot_cog import BotCog
+from disk_budget import DiskBudget
+from encoding_policy import EncodingPolicy
+from leasing import LeaseManager
+from media_cache import MediaProbeCache
+from workflows import WorkflowManager
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ShortsBot headless render node")
+    parser.add_argument('--node-id', help="Name shown in !status (default: cluster.node_id or the host name)")
+    parser.add_argument('--once', action='store_true', help="Exit once no planned clip is left to take instead of polling")
+    return parser.parse_args()
+
+class HeadlessBot:
+    """Stands in for the Discord bot: render nodes have no channel, so progress only goes to the log."""
+    def get_channel(self, channel_id): return None
+
+async def run(args):
+    config = utils.load_config(); cluster = config.setdefault('cluster', {})
+    if not cluster.get('enabled'): logging.critical("🚨 Set cluster.enabled (and cluster.shared_root for several machines) in config.yaml to run a render node."); return 1
+    if args.node_id: cluster['node_id'] = args.node_id
+    shared_root = utils.configure_cluster(config); utils.setup_folders()
+    store = utils.open_progress_store(persistent=True, wal=not shared_root)
+    cog = BotCog(HeadlessBot()); cog.config = config; cog.store = store; supervisor.SUPERVISOR.configure(config)
+    cog.media = MediaProbeCache(store); cog.leases = LeaseManager.from_config(config, store, 'render').start()
+    cog.encoding = EncodingPolicy.from_config(config, store, cog.leases.node_id); cog.configure_subtitles()
+    cog.disk = DiskBudget.from_config(config).enable(); cog.disk.clean_orphans(store, shared=True)
+    workflow = WorkflowManager(cog.bot, cog); workflow.is_online = False; cog.workflows = workflow
+    try:
+        while True:
+            rendered = 0
+            for source_video_name in await cog.leases.run(store.sources_with_status, 'processing'):
+                count = await workflow.render_planned_clips(source_video_name)
+                if count: logging.info(f"✅ Rendered {count} clips of {source_video_name}; they are waiting for the coordinator to upload them.")
+                rendered += count
+            if not rendered:
+                if args.once: return 0
+                await asyncio.sleep(cluster.get('poll_seconds', 15))
+    finally:
+        cog.leases.stop()
+        if subtitles.TRANSCRIPTION_SERVICE: subtitles.TRANSCRIPTION_SERVICE.stop()
+        supervisor.SUPERVISOR.kill_all(); store.close()
+
+def main():
+    utils.setup_folders(); utils.setup_logger(); args = parse_args()
+    try: sys.exit(asyncio.run(run(args)))
+    except KeyboardInterrupt: logging.info("🛑 Render node stopped.")
+
+if __name__ == "__main__": main()
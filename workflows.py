@@ -6,88 +6,141 @@ from pathlib import Path
 from datetime import datetime, timezone
 
 import discord
-import utils, helpers, subtitles
+import utils, helpers, leasing, subtitles, supervisor, uploads
+from progress_reporter import ProgressReporter
+from pipeline import ClipPipeline
 
 class WorkflowManager:
     def __init__(self, bot, cog):
         self.bot = bot; self.cog = cog
-        self.is_online = self.cog.config['youtube'].get('youtube_online_mode', True)
+        self.is_online = self.cog.config['youtube'].get('youtube_online_mode', True); self.active_pipelines = set(); self.stop_requested = False
 
     async def run_autonomous_workflow(self, process_new: bool):
-        channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id']))
+        channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id'])); self.stop_requested = False
+        if self.is_online and not await self.cog.wait_for_warmup('youtube'): logging.warning("🚫 YouTube client is unavailable; skipping this run."); return
         pending_clips = self._get_pending_clips()
         if pending_clips: await self.process_pending_uploads(pending_clips); return
-        failed_clips = [f for f in os.listdir(utils.FAILED_UPLOADS_DIR) if f.endswith(('.mp4', '.mkv'))]
+        failed_clips = self.cog.watcher.ready_files(utils.FAILED_UPLOADS_DIR)
         if failed_clips: await self.process_failed_uploads(failed_clips); return
         if process_new:
-            work_item, work_type = self.find_new_work()
+            await self.reconcile_sources(channel)
+            work_item, work_type = await self.find_new_work()
             if not work_item: await channel.send("✅ No new videos to process."); return
             if work_type == "processing": await self.resume_in_progress_video(work_item)
             elif work_type == "new": await self.process_new_video(work_item)
             elif work_type == "completed": await self.handle_completed_video(work_item)
 
-    async def upload_clip_task(self, channel, source_video_name, clip_path, clip_number, is_retry=False):
+    def stop_rendering(self) -> int:
+        """Cancels every running clip pipeline (see ClipPipeline.cancel). Returns how many were running."""
+        self.stop_requested = True
+        for clip_pipeline in list(self.active_pipelines): clip_pipeline.cancel()
+        return len(self.active_pipelines)
+
+    async def upload_clip_task(self, channel, source_video_name, clip_path, clip_number, is_retry=False, next_schedule_timestamp=None, background_tasks=None):
+        """Uploads one clip that the caller has already admitted with cog.quota.admit_upload(). With `background_tasks`, the
+        playlist insert and Discord notices run as tasks added to that set, so the caller can start the next upload while they finish."""
         if not self.is_online: return
         clip_filename = os.path.basename(clip_path)
-        next_schedule_timestamp = helpers.get_next_schedule_time(self.cog.progress.get('last_scheduled_time'))
-        if next_schedule_timestamp is None: await channel.send("❌ Scheduling Error: Could not get next slot."); return
-        if not is_retry: self.cog.progress['last_scheduled_time'] = next_schedule_timestamp
-        
-        base_title = Path(source_video_name).stem.replace('_', ' ').replace('.', ' ').title()
-        title = f"{base_title} - Part {clip_number} #shorts"
-        
-        playlist_id = self.cog.progress['source_videos'][source_video_name]['playlist_id']
-        playlist_link = f"https://www.youtube.com/playlist?list={playlist_id}"
-        hashtags = ' '.join(self.cog.config['default_hashtags'])
-        
-        description = self.cog.config['description_template'].format(
-            title=base_title,
-            playlist_link=playlist_link,
-            hashtags=hashtags
-        )
+        if next_schedule_timestamp is None:
+            slots = helpers.reserve_schedule_slots(self.cog.store, 1)
+            if not slots: self.cog.quota.release_upload(); await channel.send("❌ Scheduling Error: Could not get next slot."); return
+            next_schedule_timestamp = slots[0]
 
-        video_id, error_message = await helpers.upload_video(self.cog.youtube, self.cog.config, clip_path, title, description, self.cog.config['youtube']['default_category_id'], self.cog.config['default_hashtags'], next_schedule_timestamp)
+        # Until the upload call returns nothing is charged, so a crash hands back the admitted quota and the slot.
+        try:
+            base_title = Path(source_video_name).stem.replace('_', ' ').replace('.', ' ').title()
+            title = f"{base_title} - Part {clip_number} #shorts"
+            playlist_id = self.cog.store.get_source(source_video_name)['playlist_id']
+            playlist_link = f"https://www.youtube.com/playlist?list={playlist_id}"
+            hashtags = ' '.join(self.cog.config['default_hashtags'])
+            description = self.cog.config['description_template'].format(
+                title=base_title,
+                playlist_link=playlist_link,
+                hashtags=hashtags
+            )
+            async def upload_progress(p): logging.debug(f"⬆️ Uploading {clip_filename}: {p:.1f}%")
+            video_id, error_message = await helpers.upload_video(self.cog.youtube, self.cog.config, clip_path, title, description, self.cog.config['youtube']['default_category_id'], self.cog.config['default_hashtags'], next_schedule_timestamp, store=self.cog.store, progress_callback=upload_progress, in_memory=utils.is_staged(clip_path))
+        except BaseException:
+            self.cog.quota.release_upload(); helpers.release_schedule_slot(self.cog.store, next_schedule_timestamp); raise
+        self.cog.quota.charge('upload')
+        if error_message and 'quotaExceeded' in error_message: self.cog.quota.exhaust()
         
         if video_id:
-            await self.cog._log_quota_usage('upload')
-            success = await helpers.add_video_to_playlist(self.cog.youtube, playlist_id, video_id)
-            if success: await self.cog._log_quota_usage('playlist_item_insert')
-            
             scheduled_time_obj = datetime.fromtimestamp(next_schedule_timestamp, tz=timezone.utc)
-            self.cog.progress['source_videos'][source_video_name]['clips'][clip_filename] = {
+            self.cog.store.set_clip(source_video_name, clip_filename, {
                 'status': 'uploaded', 'youtube_id': video_id, 
                 'publish_at': scheduled_time_obj.strftime('%Y-%m-%dT%H:%M:%SZ')
-            }
-            formatted_time = scheduled_time_obj.strftime('%b %d, %Y at %I:%M %p (UTC)')
-            await channel.send(f"✅ **Upload Complete:** `{title}`\n> Scheduled for **{formatted_time}**")
+            })
             os.remove(clip_path)
+            finish = self._finish_upload(channel, playlist_id, video_id, title, scheduled_time_obj.strftime('%b %d, %Y at %I:%M %p (UTC)'))
+            if background_tasks is None: await finish
+            else: task = asyncio.create_task(finish); background_tasks.add(task); task.add_done_callback(background_tasks.discard)
         else:
-            self.cog.progress['source_videos'][source_video_name]['clips'][clip_filename] = {'status': 'upload_failed', 'reason': error_message}
-            await channel.send(f"❌ **Upload FAILED:** `{title}`\n> **Reason:** `{error_message}`")
+            self.cog.quota.release('playlist_item_insert'); helpers.release_schedule_slot(self.cog.store, next_schedule_timestamp)
+            self.cog.store.set_clip(source_video_name, clip_filename, {'status': 'upload_failed', 'reason': error_message})
             if not is_retry: shutil.move(clip_path, os.path.join(utils.FAILED_UPLOADS_DIR, clip_filename))
-        
-        utils.save_progress(self.cog.progress)
+            await channel.send(f"❌ **Upload FAILED:** `{title}`\n> **Reason:** `{error_message}`")
+    async def _finish_upload(self, channel, playlist_id, video_id, title, formatted_time):
+        added, error_message = await helpers.add_video_to_playlist(self.cog.youtube, self.cog.config, playlist_id, video_id)
+        # A refused insert spends no quota, so its reservation goes back instead of being counted.
+        if added: self.cog.quota.charge('playlist_item_insert')
+        else: self.cog.quota.release('playlist_item_insert')
+        if error_message and 'quotaExceeded' in error_message: self.cog.quota.exhaust()
+        await self.cog._post_quota_notice()
+        await channel.send(f"✅ **Upload Complete:** `{title}`\n> Scheduled for **{formatted_time}**")
         
     # ... (The rest of the file is correct and can remain unchanged)
-    def find_new_work(self):
-        all_videos_in_folder = {f for f in os.listdir(utils.INPUT_VIDEOS_DIR) if f.endswith(('.mp4', '.mkv'))}
+    async def find_new_work(self):
+        all_videos_in_folder = self.cog.watcher.ready_files(utils.INPUT_VIDEOS_DIR)
         if not all_videos_in_folder: return None, None
-        in_progress_videos = [v for v in all_videos_in_folder if self.cog.progress['source_videos'].get(v, {}).get('status') == 'processing']
+        statuses = {v: self.cog.store.get_source_status(v) for v in all_videos_in_folder}
+        in_progress_videos = [v for v in all_videos_in_folder if statuses[v] == 'processing' and not await self._rendering_elsewhere(v)]
         if in_progress_videos: return in_progress_videos[0], "processing"
-        new_videos = [v for v in all_videos_in_folder if v not in self.cog.progress['source_videos']]
+        new_videos = [v for v in all_videos_in_folder if not self.cog.store.has_source(v)]
         if new_videos: return new_videos[0], "new"
         if self.is_online:
-            completed_video = next((v for v in all_videos_in_folder if self.cog.progress['source_videos'].get(v, {}).get('status') == 'completed' and v not in self.cog.session_ignore_list), None)
+            completed_video = next((v for v in all_videos_in_folder if statuses[v] == 'completed' and v not in self.cog.session_ignore_list), None)
             if completed_video: return completed_video, "completed"
         return None, None
+    async def reconcile_sources(self, channel):
+        """Matches input files that have no record to known sources by content. A renamed source keeps its progress, clips
+        and playlist under the new name; a duplicate is recorded as such and never processed."""
+        if not self.cog.sources: return
+        for file_name in self.cog.watcher.ready_files(utils.INPUT_VIDEOS_DIR):
+            if self.cog.store.has_source(file_name):
+                # Sources recorded before fingerprinting existed are registered the first time they are seen.
+                if not self.cog.store.get_source_fingerprint(file_name) and self.cog.store.get_source_status(file_name) != 'duplicate': await self.cog.sources.register(file_name)
+                continue
+            kind, known = await self.cog.sources.identify(file_name)
+            if kind == 'renamed':
+                self.cog.sources.apply_rename(known, file_name); logging.info(f"🔁 {known} was renamed to {file_name}.")
+                await channel.send(f"🔁 **Renamed:** `{known}` is now `{file_name}`. Its progress, clips and playlist carry over.")
+            elif kind == 'duplicate':
+                with self.cog.store.transaction(): self.cog.store.add_source(file_name, 'duplicate'); self.cog.store.update_source_data(file_name, duplicate_of=known)
+                await channel.send(f"👯 **Duplicate:** `{file_name}` has the same content as `{known}` and will be skipped. You can delete it.")
+    async def _db(self, fn, *args, **kwargs):
+        """Runs a store call on the lease thread in cluster mode, where the shared database may wait on another node's lock."""
+        return await self.cog.leases.run(fn, *args, **kwargs) if self.cog.leases else fn(*args, **kwargs)
+    async def planned_clips(self, source_video_name):
+        """Clips of the source's stored render plan that have no record yet and that no other node is rendering."""
+        plan = (await self._db(self.cog.store.get_source, source_video_name) or {}).get('plan')
+        if not plan: return []
+        recorded = {self._parse_clip_number(name) for name in await self._db(self.cog.store.get_clips, source_video_name)}
+        busy = await self.cog.leases.held_elsewhere(leasing.clip_prefix(source_video_name)) if self.cog.leases else set()
+        return [n for n in range(plan[0], plan[1] + 1) if n not in recorded and leasing.clip_resource(source_video_name, n) not in busy]
+    async def missing_clips(self, source_video_name, total_clips):
+        """Clip numbers 1..total_clips that have no record yet, in order."""
+        recorded = {self._parse_clip_number(name) for name in await self._db(self.cog.store.get_clips, source_video_name)}
+        return [n for n in range(1, total_clips + 1) if n not in recorded]
+    async def _rendering_elsewhere(self, source_video_name):
+        """True while other cluster nodes hold clips of the source and its plan has nothing left for this node."""
+        return bool(self.cog.leases and await self.cog.leases.held_elsewhere(leasing.clip_prefix(source_video_name)) and not await self.planned_clips(source_video_name))
     def _get_pending_clips(self):
         pending = []
-        for source_name, source_data in self.cog.progress.get('source_videos', {}).items():
-            for clip_name, clip_data in source_data.get('clips', {}).items():
-                if clip_data.get('status') == 'pending_upload':
-                    clip_path = os.path.join(utils.PROCESSED_CLIPS_DIR, clip_name)
-                    if os.path.exists(clip_path):
-                        pending.append({'source': source_name, 'clip_name': clip_name, 'path': clip_path})
+        for source_name, clip_name, _ in self.cog.store.clips_with_status('pending_upload'):
+            clip_path = utils.find_clip(clip_name)
+            if os.path.exists(clip_path):
+                pending.append({'source': source_name, 'clip_name': clip_name, 'path': clip_path})
         return pending
     def _parse_clip_number(self, clip_filename: str) -> int | None:
         try:
@@ -95,109 +148,212 @@ class WorkflowManager:
         except (IndexError, ValueError): logging.error(f"Could not parse clip number from: {clip_filename}"); return None
     async def process_pending_uploads(self, pending_clips):
         channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id'])); await channel.send(f"📬 Found **{len(pending_clips)}** clips in the upload queue. Checking daily limit...")
-        max_daily_uploads = self.cog.config['bot']['max_uploads_per_day']; today_utc_str = datetime.now(timezone.utc).strftime('%Y-%m-%d'); quota_data = self.cog.progress.get('quota_tracker', {})
-        uploads_today = quota_data.get('uploads_today', 0) if quota_data.get('date') == today_utc_str else 0
-        uploads_left_today = max_daily_uploads - uploads_today
-        if uploads_left_today <= 0: await channel.send("🚫 Daily upload limit reached for today."); return
-        await channel.send(f"   - Uploading up to **{uploads_left_today}** clips now...")
-        clips_to_upload_now = pending_clips[:uploads_left_today]
-        for item in clips_to_upload_now:
-            clip_number = self._parse_clip_number(item['clip_name'])
-            if clip_number is None: continue
-            await self.upload_clip_task(channel, item['source'], item['path'], clip_number)
+        items = [(item['source'], item['path'], self._parse_clip_number(item['clip_name'])) for item in pending_clips]
+        await uploads.UploadDispatcher(self, channel).run([item for item in items if item[2] is not None])
     async def process_failed_uploads(self, failed_clips):
         channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id'])); await channel.send(f"♻️ Retrying **{len(failed_clips)}** failed uploads...")
+        retries = []
         for clip_filename in failed_clips:
             clip_number = self._parse_clip_number(clip_filename)
             if clip_number is None: continue
             try:
                 base_name = " ".join(Path(clip_filename).stem.split(' part ')[0:-1]); source_video_name = base_name + Path(clip_filename).suffix
-                clip_path = os.path.join(utils.FAILED_UPLOADS_DIR, clip_filename)
-                if source_video_name not in self.cog.progress['source_videos']: continue
-                await self.upload_clip_task(channel, source_video_name, clip_path, clip_number, is_retry=True)
+                # Clip files keep the source's old name after a rename, so follow it to the current record.
+                source_video_name = self.cog.store.resolve_source(source_video_name)
+                if source_video_name: retries.append((source_video_name, os.path.join(utils.FAILED_UPLOADS_DIR, clip_filename), clip_number))
             except Exception as e: logging.error(f"Could not parse failed clip '{clip_filename}': {e}")
+        await uploads.UploadDispatcher(self, channel).run(retries, is_retry=True)
         await channel.send("✅ Re-upload process complete.")
-    async def process_new_video(self, source_video_name): await self.run_full_process(source_video_name, start_clip_index=0)
+    async def process_new_video(self, source_video_name): await self.run_full_process(source_video_name)
     async def resume_in_progress_video(self, source_video_name):
-        channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id'])); video_data = self.cog.progress['source_videos'][source_video_name]
+        channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id']))
+        planned = await self.planned_clips(source_video_name) if self.cog.leases else []
+        if planned:
+            # Render nodes are already working through the plan the user chose; help with the rest instead of asking again.
+            await channel.send(f"▶️ **Continuing `{source_video_name}`**: **{len(planned)}** planned clips are not yet taken by any node.")
+            clip_pipeline = await self.render_clips(channel, source_video_name, planned); await self._finish_batch(channel, source_video_name, clip_pipeline); return
         total_possible = await self.get_total_clips(source_video_name);
         if total_possible is None: return
-        clips_done_count = len(video_data.get('clips', {})); clips_remaining = total_possible - clips_done_count
-        if clips_remaining <= 0: self.cog.progress['source_videos'][source_video_name]['status'] = 'completed'; utils.save_progress(self.cog.progress); return
+        # Clips render in parallel, so a failed clip can leave a gap below clips that finished: resume the missing numbers, not a count.
+        missing = await self.missing_clips(source_video_name, total_possible); clips_done_count = total_possible - len(missing); clips_remaining = len(missing)
+        if clips_remaining <= 0:
+            # Render nodes may have finished the last clips after this node's own batch ended.
+            if self.cog.leases: await self._complete_source(channel, source_video_name)
+            else: self.cog.store.set_source_status(source_video_name, 'completed')
+            return
         await channel.send(f"▶️ **Resuming `{source_video_name}`**.\n> `{clips_done_count}/{total_possible}` done. **{clips_remaining}** remaining.\nHow many **more**?")
         def check(m): return m.channel == channel and (m.content.lower() == 'all' or (m.content.isdigit() and 1 <= int(m.content) <= clips_remaining))
         try:
             msg = await self.bot.wait_for('message', timeout=300.0, check=check); num_to_process = clips_remaining if msg.content.lower() == 'all' else int(msg.content)
-            await self.run_full_process(source_video_name, start_clip_index=clips_done_count, num_to_process=num_to_process)
+            await self.run_full_process(source_video_name, missing[:num_to_process])
         except asyncio.TimeoutError: await channel.send("⏰ Timed out.")
     async def handle_completed_video(self, source_video_name):
         channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id'])); await channel.send(f"⚠️ **Notice:** `{source_video_name}` is fully processed.\n➡️ Reply `reprocess`, `ignore`, or `stop`.")
         def check(m): return m.channel == channel and m.content.lower() in ['reprocess', 'ignore', 'stop']
         try:
             msg = await self.bot.wait_for('message', timeout=300.0, check=check)
-            if msg.content.lower() == 'reprocess': del self.cog.progress['source_videos'][source_video_name]; utils.save_progress(self.cog.progress); await channel.send(f"✅ Records deleted for `{source_video_name}`.")
+            if msg.content.lower() == 'reprocess': self.cog.store.delete_source(source_video_name); await channel.send(f"✅ Records deleted for `{source_video_name}`.")
             elif msg.content.lower() == 'ignore': self.cog.session_ignore_list.add(source_video_name); await channel.send(f"👍 Ignoring `{source_video_name}`.")
             elif msg.content.lower() == 'stop': self.cog.is_manual_processing_running = False; await channel.send("✅ Processing stopped.")
         except asyncio.TimeoutError: await channel.send("⏰ Timed out. Ignoring."); self.cog.session_ignore_list.add(source_video_name)
-    async def create_clip(self, channel, source_video_path, clip_number):
-        progress_message = await channel.send(f"⏳ Preparing clip #{clip_number}...")
-        async def update_progress(p):
-            bar = utils.create_progress_bar(p); print(f"\r-> Creating Clip #{clip_number}: {bar}", end="")
-            try: await progress_message.edit(content=f"⚙️ Creating clip #{clip_number}: `{bar}`")
-            except discord.NotFound: pass
+    async def transcribe_source(self, reporter, source_video_path):
+        """Runs Whisper once over the whole source; clips slice their subtitles out of the result."""
+        if not self.cog.config['subtitles']['enabled']: return None
+        leases = self.cog.leases; resource = leasing.transcript_resource(os.path.basename(source_video_path))
+        # One node transcribes the whole source; the others wait and then read its cached transcript.
+        while leases and not await leases.acquire(resource):
+            reporter.report('transcript', f"⏳ Another node is transcribing `{os.path.basename(source_video_path)}`..."); await leases.wait_released(resource)
+        reporter.report('transcript', f"🎤 Transcribing `{os.path.basename(source_video_path)}`...")
+        try: transcript = await subtitles.transcribe_source(source_video_path, utils.TRANSCRIPTS_DIR)
+        finally:
+            if leases: await leases.release(resource)
+        reporter.report('transcript', "✅ Source transcribed." if transcript is not None else "⚠️ **Could not transcribe the source.** Falling back to per-clip subtitles.")
+        return transcript
+    def _clip_window(self, clip_number):
         clip_duration = self.cog.config['video']['clip_duration_seconds']; overlap = self.cog.config['video']['clip_overlap_seconds']
-        start_time = (clip_number - 1) * (clip_duration - overlap)
-        base_clip_path = await utils.split_video_into_clip_with_progress(source_video_path, clip_number, start_time, clip_duration, progress_callback=update_progress)
-        print();
-        if not base_clip_path: await progress_message.edit(content=f"❌ **Error creating base clip #{clip_number}.**"); return None
-        if self.cog.config['subtitles']['enabled']:
-            subtitles.load_whisper_model(self.cog.config['subtitles']['whisper_model'])
-            await progress_message.edit(content=f"🎤 Generating subtitles...")
-            srt_path = await subtitles.generate_subtitles(base_clip_path)
-            if srt_path:
-                await progress_message.edit(content=f"🔥 Burning subtitles...")
-                final_clip_path = await subtitles.burn_subtitles_into_video(base_clip_path, srt_path, self.cog.config['subtitles']['style'])
-                os.remove(srt_path)
-                if final_clip_path:
-                    await progress_message.edit(content=f"✅ Subtitles added!")
-                    os.remove(base_clip_path)
-                    return final_clip_path
-                else:
-                    await progress_message.edit(content=f"❌ **Error burning subtitles.** Clip will be unsubtitled.")
-                    return base_clip_path
-            else: await progress_message.edit(content=f"⚠️ **Could not generate subtitles.**")
+        return (clip_number - 1) * (clip_duration - overlap), clip_duration
+    def _fused_burn_enabled(self, transcript):
+        return transcript is not None and self.cog.config['subtitles']['enabled'] and self.cog.config['subtitles'].get('render_mode', 'ffmpeg') == 'ffmpeg'
+    def _prepare_subtitle_filter(self, source_video_path, clip_number, transcript):
+        """Writes the clip's ASS track and returns (ffmpeg filter, ass path), or (None, None) when the clip has no speech."""
+        start_time, clip_duration = self._clip_window(clip_number); clip_words = subtitles.slice_words(transcript, start_time, clip_duration)
+        if not clip_words: return None, None
+        safe_stem = ''.join(c if c.isalnum() or c in '-_' else '_' for c in Path(source_video_path).stem)
+        ass_path = os.path.join(utils.clip_work_dir(), f"{safe_stem}_part{clip_number}.ass"); style_config = self.cog.config['subtitles']
+        subtitles.write_ass(clip_words, ass_path, Path(style_config['font_filename']).stem, style_config['style'])
+        return subtitles.ffmpeg_subtitle_filter(ass_path, utils.FONTS_DIR), ass_path
+    async def batch_split_clips(self, reporter, source_video_path, clip_numbers, transcript=None, clips_to_render=None):
+        """Pre-splits clips with one decode per batch; the split stage then finds the base clips already on disk."""
+        batch_size = max(1, int(self.cog.config['video'].get('batch_split_size', 8))); media_info = await self.cog.media.get(source_video_path)
+        for offset in range(0, len(clip_numbers), batch_size):
+            batch = clip_numbers[offset:offset + batch_size]; percentages = {n: 0.0 for n in batch}; subtitle_filters = {}; ass_paths = []
+            if self._fused_burn_enabled(transcript):
+                for n in batch:
+                    subtitle_filter, ass_path = self._prepare_subtitle_filter(source_video_path, n, transcript)
+                    if subtitle_filter: subtitle_filters[n] = subtitle_filter; ass_paths.append(ass_path)
+            for n in batch: reporter.report(f"#{n}", f"⏳ Clip #{n}: waiting to split...")
+            preset, crf = self._choose_encoding((clips_to_render or len(clip_numbers)) - offset)
+            async def update_progress(clip_number, p): reporter.report(f"#{clip_number}", f"⚙️ Splitting clip #{clip_number} ({preset}): `{utils.create_progress_bar(p)}`")
+            results = await utils.split_video_into_clips_batch(source_video_path, [(n, *self._clip_window(n)) for n in batch], progress_callback=update_progress, threads=self._encoder_threads(), subtitle_filters=subtitle_filters,
+                                                               has_audio=media_info['audio_streams'] > 0 if media_info else None, preset=preset, crf=crf, on_encoded=self._encode_recorder(preset))
+            for ass_path in ass_paths:
+                if os.path.exists(ass_path): os.remove(ass_path)
+            if not all(results.values()): reporter.report('batch', f"⚠️ **Batch split failed for clips #{batch[0]}-#{batch[-1]}.** Falling back to one clip at a time.")
+    def _encoder_threads(self, stage='split'): return supervisor.SUPERVISOR.threads(stage, int(self.cog.config['video'].get('encoder_threads', 4)))
+    def _choose_encoding(self, clips_to_render):
+        return self.cog.encoding.choose(clips_to_render, self.cog.config['video']['clip_duration_seconds'], self._max_parallel_clips())
+    def _encode_recorder(self, preset): return lambda media_seconds, wall_seconds: self.cog.encoding.record(preset, media_seconds, wall_seconds)
+    def _max_parallel_clips(self):
+        configured = int(self.cog.config['video'].get('max_parallel_clips', 0))
+        return configured if configured > 0 else max(1, (os.cpu_count() or 1) // max(1, self._encoder_threads()))
+    async def split_clip(self, reporter, source_video_path, clip_number, transcript=None, clips_to_render=1):
+        """Split stage. Returns (clip path, subtitles already burned) or (None, False) when FFmpeg fails."""
+        key = f"#{clip_number}"; reporter.report(key, f"⏳ Preparing clip #{clip_number}...")
+        preset, crf = self._choose_encoding(clips_to_render); encode_options = {'preset': preset, 'crf': crf, 'on_encoded': self._encode_recorder(preset)}
+        async def update_progress(p): reporter.report(key, f"⚙️ Creating clip #{clip_number} ({preset}): `{utils.create_progress_bar(p)}`")
+        start_time, clip_duration = self._clip_window(clip_number); subtitle_filter = None
+        if self._fused_burn_enabled(transcript):
+            fused_clip_path = utils.get_clip_output_path(source_video_path, clip_number, subtitled=True)
+            if os.path.exists(fused_clip_path): reporter.report(key, f"✅ Clip #{clip_number} is ready."); return fused_clip_path, True
+            subtitle_filter, ass_path = self._prepare_subtitle_filter(source_video_path, clip_number, transcript)
+        if subtitle_filter:
+            # Subtitles are burned by the same encode that crops and scales the clip.
+            fused_clip_path = await utils.split_video_into_clip_with_progress(source_video_path, clip_number, start_time, clip_duration, progress_callback=update_progress, threads=self._encoder_threads(), subtitle_filter=subtitle_filter, **encode_options)
+            os.remove(ass_path)
+            if fused_clip_path: reporter.report(key, f"✅ Clip #{clip_number}: subtitles added!"); return fused_clip_path, True
+            reporter.report(key, f"⚠️ Clip #{clip_number}: **FFmpeg subtitle burn failed.** Falling back to MoviePy...")
+        base_clip_path = await utils.split_video_into_clip_with_progress(source_video_path, clip_number, start_time, clip_duration, progress_callback=update_progress, threads=self._encoder_threads(), **encode_options)
+        if not base_clip_path: reporter.report(key, f"❌ **Error creating base clip #{clip_number}.**"); return None, False
+        if not self.cog.config['subtitles']['enabled']: reporter.report(key, f"✅ Clip #{clip_number} is ready.")
+        return base_clip_path, False
+    async def subtitle_clip(self, reporter, source_video_path, clip_number, base_clip_path, transcript=None):
+        """Subtitle stage. Returns the clip's .srt path, or None when there is nothing to burn."""
+        key = f"#{clip_number}"; start_time, clip_duration = self._clip_window(clip_number)
+        if transcript is not None:
+            srt_path = subtitles.generate_clip_subtitles(subtitles.slice_words(transcript, start_time, clip_duration), base_clip_path)
+            if not srt_path: reporter.report(key, f"✅ Clip #{clip_number} has no speech to subtitle.")
+            return srt_path
+        reporter.report(key, f"🎤 Clip #{clip_number}: generating subtitles...")
+        srt_path = await subtitles.generate_subtitles(base_clip_path, source_video_path, start_time, clip_duration)
+        if not srt_path: reporter.report(key, f"⚠️ Clip #{clip_number}: **Could not generate subtitles.**")
+        return srt_path
+    async def burn_clip(self, reporter, clip_number, base_clip_path, srt_path):
+        """MoviePy burn stage. Returns the subtitled clip, or the base clip if burning fails."""
+        key = f"#{clip_number}"; reporter.report(key, f"🔥 Clip #{clip_number}: burning subtitles...")
+        font_path = subtitles.resolve_font(self.cog.config['subtitles']['font_filename'], utils.FONTS_DIR)
+        preset, crf = self.cog.encoding.current
+        final_clip_path = await subtitles.burn_subtitles_into_video(base_clip_path, srt_path, font_path, self.cog.config['subtitles']['style'], threads=self._encoder_threads('burn'), preset=preset, crf=crf)
+        os.remove(srt_path)
+        if final_clip_path:
+            reporter.report(key, f"✅ Clip #{clip_number}: subtitles added!")
+            os.remove(base_clip_path)
+            return final_clip_path
+        reporter.report(key, f"❌ Clip #{clip_number}: **Error burning subtitles.** Clip will be unsubtitled.")
         return base_clip_path
-    async def run_full_process(self, source_video_name, start_clip_index=0, num_to_process=None):
+    async def run_full_process(self, source_video_name, clip_numbers=None):
+        """Renders `clip_numbers` of an in-progress source, or (None) asks how many clips of a new source to make and sets it up."""
         channel = self.bot.get_channel(int(self.cog.config['bot']['channel_id'])); source_video_path = os.path.join(utils.INPUT_VIDEOS_DIR, source_video_name)
-        if num_to_process is None:
+        new_source = clip_numbers is None
+        if new_source:
             _, num_to_process = await self.prompt_for_clips(channel, source_video_path)
             if num_to_process is None: return
-        if self.is_online and start_clip_index == 0:
+            clip_numbers = list(range(1, num_to_process + 1))
+        if self.is_online and new_source:
             playlist_title = Path(source_video_name).stem.replace('_', ' ').replace('.', ' ').title()
+            if not self.cog.quota.admit('playlist_insert'): await channel.send("🚫 Not enough API quota left today to create the playlist. Try again after the reset."); return
             playlist_id = await helpers.create_youtube_playlist(self.cog.youtube, playlist_title)
+            self.cog.quota.charge('playlist_insert'); await self.cog._post_quota_notice()
             if not playlist_id: await channel.send("❌ Failed to create playlist."); return
-            await self.cog._log_quota_usage('playlist_insert')
-            self.cog.progress['source_videos'][source_video_name] = {'status': 'processing', 'playlist_id': playlist_id, 'clips': {}}
-            utils.save_progress(self.cog.progress)
-        await channel.send(f"⚙️ Starting processing of **{num_to_process}** clips...")
-        for i in range(start_clip_index, start_clip_index + num_to_process):
-            clip_number = i + 1; clip_path = await self.create_clip(channel, source_video_path, clip_number)
-            if clip_path:
-                clip_filename = os.path.basename(clip_path)
-                self.cog.progress['source_videos'][source_video_name]['clips'][clip_filename] = {'status': 'pending_upload', 'created_at': datetime.now(timezone.utc).isoformat()}
-            else:
-                self.cog.progress['source_videos'][source_video_name]['status'] = 'failed_split'; break
-        utils.save_progress(self.cog.progress)
-        await channel.send(f"✅ Batch processing complete! **{num_to_process}** clips added to upload queue.")
+            self.cog.store.add_source(source_video_name, 'processing', playlist_id)
+        elif new_source: self.cog.store.add_source(source_video_name, 'processing')
+        if new_source and self.cog.sources: await self.cog.sources.register(source_video_name)
+        # The plan lets render nodes (see worker.py) share these clips without being asked on Discord. Clips inside its
+        # range that were not asked for are already recorded, and planned_clips() skips recorded clips.
+        self.cog.store.update_source_data(source_video_name, plan=[min(clip_numbers), max(clip_numbers)])
+        await channel.send(f"⚙️ Starting processing of **{len(clip_numbers)}** clips...")
+        clip_pipeline = await self.render_clips(channel, source_video_name, clip_numbers)
+        await self._finish_batch(channel, source_video_name, clip_pipeline)
+    async def render_clips(self, channel, source_video_name, clip_numbers):
+        """Transcribes the source and streams `clip_numbers` (plus clips a previous run left mid-pipeline) through the clip
+        pipeline. `channel` may be None on a headless render node. Returns the finished pipeline."""
+        source_video_path = os.path.join(utils.INPUT_VIDEOS_DIR, source_video_name)
+        reporter = await ProgressReporter(channel, f"⚙️ **Processing `{source_video_name}`**", self.cog.config['bot'].get('progress_update_interval_seconds', 3)).start(); clip_pipeline = None
+        try:
+            transcript = await self.transcribe_source(reporter, source_video_path)
+            clip_pipeline = ClipPipeline(self, reporter, channel, source_video_name, source_video_path, transcript); self.active_pipelines.add(clip_pipeline)
+            # A !stop that arrived during transcription still stops the clips.
+            if self.stop_requested: clip_pipeline.cancel()
+            resumable, resplit = await clip_pipeline.resume_items(); clip_numbers = sorted(set(clip_numbers) | set(resplit))
+            if (resumable or resplit) and channel: await channel.send(f"⏯️ Resuming **{len(resumable) + len(resplit)}** clips left mid-pipeline by the last run.")
+            results = await clip_pipeline.run(clip_numbers, resumable)
+        finally: await reporter.close(); self.active_pipelines.discard(clip_pipeline)
+        # A render node's failed clip has no record and its lease is released, so any node leases and renders it again;
+        # only a single node stops the source until someone looks at it.
+        if None in results.values() and not self.cog.leases: self.cog.store.set_source_status(source_video_name, 'failed_split')
+        return clip_pipeline
+    async def _finish_batch(self, channel, source_video_name, clip_pipeline):
+        rendered = sum(1 for path in clip_pipeline.results.values() if path)
+        if clip_pipeline.stopped: await channel.send(f"⏹️ **Stopped.** **{rendered}** clips rendered; unfinished clips of `{source_video_name}` resume on the next run."); return
+        await channel.send(f"✅ Batch processing complete! **{rendered}** clips rendered, **{clip_pipeline.uploaded}** uploaded, **{clip_pipeline.parked}** waiting in the upload queue.")
         total_possible = await self.get_total_clips(source_video_name)
-        if total_possible and len(self.cog.progress['source_videos'][source_video_name]['clips']) >= total_possible:
-            if self.is_online: self.cog.progress['source_videos'][source_video_name]['status'] = 'completed'
-            shutil.move(source_video_path, os.path.join(utils.PROCESSED_VIDEOS_DIR, source_video_name))
-            await channel.send(f"✅ **All processing for `{source_video_name}` is complete!**")
+        elsewhere = await self.cog.leases.held_elsewhere(leasing.clip_prefix(source_video_name)) if self.cog.leases else set()
+        if elsewhere: await channel.send(f"🛰️ **{len(elsewhere)}** clips of `{source_video_name}` are still rendering on other nodes.")
+        elif total_possible and await self._db(self.cog.store.count_clips, source_video_name) >= total_possible: await self._complete_source(channel, source_video_name)
         else: await channel.send(f"✅ Batch complete. `{source_video_name}` remains in progress.")
-        utils.save_progress(self.cog.progress)
+    async def _complete_source(self, channel, source_video_name):
+        source_video_path = os.path.join(utils.INPUT_VIDEOS_DIR, source_video_name)
+        if self.is_online: await self._db(self.cog.store.set_source_status, source_video_name, 'completed')
+        if subtitles.AUDIO_STORE: subtitles.AUDIO_STORE.discard(source_video_path)
+        shutil.move(source_video_path, os.path.join(utils.PROCESSED_VIDEOS_DIR, source_video_name))
+        await channel.send(f"✅ **All processing for `{source_video_name}` is complete!**")
+    async def render_planned_clips(self, source_video_name):
+        """Render-node entry point: renders the part of the source's plan no node has taken yet. Returns how many clips it rendered."""
+        planned = await self.planned_clips(source_video_name)
+        if not planned or not os.path.exists(os.path.join(utils.INPUT_VIDEOS_DIR, source_video_name)): return 0
+        clip_pipeline = await self.render_clips(None, source_video_name, planned)
+        return sum(1 for path in clip_pipeline.results.values() if path)
     async def get_total_clips(self, source_video_name):
-        source_video_path = os.path.join(utils.INPUT_VIDEOS_DIR, source_video_name); duration = await asyncio.to_thread(utils.get_video_duration, source_video_path)
+        source_video_path = os.path.join(utils.INPUT_VIDEOS_DIR, source_video_name); duration = await self.cog.media.duration(source_video_path)
         if not duration:
             logging.error(f"🚨 Unreadable file: '{source_video_name}'."); quarantine_path = os.path.join(utils.QUARANTINED_VIDEOS_DIR, source_video_name)
             shutil.move(source_video_path, quarantine_path); logging.info(f"   -> Moved to quarantine.")